@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': "Gestionnaire de file d'attente",
-    'version': '19.0.2.9.0',
+    'version': '19.0.2.10.0',
     'category': 'Services',
     'summary': "File d'attente virtuelle multi-établissements (hôpitaux, services, administrations)",
     'description': """
@@ -35,6 +35,7 @@ d'attente & statistiques (Phase 5).
     'author': 'odoo_nineteen',
     'depends': [
         'base',
+        'bus',
         'mail',
         'queue_payment',
         # 'push_notification_hub' : dépendance VOLONTAIREMENT souple (non listée).
@@ -6,9 +6,11 @@
   ``queue_management.app_store_url`` est défini (passage au Play Store), la
   page redirige vers le store sans qu'aucun QR imprimé ne devienne obsolète.
 * ``GET /queue/app/download`` : binaire APK de la version publiée,
-  rate-limité par IP.
+  rate-limité par IP. Servi en flux depuis le filestore (jamais chargé ni
+  décodé en mémoire) avec ``Range``/206 pour reprendre un téléchargement
+  interrompu sur réseau mobile, et ``ETag`` = SHA-256 de l'APK (304 sur
+  ``If-None-Match``).
 """
-import base64
 import logging
 
 from odoo import http
@@ -33,7 +35,8 @@ class QueueAppDownloadController(http.Controller):
         if store_url:
             return request.redirect(store_url, code=302, local=False)
         release = Release._get_published()
-        if not release or not release.apk_file:
+        # ``bin_size`` : tester la présence du fichier sans lire l'APK.
+        if not release or not release.with_context(bin_size=True).apk_file:
             return request.not_found()
         return secure_public_page(request.render(
             'queue_management.app_landing_page', {'release': release}))
@@ -45,7 +48,7 @@ class QueueAppDownloadController(http.Controller):
               .split(',')[0].strip() or request.httprequest.remote_addr
               or 'unknown')
         limited, retry_after = request.env['queue.rate.limit'].sudo(
-        ).check_and_record(f"queue_apk_dl:{ip}", **_RL_APK_DOWNLOAD)
+        ).check(f"queue_apk_dl:{ip}", **_RL_APK_DOWNLOAD)
         if limited:
             return request.make_response(
                 "Trop de téléchargements depuis cette adresse. Réessayez plus tard.",
@@ -54,21 +57,36 @@ class QueueAppDownloadController(http.Controller):
                 status=429)
 
         release = request.env['queue.app.release'].sudo()._get_published()
-        if not release or not release.apk_file:
+        if not release or not release.with_context(bin_size=True).apk_file:
             return request.not_found()
+        filename = (release.apk_file_name
+                    or 'queue_mobile-v%s.apk' % (release.version or '0'))
         try:
-            data = base64.b64decode(release.apk_file)
+            stream = request.env['ir.binary']._get_stream_from(
+                release, 'apk_file', filename=filename,
+                mimetype='application/vnd.android.package-archive')
         except Exception:
             _logger.exception("APK release %s : binaire illisible", release.id)
             return request.not_found()
-        release.increment_download()
-        filename = (release.apk_file_name
-                    or 'queue_mobile-v%s.apk' % (release.version or '0'))
-        return request.make_response(data, headers=[
-            ('Content-Type', 'application/vnd.android.package-archive'),
-            ('Content-Disposition',
-             'attachment; filename="%s"' % filename.replace('"', '')),
-            ('Content-Length', str(len(data))),
-            ('X-Content-Type-Options', 'nosniff'),
-            ('Cache-Control', 'public, max-age=3600'),
-        ])
+        if release.apk_sha256:
+            stream.etag = release.apk_sha256
+        stream.public = True
+        stream.max_age = 3600
+        # ``conditional`` (par défaut) : werkzeug traite Range/If-Range (206)
+        # et If-None-Match (304) et lit le fichier par blocs.
+        response = stream.get_response(as_attachment=True)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        if self._is_new_download(response):
+            release.increment_download()
+        return response
+
+    @staticmethod
+    def _is_new_download(response):
+        """Compte un téléchargement complet ou son premier morceau ; pas une
+        reprise (Range au-delà de l'octet 0) ni un 304."""
+        if response.status_code == 200:
+            return True
+        if response.status_code != 206:
+            return False
+        content_range = response.headers.get('Content-Range', '')
+        return content_range.startswith('bytes 0-')
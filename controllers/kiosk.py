@@ -58,7 +58,7 @@ class QueueKioskController(http.Controller):
               .split(',')[0].strip() or request.httprequest.remote_addr
               or 'unknown')
         limited, _retry = request.env['queue.rate.limit'].sudo(
-        ).check_and_record(f"queue_kiosk:{ip}", **_RL_KIOSK_TICKET)
+        ).check(f"queue_kiosk:{ip}", **_RL_KIOSK_TICKET)
         if limited:
             return secure_public_page(request.make_response(
                 json.dumps({'status': 'error',
@@ -2,6 +2,7 @@
 import json
 
 from odoo import fields, http
+from odoo.addons.bus.websocket import WebsocketConnectionHandler
 from odoo.http import request
 
 # Défense en profondeur des pages publiques (borne, affichage) : elles sont
@@ -19,10 +20,20 @@ PUBLIC_PAGE_HEADERS = [
 ]
 
 
-def secure_public_page(response):
-    """Pose les en-têtes de sécurité sur une réponse de page publique."""
+def secure_public_page(response, websocket=False):
+    """Pose les en-têtes de sécurité sur une réponse de page publique.
+
+    ``websocket`` : la page s'abonne au bus d'Odoo ; sa CSP autorise alors la
+    connexion au websocket du même hôte (``'self'`` ne couvre pas ``ws:``
+    partout).
+    """
     for key, value in PUBLIC_PAGE_HEADERS:
         response.headers[key] = value
+    if websocket:
+        scheme = 'wss' if request.httprequest.scheme == 'https' else 'ws'
+        response.headers['Content-Security-Policy'] = PUBLIC_PAGE_CSP.replace(
+            "connect-src 'self'",
+            "connect-src 'self' %s://%s" % (scheme, request.httprequest.host))
     return response
 
 
@@ -58,13 +69,14 @@ class QueueDisplayController(http.Controller):
                 'called': bool(shown and shown.state == 'called'),
             })
 
-        waiting = location.service_ids.mapped('ticket_ids').filtered(
-            lambda t: t.state == 'waiting')
+        # Les 6 prochains, toutes files du site : requête indexée bornée, sans
+        # charger l'historique des tickets.
         upcoming = [
             {'ticket': t.name, 'service': t.service_id.name}
-            for t in waiting.sorted(key=lambda t: t._scheduling_key())[:6]
+            for t in location.service_ids._get_waiting_heads(limit=6)
         ]
-        # Attente par service (petit récap sous les appels).
+        # Attente par service (petit récap sous les appels) — compteurs tenus
+        # à jour par incréments, sans lire les tickets.
         services = [
             {'name': s.name, 'waiting': s.waiting_count}
             for s in location.service_ids.filtered('active')
@@ -78,6 +90,7 @@ class QueueDisplayController(http.Controller):
             default=False)
         return {
             'location': location.name,
+            'version': location.display_version,
             'now_serving': now_serving,
             'upcoming': upcoming,
             'services': services,
@@ -95,17 +108,38 @@ class QueueDisplayController(http.Controller):
         location = self._get_location(token)
         if not location:
             return request.not_found()
+        # Temps réel par le bus : l'écran s'abonne au canal de son site et
+        # relit /data (requête conditionnelle) à chaque changement publié.
         return secure_public_page(request.render('queue_management.display_page', {
             'data': self._display_data(location),
             'app_qr': self._app_qr_src(),
-        }))
+            'bus_channel': location._display_bus_channel(),
+            'bus_url': '/websocket?version=%s' % WebsocketConnectionHandler._VERSION,
+        }), websocket=True)
+
+    @staticmethod
+    def _display_etag(location):
+        """ETag (sans guillemets) de l'état affiché : site + version."""
+        return '%s-%s' % (location.id, location.display_version)
+
+    def _data_response(self, location):
+        etag = self._display_etag(location)
+        return secure_public_page(request.make_response(
+            json.dumps(self._display_data(location)),
+            headers=[('Content-Type', 'application/json; charset=utf-8'),
+                     ('ETag', '"%s"' % etag), ('Cache-Control', 'no-cache')],
+        ))
 
     @http.route('/queue/display/<string:token>/data', type='http', auth='public', sitemap=False)
     def display_data(self, token, **kw):
         location = self._get_location(token)
         if not location:
             return request.not_found()
-        return secure_public_page(request.make_response(
-            json.dumps(self._display_data(location)),
-            headers=[('Content-Type', 'application/json; charset=utf-8')],
-        ))
+        etag = self._display_etag(location)
+        # Rien n'a bougé depuis le dernier rafraîchissement de l'écran : 304
+        # sans lire un seul ticket.
+        if request.httprequest.if_none_match.contains(etag):
+            return secure_public_page(request.make_response(
+                '', status=304,
+                headers=[('ETag', '"%s"' % etag), ('Cache-Control', 'no-cache')]))
+        return self._data_response(location)
@@ -2,10 +2,13 @@
 import base64
 import json
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 
 from odoo import _, http, fields
-from odoo.exceptions import UserError
+from odoo.exceptions import AccessError, UserError
 from odoo.http import request
 from odoo.tools import email_normalize
 
@@ -25,6 +28,69 @@ _RL_OTP_VERIFY = dict(max_requests=60, window_seconds=300, block_seconds=300)
 # guichets à la fois : au-delà, c'est un abus.
 _MAX_ACTIVE_TICKETS = 5
 
+# Fenêtre maximale de /api/queue/slots/range (un mois de calendrier).
+_SLOTS_RANGE_MAX_DAYS = 31
+
+# /api/queue/batch : opérations autorisées (nom → méthode) et taille maximale
+# d'un lot. L'authentification OTP, le paiement et le webhook restent hors lot.
+_BATCH_OPS = {
+    'site': 'site',
+    'tickets': 'my_tickets',
+    'ticket/status': 'ticket_status',
+    'ticket/create': 'ticket_create',
+    'ticket/cancel': 'ticket_cancel',
+    'ticket/checkin': 'ticket_checkin',
+    'slots': 'slots',
+    'slots/range': 'slots_range',
+    'appointment/book': 'appointment_book',
+    'sync': 'sync',
+}
+_BATCH_MAX_OPS = 10
+_CUSTOMER_CACHE_KEY = 'queue_management.api_customer'
+
+
+def _wave(ticket):
+    return ticket.env['queue.wave.mixin'].sudo()
+
+
+# Champs de ``_ticket_data`` (nom → lecture), dans l'ordre de la réponse.
+# ``position`` (rang dans la file), ``eta_minutes`` (rang + durée moyenne
+# récente) et les deux ``wave_*`` (paramètres système) sont les coûteux.
+_TICKET_FIELDS = {
+    'name': lambda t: t.name if t.name != '/' else '',
+    'state': lambda t: t.state,
+    'position': lambda t: t.position,
+    'service': lambda t: t.service_id.name,
+    'site': lambda t: t.location_id.name,
+    'counter': lambda t: t.counter_id.name or '',
+    'channel': lambda t: t.channel,
+    'scheduled_time': lambda t: (fields.Datetime.to_string(t.scheduled_time)
+                                 if t.scheduled_time else ''),
+    'eta_minutes': lambda t: t.eta_minutes,
+    'payment_state': lambda t: t.payment_state,
+    'payment_amount': lambda t: t.payment_amount,
+    'currency': lambda t: t.currency_id.symbol or t.currency_id.name or '',
+    'payment_method': lambda t: t.payment_method or '',
+    'wave_direct': lambda t: _wave(t)._wave_api_configured(),
+    'wave_merchant': lambda t: _wave(t)._wave_merchant_label(),
+}
+
+# Temps passé par champ dans CE worker : nom → [appels, secondes].
+_ticket_field_timings = {}
+_ticket_field_lock = threading.Lock()
+
+
+def ticket_field_stats():
+    """Compteurs par champ de ``_ticket_data`` (supervision) : appels, temps
+    total et moyen en millisecondes, du plus coûteux au moins coûteux."""
+    with _ticket_field_lock:
+        rows = {name: tuple(stats) for name, stats in _ticket_field_timings.items()}
+    return dict(sorted(
+        ((name, {'calls': calls, 'total_ms': round(seconds * 1000, 3),
+                 'avg_ms': round(seconds * 1000 / calls, 3) if calls else 0.0})
+         for name, (calls, seconds) in rows.items()),
+        key=lambda item: item[1]['total_ms'], reverse=True))
+
 
 class QueueMobileApi(http.Controller):
     """API REST de l'application mobile client (Phase 2).
@@ -72,7 +138,7 @@ class QueueMobileApi(http.Controller):
 
     def _rate_limited(self, scope, max_requests, window_seconds, block_seconds):
         """Renvoie une réponse d'erreur si l'IP appelante dépasse la limite."""
-        limited, retry_after = request.env['queue.rate.limit'].sudo().check_and_record(
+        limited, retry_after = request.env['queue.rate.limit'].sudo().check(
             f"{scope}:{self._client_ip()}",
             max_requests, window_seconds, block_seconds,
         )
@@ -91,38 +157,41 @@ class QueueMobileApi(http.Controller):
                 token = header[7:].strip()
         if not token:
             return False
-        Customer = request.env['queue.customer'].sudo()
-        # Seul le hash du jeton est stocké : on compare hash à hash.
-        customer = Customer.search(
-            [('token', '=', Customer._hash(token)), ('active', '=', True)],
-            limit=1)
-        if not customer:
-            return False
-        if customer.token_expiry and fields.Datetime.now() > customer.token_expiry:
-            return False  # session expirée : l'app doit se reconnecter par OTP
-        return customer
+        # Résolu une fois par requête (``/api/queue/batch`` enchaîne plusieurs
+        # opérations), puis cache de sessions par worker (cf.
+        # ``queue.customer._from_token``).
+        resolved = self._customer_memo()
+        if token not in resolved:
+            resolved[token] = (
+                request.env['queue.customer'].sudo()._from_token(token) or False)
+        return resolved[token]
 
     @staticmethod
-    def _ticket_data(ticket):
-        return {
-            'id': ticket.id,
-            'name': ticket.name if ticket.name != '/' else '',
-            'state': ticket.state,
-            'position': ticket.position,
-            'service': ticket.service_id.name,
-            'site': ticket.location_id.name,
-            'counter': ticket.counter_id.name or '',
-            'channel': ticket.channel,
-            'scheduled_time': fields.Datetime.to_string(ticket.scheduled_time)
-            if ticket.scheduled_time else '',
-            'eta_minutes': ticket.eta_minutes,
-            'payment_state': ticket.payment_state,
-            'payment_amount': ticket.payment_amount,
-            'currency': ticket.currency_id.symbol or ticket.currency_id.name or '',
-            'payment_method': ticket.payment_method or '',
-            'wave_direct': ticket.env['queue.wave.mixin'].sudo()._wave_api_configured(),
-            'wave_merchant': ticket.env['queue.wave.mixin'].sudo()._wave_merchant_label(),
-        }
+    def _ticket_data(ticket, only=None):
+        """Représentation API d'un ticket.
+
+        ``only`` (paramètre ``fields`` des routes ticket : ``"state,position"``
+        ou liste) restreint la réponse aux champs demandés, ``id`` toujours
+        inclus. Les champs coûteux (rang, attente estimée, configuration Wave)
+        ne sont alors calculés que s'ils sont demandés. Chaque champ calculé
+        alimente les compteurs de ``ticket_field_stats``.
+        """
+        if isinstance(only, str):
+            only = [name.strip() for name in only.split(',')]
+        names = ([name for name in _TICKET_FIELDS if name in set(only)]
+                 if only else list(_TICKET_FIELDS))
+        data = {'id': ticket.id}
+        spent = {}
+        for name in names:
+            start = time.perf_counter()
+            data[name] = _TICKET_FIELDS[name](ticket)
+            spent[name] = time.perf_counter() - start
+        with _ticket_field_lock:
+            for name, seconds in spent.items():
+                stats = _ticket_field_timings.setdefault(name, [0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+        return data
 
     # --- Authentification par email (OTP) ------------------------------------
 
@@ -263,7 +332,7 @@ class QueueMobileApi(http.Controller):
             ('state', 'in', ('waiting', 'called', 'serving')),
         ], limit=1)
         if existing:
-            return self._ok(ticket=self._ticket_data(existing),
+            return self._ok(ticket=self._ticket_data(existing, kw.get('fields')),
                             message=_("Vous avez déjà un ticket pour ce service."))
         if self._active_quota_reached(customer.partner_id):
             return self._err(_(
@@ -272,9 +341,10 @@ class QueueMobileApi(http.Controller):
         ticket = request.env['queue.ticket'].sudo().create({
             'service_id': service.id,
             'partner_id': customer.partner_id.id,
+            'customer_id': customer.id,
             'channel': 'remote' if remote else 'mobile',
         })
-        return self._ok(ticket=self._ticket_data(ticket))
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
 
     @http.route('/api/queue/ticket/status', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
@@ -285,7 +355,7 @@ class QueueMobileApi(http.Controller):
         ticket = request.env['queue.ticket'].sudo().browse(int(kw.get('ticket_id') or 0))
         if not ticket.exists() or ticket.partner_id != customer.partner_id:
             return self._err(_("Ticket introuvable."))
-        return self._ok(ticket=self._ticket_data(ticket))
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
 
     @http.route('/api/queue/ticket/cancel', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
@@ -299,7 +369,7 @@ class QueueMobileApi(http.Controller):
         if ticket.state not in ('scheduled', 'waiting', 'called'):
             return self._err(_("Ce ticket ne peut plus être annulé."))
         ticket.action_cancel()
-        return self._ok(ticket=self._ticket_data(ticket))
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
 
     @http.route('/api/queue/tickets', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
@@ -311,7 +381,106 @@ class QueueMobileApi(http.Controller):
             ('partner_id', '=', customer.partner_id.id),
             ('state', 'in', ('scheduled', 'waiting', 'called', 'serving')),
         ])
-        return self._ok(tickets=[self._ticket_data(t) for t in tickets])
+        return self._ok(tickets=[self._ticket_data(t, kw.get('fields')) for t in tickets])
+
+    @staticmethod
+    def _parse_sync_version(version):
+        """Relit la version opaque de ``/api/queue/sync`` (illisible → vide)."""
+        try:
+            seen = json.loads(version or '{}')
+            return (
+                {int(k): int(v) for k, v in seen.get('sites', {}).items()},
+                {int(k): v for k, v in seen.get('tickets', {}).items()},
+            )
+        except (TypeError, ValueError, AttributeError):
+            return {}, {}
+
+    @http.route('/api/queue/sync', type='jsonrpc', auth='public',
+                methods=['POST'], csrf=False)
+    def sync(self, **kw):
+        """Rafraîchissement groupé des tickets du client : seulement ce qui a
+        bougé depuis ``version`` (valeur opaque renvoyée par l'appel précédent).
+
+        Si aucun site suivi n'a changé (``display_version``), le diff est vide
+        après une seule requête de version. Sinon : ``changed`` (tickets
+        nouveaux ou dont l'état, le rang ou l'attente estimée ont changé) et
+        ``removed`` (tickets qui ne sont plus actifs).
+        """
+        customer = self._get_customer(kw)
+        if not customer:
+            return self._err(_("Non authentifié."), code='auth_required')
+        seen_sites, seen_tickets = self._parse_sync_version(kw.get('version'))
+        sites = customer._site_versions(seen_sites)
+        if kw.get('version') and sites == seen_sites:
+            return self._ok(version=kw['version'], changed=[], removed=[])
+        tickets = request.env['queue.ticket'].sudo().search([
+            ('customer_id', '=', customer.id),
+            ('state', 'in', ('scheduled', 'waiting', 'called', 'serving')),
+        ])
+        marks = {t.id: [t.state, t.position, t.eta_minutes] for t in tickets}
+        version = json.dumps({
+            'sites': {loc: ver for loc, ver in sites.items()
+                      if loc in tickets.location_id.ids},
+            'tickets': marks,
+        }, separators=(',', ':'))
+        return self._ok(
+            version=version,
+            changed=[self._ticket_data(t, kw.get('fields')) for t in tickets
+                     if seen_tickets.get(t.id) != marks[t.id]],
+            removed=sorted(set(seen_tickets) - set(marks)),
+        )
+
+    @http.route('/api/queue/batch', type='jsonrpc', auth='public',
+                methods=['POST'], csrf=False)
+    def batch(self, **kw):
+        """Plusieurs opérations de l'API en un aller-retour (réseaux mobiles
+        lents) : ``ops = [{'op': 'site', 'params': {...}}, …]``.
+
+        Un seul curseur, client résolu une seule fois (``auth_token`` commun,
+        repris par chaque opération qui n'en fournit pas). Chaque opération
+        tourne dans son savepoint : une erreur métier n'annule que la sienne,
+        client mémorisé compris (cf. ``_customer_memo``).
+        ``results`` suit l'ordre de ``ops``, chaque entrée dans l'enveloppe
+        habituelle (``status``/``success``…) plus l'écho ``op``/``id``.
+        """
+        ops = kw.get('ops')
+        if not isinstance(ops, list) or not ops:
+            return self._err(_("Aucune opération."), code='bad_request')
+        if len(ops) > _BATCH_MAX_OPS:
+            return self._err(_("Au plus %s opérations par lot.", _BATCH_MAX_OPS),
+                             code='bad_request')
+        results = []
+        for entry in ops:
+            entry = entry if isinstance(entry, dict) else {}
+            name = entry.get('op')
+            method = _BATCH_OPS.get(name)
+            if not method:
+                result = self._err(_("Opération inconnue."), code='bad_request')
+            else:
+                params = dict(entry.get('params') or {})
+                if kw.get('auth_token'):
+                    params.setdefault('auth_token', kw['auth_token'])
+                memo = dict(self._customer_memo())
+                try:
+                    with request.env.cr.savepoint():
+                        result = getattr(self, method)(**params)
+                except UserError as exc:
+                    resolved = self._customer_memo()
+                    resolved.clear()
+                    resolved.update(memo)
+                    result = self._err(exc.args[0] if exc.args
+                                       else _("Opération impossible."))
+            results.append(dict(result, op=name, id=entry.get('id')))
+        return self._ok(results=results)
+
+    @staticmethod
+    def _customer_memo():
+        """Clients résolus par jeton pour la requête (``_get_customer``) :
+        le rollback d'un savepoint ne le vide pas, ``batch`` le restaure.
+        Les publications de pré-commit, elles, partent à l'entrée du
+        savepoint (flush) et celles de l'opération annulée sont effacées
+        avec lui."""
+        return request.env.cr.cache.setdefault(_CUSTOMER_CACHE_KEY, {})
 
     # --- Rendez-vous ---------------------------------------------------------
 
@@ -326,18 +495,47 @@ class QueueMobileApi(http.Controller):
             day = datetime.strptime(kw.get('date') or '', '%Y-%m-%d').date()
         except ValueError:
             return self._err(_("Date invalide (attendu AAAA-MM-JJ)."))
-        now = fields.Datetime.now()
-        slots = []
-        for slot_dt, available in service._slots_for_date(day):
-            if slot_dt <= now:
-                continue  # on ne propose pas un créneau déjà passé
-            slots.append({
-                'time': fields.Datetime.to_string(slot_dt),
-                'label': slot_dt.strftime('%H:%M'),
-                'available': available,
-            })
+        slots = self._slots_data(service._slots_for_date(day))
         return self._ok(date=kw.get('date'), slots=slots)
 
+    @http.route('/api/queue/slots/range', type='jsonrpc', auth='public',
+                methods=['POST'], csrf=False)
+    def slots_range(self, **kw):
+        """Disponibilités de ``date_from`` à ``date_to`` (inclus, 31 jours
+        max) en une réponse : le calendrier de l'app n'appelle plus
+        ``/api/queue/slots`` jour par jour."""
+        service = request.env['queue.service'].sudo().browse(
+            int(kw.get('service_id') or 0))
+        if not service.exists() or not service.appointment_enabled:
+            return self._err(_("Ce service ne propose pas de rendez-vous."))
+        try:
+            date_from = datetime.strptime(kw.get('date_from') or '', '%Y-%m-%d').date()
+            date_to = datetime.strptime(kw.get('date_to') or '', '%Y-%m-%d').date()
+        except ValueError:
+            return self._err(_("Date invalide (attendu AAAA-MM-JJ)."))
+        if date_to < date_from:
+            return self._err(_("La date de fin précède la date de début."))
+        if (date_to - date_from).days >= _SLOTS_RANGE_MAX_DAYS:
+            return self._err(_("Période trop longue (%d jours maximum).",
+                               _SLOTS_RANGE_MAX_DAYS))
+        by_day = service._slots_for_range(date_from, date_to)
+        days = [
+            {'date': fields.Date.to_string(day), 'slots': self._slots_data(slots)}
+            for day, slots in sorted(by_day.items())
+        ]
+        return self._ok(date_from=kw.get('date_from'),
+                        date_to=kw.get('date_to'), days=days)
+
+    @staticmethod
+    def _slots_data(slots):
+        now = fields.Datetime.now()
+        return [{
+            'time': fields.Datetime.to_string(slot_dt),
+            'label': slot_dt.strftime('%H:%M'),
+            'available': available,
+        } for slot_dt, available in slots
+            if slot_dt > now]  # on ne propose pas un créneau déjà passé
+
     @http.route('/api/queue/appointment/book', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
     def appointment_book(self, **kw):
@@ -358,10 +556,11 @@ class QueueMobileApi(http.Controller):
                 "Vous avez trop de tickets ou rendez-vous en cours. "
                 "Annulez-en avant d'en réserver un autre."))
         try:
-            ticket = service._book_appointment(customer.partner_id, slot_dt)
+            ticket = service._book_appointment(
+                customer.partner_id, slot_dt, customer=customer)
         except UserError as exc:
             return self._err(exc.args[0] if exc.args else _("Réservation impossible."))
-        return self._ok(ticket=self._ticket_data(ticket))
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
 
     @http.route('/api/queue/ticket/checkin', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
@@ -377,7 +576,7 @@ class QueueMobileApi(http.Controller):
             ticket.action_check_in()
         except UserError as exc:
             return self._err(exc.args[0] if exc.args else _("Enregistrement impossible."))
-        return self._ok(ticket=self._ticket_data(ticket))
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
 
     @http.route('/api/queue/ticket/pay', type='jsonrpc', auth='public',
                 methods=['POST'], csrf=False)
@@ -401,7 +600,7 @@ class QueueMobileApi(http.Controller):
         if not ticket.exists() or ticket.partner_id != customer.partner_id:
             return self._err(_("Ticket introuvable."))
         if ticket.payment_state in ('paid', 'to_validate'):
-            return self._ok(ticket=self._ticket_data(ticket))
+            return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')))
         if ticket.payment_state != 'pending':
             return self._err(_("Ce ticket n'attend pas de paiement."))
 
@@ -413,7 +612,7 @@ class QueueMobileApi(http.Controller):
             from odoo.addons.queue_payment.models.queue_wave import WaveError
             try:
                 url = wave._wave_create_checkout(ticket)
-                return self._ok(ticket=self._ticket_data(ticket),
+                return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')),
                                 payment_url=url)
             except WaveError:
                 pass  # repli sur le lien de paiement ci-dessous
@@ -440,7 +639,7 @@ class QueueMobileApi(http.Controller):
             # Le paiement reste « à valider » (un lien ne confirme pas seul).
             extra['payment_url'] = wave._wave_payment_url(ticket)
             extra['merchant'] = wave._wave_merchant_label()
-        return self._ok(ticket=self._ticket_data(ticket), **extra)
+        return self._ok(ticket=self._ticket_data(ticket, kw.get('fields')), **extra)
 
     @http.route('/api/queue/wave/webhook', type='http', auth='public',
                 methods=['POST'], csrf=False)
@@ -469,3 +668,19 @@ class QueueMobileApi(http.Controller):
             return self._err(_("Non authentifié."), code='auth_required')
         customer._register_fcm(kw.get('fcm_token'))
         return self._ok()
+
+    # --- Supervision ----------------------------------------------------------
+
+    @http.route('/queue_management/stats', type='jsonrpc', auth='user',
+                methods=['POST'])
+    def stats(self, **kw):
+        """Compteurs de CE worker (administrateurs) : cache de sessions et
+        coût par champ de ``_ticket_data``. ``pid`` identifie le worker ;
+        interroger plusieurs fois pour couvrir les autres."""
+        if not request.env.user.has_group('base.group_system'):
+            raise AccessError(_("Réservé aux administrateurs."))
+        return {
+            'pid': os.getpid(),
+            'session_cache': request.env['queue.customer'].sudo()._session_cache_stats(),
+            'ticket_fields': ticket_field_stats(),
+        }
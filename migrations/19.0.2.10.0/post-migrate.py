@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+
+def migrate(cr, version):
+    """Reprise de l'existant, une seule fois : ``queue_ticket.customer_id``
+    retrouvé par partenaire (le compte mobile le plus récent, comme
+    l'ancienne recherche de ``_customer``). Les tickets émis ensuite le
+    reçoivent à la création."""
+    if not version:
+        return
+    cr.execute("""
+        UPDATE queue_ticket t
+           SET customer_id = c.id
+          FROM (SELECT DISTINCT ON (partner_id) id, partner_id
+                  FROM queue_customer
+                 WHERE partner_id IS NOT NULL
+              ORDER BY partner_id, create_date DESC, id DESC) c
+         WHERE t.customer_id IS NULL
+           AND t.partner_id = c.partner_id
+    """)
@@ -5,9 +5,14 @@ from . import queue_wave
 from . import queue_rate_limit
 from . import queue_location
 from . import queue_service
+from . import queue_service_count
 from . import queue_counter
 from . import queue_opening_hour
 from . import queue_ticket
+from . import queue_slot_booking
+from . import queue_appointment_quota
 from . import queue_customer
+from . import queue_push_outbox
 from . import queue_app_release
 from . import res_config_settings
+from . import ir_websocket
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+_LOCATION_CHANNEL_PREFIX = 'queue_management.location_'
+_DISPLAY_CHANNEL_PREFIX = 'queue_management.display_'
+
+
+class IrWebsocket(models.AbstractModel):
+    """Abonnement aux changements temps réel des sites.
+
+    - ``queue_management.location_<id>`` (consoles, tableau de bord) : on ne
+      garde que les sites que l'utilisateur peut lire (record rules
+      multi-société) et seulement pour les agents de la file d'attente ;
+    - ``queue_management.display_<jeton>`` (écrans publics, sans login) :
+      accordé à qui connaît le jeton QR d'un site actif, comme l'URL de
+      l'écran elle-même.
+    """
+
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        requested = {}
+        displays = {}
+        others = []
+        for channel in channels:
+            if isinstance(channel, str) and channel.startswith(_LOCATION_CHANNEL_PREFIX):
+                suffix = channel[len(_LOCATION_CHANNEL_PREFIX):]
+                if suffix.isdigit():
+                    requested[int(suffix)] = channel
+                continue
+            if isinstance(channel, str) and channel.startswith(_DISPLAY_CHANNEL_PREFIX):
+                token = channel[len(_DISPLAY_CHANNEL_PREFIX):]
+                if token:
+                    displays[token] = channel
+                continue
+            others.append(channel)
+        if requested and self.env.user.has_group('queue_management.group_queue_agent'):
+            readable = self.env['queue.location'].search(
+                [('id', 'in', list(requested))])
+            others.extend(requested[location.id] for location in readable)
+        if displays:
+            sites = self.env['queue.location'].sudo().search_fetch(
+                [('qr_token', 'in', list(displays)), ('active', '=', True)],
+                ['qr_token'])
+            others.extend(displays[site.qr_token] for site in sites)
+        return super()._build_bus_channel_list(others)
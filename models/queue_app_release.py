@@ -11,7 +11,6 @@ binaire — si bien qu'un passage ultérieur au Play Store (paramètre système
 Pattern repris de ``dms_ocr.dms_app_release`` (éprouvé), sans ``company_id`` :
 l'app est la même pour tous les établissements du SaaS.
 """
-import base64
 import hashlib
 from urllib.parse import quote
 
@@ -76,17 +75,42 @@ class QueueAppRelease(models.Model):
 
     @api.depends('apk_file')
     def _compute_apk_meta(self):
+        """Taille et SHA-256 lus sur la pièce jointe, une fois, à l'upload.
+
+        Le fichier du filestore est haché par blocs : ni lecture du binaire en
+        base64, ni APK entier en mémoire. Stockés, ils ne sont plus recalculés
+        à l'affichage (liste des versions, landing).
+        """
+        attachments = {
+            attachment.res_id: attachment
+            for attachment in self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('res_field', '=', 'apk_file'),
+                ('res_id', 'in', [r.id for r in self if r.id]),
+            ])
+        }
         for r in self:
-            if not r.apk_file:
+            # Enregistrement pas encore sauvé (formulaire) : calculé à la
+            # sauvegarde, quand la pièce jointe existe.
+            attachment = attachments.get(r.id) if r.id else None
+            if not attachment or not attachment.file_size:
                 r.apk_size_mb = 0.0
                 r.apk_sha256 = False
                 continue
-            try:
-                raw = base64.b64decode(r.apk_file)
-            except Exception:
-                raw = b''
-            r.apk_size_mb = round(len(raw) / (1024 * 1024), 2)
-            r.apk_sha256 = hashlib.sha256(raw).hexdigest() if raw else False
+            r.apk_size_mb = round(attachment.file_size / (1024 * 1024), 2)
+            r.apk_sha256 = self._attachment_sha256(attachment)
+
+    @staticmethod
+    def _attachment_sha256(attachment, chunk_size=1024 * 1024):
+        digest = hashlib.sha256()
+        if attachment.store_fname:
+            with open(attachment._full_path(attachment.store_fname), 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+        else:
+            # Pièces jointes stockées en base (``ir_attachment.location=db``).
+            digest.update(attachment.raw or b'')
+        return digest.hexdigest()
 
     @api.model
     def _qr_src(self, size=320):
@@ -138,7 +162,7 @@ class QueueAppRelease(models.Model):
     def action_publish(self):
         """Publie cette version (et dépublie toute autre)."""
         self.ensure_one()
-        if not self.apk_file:
+        if not self.with_context(bin_size=True).apk_file:
             raise UserError(
                 "Aucun fichier APK attaché — impossible de publier cette version.")
         others = self.search([('is_active', '=', True), ('id', '!=', self.id)])
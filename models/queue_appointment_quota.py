@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Garde du quota de rendez-vous : une ligne par (file, client).
+
+``queue.service._book_appointment`` réécrit la ligne du couple AVANT de
+compter les RDV à venir du client. Deux réservations simultanées du même
+client sur la même file se sérialisent donc sur elle : la seconde attend la
+première, échoue en sérialisation et est rejouée par Odoo avec un instantané
+qui voit le RDV déjà pris. Un simple verrou consultatif ne suffirait pas :
+en ``REPEATABLE READ``, la seconde compterait encore sur son ancien
+instantané. Les autres clients et les autres files ne se croisent jamais.
+"""
+from odoo import api, fields, models
+
+
+class QueueAppointmentQuota(models.Model):
+    _name = 'queue.appointment.quota'
+    _description = "Garde du quota de rendez-vous par client"
+    _rec_name = 'partner_id'
+
+    service_id = fields.Many2one(
+        'queue.service', "Service", required=True, ondelete='cascade')
+    partner_id = fields.Many2one(
+        'res.partner', "Client", required=True, ondelete='cascade')
+
+    _service_partner_uniq = models.Constraint(
+        'UNIQUE(service_id, partner_id)',
+        "Une seule ligne de quota par client et par file.",
+    )
+
+    @api.model
+    def _claim(self, service, partner):
+        """Prend (et garde jusqu'au commit) la ligne du couple."""
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            INSERT INTO queue_appointment_quota
+                (service_id, partner_id, create_uid, write_uid, create_date,
+                 write_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (service_id, partner_id) DO UPDATE
+               SET write_date = EXCLUDED.write_date
+        """, (service.id, partner.id, self.env.uid, self.env.uid, now, now))
@@ -61,7 +61,20 @@ class QueueCounter(models.Model):
         'queue.ticket', string="Prochain", compute='_compute_next',
     )
     next_number = fields.Char("N° suivant", compute='_compute_next')
-    waiting_count = fields.Integer("En attente", compute='_compute_next')
+    waiting_count = fields.Integer("En attente", compute='_compute_waiting_count')
+
+    def write(self, vals):
+        # L'écran du site affiche le nom du guichet et son ticket en cours.
+        displayed = {'name', 'active', 'current_ticket_id', 'location_id',
+                     'agent_ids', 'service_ids'} & set(vals)
+        if displayed:
+            self.env['queue.location']._touch_display(
+                self.location_id.ids, counter_ids=self.ids)
+        res = super().write(vals)
+        if displayed:
+            self.env['queue.location']._touch_display(
+                self.location_id.ids, counter_ids=self.ids)
+        return res
 
     @api.onchange('location_id')
     def _onchange_location_id(self):
@@ -98,29 +111,74 @@ class QueueCounter(models.Model):
                 counter.current_ticket_id.state in ('called', 'serving')
             counter.state = 'busy' if busy else 'free'
 
-    @api.depends('service_ids', 'service_ids.ticket_ids.state',
-                 'service_ids.ticket_ids.priority')
+    # Pas de dépendance sur les tickets : un mouvement de file invalide
+    # l'aperçu explicitement (``queue.ticket.write``) au lieu de périmer
+    # tous les guichets du site à chaque changement d'état.
+    @api.depends('service_ids')
     def _compute_next(self):
         for counter in self:
             head = counter._peek_next()
             counter.next_ticket_id = head.id
             counter.next_number = head.name if head else ''
+
+    @api.depends('service_ids')
+    def _compute_waiting_count(self):
+        # Somme des compteurs des files (une lecture par clé pour le lot).
+        for counter in self:
             counter.waiting_count = sum(counter.service_ids.mapped('waiting_count'))
 
     def _peek_next(self):
         """Le prochain ticket à appeler parmi toutes les files du guichet.
 
-        On agrège les têtes de file des services desservis puis on les départage
-        avec la même clé d'ordonnancement (priorité, ancienneté, RDV échu).
-        Itération explicite (pas de ``mapped(lambda)``) : sur un guichet en
-        cours de création (onchange), ``service_ids`` est vide et Odoo 19
-        passerait le recordset vide à la lambda → ``ensure_one()`` planterait.
+        Même clé d'ordonnancement que la file (priorité, ancienneté, RDV
+        échu), en une seule requête indexée sur toutes les files desservies.
+        Sur un guichet en cours de création (onchange), ``service_ids`` est
+        vide : recordset vide, sans requête.
         """
+        return self.peek_next_n(1)
+
+    def peek_next_n(self, n=3):
+        """Les ``n`` prochains tickets du guichet, dans l'ordre d'appel, sans
+        rien réserver. Seule lecture des têtes de file du guichet : aperçu,
+        console et « Appeler le suivant » annoncent les mêmes tickets."""
         self.ensure_one()
-        candidates = self.env['queue.ticket']
-        for service in self.service_ids:
-            candidates |= service._get_next_waiting()
-        return candidates.sorted(key=lambda t: t._scheduling_key())[:1]
+        return self.service_ids._get_waiting_heads(limit=max(int(n or 1), 1))
+
+    def _claim_next(self):
+        """Réserve le prochain ticket du guichet pour CETTE transaction.
+
+        ``SELECT … FOR UPDATE SKIP LOCKED`` sur toutes les files desservies,
+        dans l'ordre d'appel : un ticket déjà en cours d'appel par un autre
+        agent est sauté au lieu d'être disputé. Vingt agents d'un même site
+        obtiennent chacun un ticket distinct, en une requête, sans verrou
+        global ni nouvelle tentative.
+
+        Même ordre que l'aperçu (``_peek_next``, ``WAITING_ORDER``), servi
+        par l'index partiel des tickets en attente : les RDV échus des files
+        desservies sont d'abord remontés (lignes déjà verrouillées sautées,
+        cf. ``queue.ticket._promote_due_appointments``), le ticket appelé est
+        donc celui que la console annonçait.
+        """
+        self.ensure_one()
+        Ticket = self.env['queue.ticket']
+        if not self.service_ids:
+            return Ticket
+        Ticket._promote_due_appointments(self.service_ids)
+        Ticket.flush_model(['state', 'service_id', 'sched_weight', 'created_at'])
+        self.env.cr.execute(f"""
+            SELECT id FROM queue_ticket
+             WHERE service_id IN %s AND state = 'waiting'
+          ORDER BY {Ticket.WAITING_ORDER}
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """, (tuple(self.service_ids.ids),))
+        row = self.env.cr.fetchone()
+        if not row:
+            return Ticket
+        ticket = Ticket.browse(row[0])
+        # Ligne verrouillée : on relit son état depuis la base.
+        ticket.invalidate_recordset()
+        return ticket
 
     # ------------------------------------------------------------------
     # Console agent (client action Owl) : présence + données temps réel
@@ -150,53 +208,155 @@ class QueueCounter(models.Model):
                     "%s a quitté le guichet.", self.env.user.name))
         return True
 
+    # Nombre de tickets affichés après « prochain » dans la console.
+    CONSOLE_UPCOMING = 3
+
     @api.model
-    def get_console_data(self, counter_id=None):
+    def get_console_data(self, counter_id=None, counters_version=None,
+                         version=None):
         """Données de la console agent. Sans sudo : record rules appliquées
-        (un agent ne voit que les guichets de ses établissements)."""
-        counters = self.search([('active', '=', True)])
-        mine = counters.filtered(lambda c: self.env.user in c.agent_ids)
-        counter = (counters.filtered(lambda c: c.id == counter_id)
-                   or mine or counters)[:1]
+        (un agent ne voit que les guichets de ses établissements).
+
+        Deux parties, chacune versionnée ; le client renvoie les versions
+        qu'il détient et ne reçoit que ce qui a bougé :
+
+        - ``counters`` (liste des guichets, rarement modifiée) : absente si
+          ``counters_version`` est à jour ;
+        - partie vivante du guichet courant : versionnée par le
+          ``display_version`` de son site ; à jour → ``unchanged``.
+        """
+        counters_stamp = self._console_counters_version()
+        counter = self._console_counter(counter_id)
         data = {
-            'counters': [{
-                'id': c.id,
-                'name': c.display_name,
-                'location': c.location_id.name,
-                'joined': self.env.user in c.agent_ids,
-            } for c in counters],
+            'counters_version': counters_stamp,
             'counter_id': counter.id if counter else False,
+            'version': (f'{counter.id}-{counter.location_id.display_version}'
+                        if counter else False),
         }
-        if counter:
+        if counters_version != counters_stamp:
+            data['counters'] = self._console_counters()
+        if not counter:
+            return data
+        if version == data['version']:
+            data['unchanged'] = True
+            return data
+        data.update({
+            'name': counter.name,
+            'location': counter.location_id.name,
+            'location_id': counter.location_id.id,
+            'joined': self.env.user in counter.agent_ids,
+            'services': counter.service_ids.mapped('name'),
+            **counter._console_live_data(),
+        })
+        return data
+
+    @api.model
+    def _console_counters_version(self):
+        """Empreinte de la liste : nombre de guichets visibles et dernière
+        écriture (renommage, présence des agents, archivage)."""
+        [(count, last_write)] = self._read_group(
+            [('active', '=', True)], [], ['__count', 'write_date:max'])
+        return f'{count}-{fields.Datetime.to_string(last_write) or ""}'
+
+    @api.model
+    def _console_counter(self, counter_id=None):
+        """Le guichet demandé s'il est visible, sinon celui de l'agent, sinon
+        le premier : trois recherches bornées (``limit=1``)."""
+        counter = self.browse()
+        if counter_id:
+            counter = self.search([('id', '=', counter_id), ('active', '=', True)])
+        return (counter
+                or self.search([('active', '=', True),
+                                ('agent_ids', 'in', self.env.uid)], limit=1)
+                or self.search([('active', '=', True)], limit=1))
+
+    @api.model
+    def _console_counters(self):
+        counters = self.search_fetch([('active', '=', True)],
+                                     ['name', 'location_id'])
+        mine = set(self.search([('active', '=', True),
+                                ('agent_ids', 'in', self.env.uid)]).ids)
+        return [{
+            'id': c.id,
+            'name': c.display_name,
+            'location': c.location_id.name,
+            'joined': c.id in mine,
+        } for c in counters]
+
+    def _console_live_data(self):
+        """Partie « vivante » de la console d'un guichet : rechargée à
+        l'ouverture, puis relue par la console à chaque signal du bus qui
+        cite ce guichet (cf. ``queue.location._publish_site_changes``)."""
+        self.ensure_one()
+        return self._console_live_batch()[self.id]
+
+    def _console_live_batch(self):
+        """``{counter_id: partie vivante}`` pour tous les guichets de ``self`` :
+        têtes de file par ``peek_next_n`` (la même lecture que l'aperçu),
+        paiements à valider de tous les guichets en une requête ``LATERAL``,
+        puis tous les tickets concernés lus d'un seul ``fetch``."""
+        Ticket = self.env['queue.ticket']
+        if not self:
+            return {}
+        heads = {counter.id: counter.peek_next_n(self.CONSOLE_UPCOMING + 1)
+                 for counter in self}
+        Ticket.flush_model(['state', 'service_id', 'payment_state'])
+        self.flush_recordset(['service_ids', 'current_ticket_id'])
+        self.env['queue.service'].flush_model(['active'])
+        cr = self.env.cr
+        # Paiements déclarés à distance sur les services du guichet
+        # (Wave marchand avant l'arrivée…) — hors ticket en cours.
+        cr.execute("""
+            SELECT c.id, v.id
+              FROM queue_counter c
+        CROSS JOIN LATERAL (
+                  SELECT t.id, t.create_date
+                    FROM queue_ticket t
+                   WHERE t.payment_state = 'to_validate'
+                     AND t.id IS DISTINCT FROM c.current_ticket_id
+                     AND t.service_id IN (
+                         SELECT r.service_id
+                           FROM queue_counter_service_rel r
+                           JOIN queue_service s ON s.id = r.service_id AND s.active
+                          WHERE r.counter_id = c.id)
+                ORDER BY t.create_date DESC, t.id DESC
+                   LIMIT 20
+              ) v
+             WHERE c.id = ANY(%s)
+          ORDER BY c.id, v.create_date DESC, v.id DESC
+        """, (self.ids,))
+        to_validate = {}
+        for counter_id, ticket_id in cr.fetchall():
+            to_validate.setdefault(counter_id, []).append(ticket_id)
+        tickets = self.current_ticket_id.union(*heads.values()) | Ticket.browse(
+            [tid for ids in to_validate.values() for tid in ids])
+        tickets.fetch(['name', 'state', 'service_id', 'partner_id',
+                       'payment_state', 'payment_method', 'payment_ref',
+                       'payment_amount', 'currency_id'])
+        result = {}
+        for counter in self:
             ticket = counter.current_ticket_id
-            data.update({
-                'name': counter.name,
-                'location': counter.location_id.name,
-                'joined': self.env.user in counter.agent_ids,
+            queue = heads[counter.id]
+            result[counter.id] = {
                 'agents': counter.agent_ids.mapped('name'),
-                'services': counter.service_ids.mapped('name'),
                 'busy': counter.state == 'busy',
                 'ticket_id': ticket.id if ticket else False,
                 'ticket': ticket.name if ticket else '',
                 'ticket_state': ticket.state if ticket else '',
                 'ticket_service': ticket.service_id.name if ticket else '',
                 'ticket_partner': ticket.partner_id.name if ticket else '',
-                'next_number': counter.next_number or '',
+                'next_number': queue[:1].name or '',
+                # Les suivants (même requête que la tête de file).
+                'upcoming': queue[1:].mapped('name'),
                 'waiting': counter.waiting_count,
                 # Paiement du ticket en cours (pour valider/encaisser en direct).
                 'ticket_payment': ticket._console_payment() if ticket else False,
-                # Paiements déclarés à distance sur les services du guichet
-                # (Wave marchand avant l'arrivée…) — hors ticket en cours.
                 'to_validate': [
                     t._console_payment(with_ticket=True)
-                    for t in self.env['queue.ticket'].search([
-                        ('service_id', 'in', counter.service_ids.ids),
-                        ('payment_state', '=', 'to_validate'),
-                        ('id', '!=', ticket.id),
-                    ], limit=20)
+                    for t in Ticket.browse(to_validate.get(counter.id, []))
                 ],
-            })
-        return data
+            }
+        return result
 
     def action_call_next(self):
         """Appelle le prochain client (waiting → called à ce guichet)."""
@@ -207,7 +367,7 @@ class QueueCounter(models.Model):
                 "ajoutez-en dans « Services desservis »."))
         if self.current_ticket_id and self.current_ticket_id.state in ('called', 'serving'):
             raise UserError(_("Terminez d'abord le client en cours à ce guichet."))
-        ticket = self._peek_next()
+        ticket = self._claim_next()
         if not ticket:
             raise UserError(_("Aucun client en attente."))
         ticket.action_call(self)
@@ -3,6 +3,9 @@ import hashlib
 import logging
 import secrets
 import string
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
 
 from odoo import _, api, fields, models
@@ -11,6 +14,46 @@ from odoo.tools import email_normalize
 
 _logger = logging.getLogger(__name__)
 
+# Cache des sessions mobiles (par worker) : hash du jeton → (client,
+# expiration). L'app interroge le statut de son ticket toutes les quelques
+# secondes ; sans ce cache, chaque appel refait la recherche par hash.
+# Invalidation inter-workers : toute écriture de session incrémente, après
+# commit, la séquence ``queue_customer_session_seq`` ; chaque worker la relit
+# au plus toutes les ``_SESSION_CHECK_SECONDS`` et se vide si elle a bougé.
+_SESSION_CACHE_SIZE = 4096
+_SESSION_TTL_SECONDS = 60
+_SESSION_CHECK_SECONDS = 2
+_SESSION_SEQUENCE = 'queue_customer_session_seq'
+# Champs dont l'écriture invalide une session en cache.
+_SESSION_FIELDS = frozenset({'token', 'token_expiry', 'active'})
+
+_session_cache = OrderedDict()  # (dbname, hash) -> (id, expiry, monotonic)
+_session_versions = {}          # dbname -> (last_value, monotonic)
+_session_lock = threading.Lock()
+_session_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _drop_sessions(dbname, customer_ids=None):
+    """Vide le cache d'une base (ou des seuls clients ``customer_ids``)."""
+    with _session_lock:
+        stale = [key for key, entry in _session_cache.items()
+                 if key[0] == dbname
+                 and (customer_ids is None or entry[0] in customer_ids)]
+        for key in stale:
+            del _session_cache[key]
+
+
+def _publish_session_change(registry, customer_ids):
+    """Post-commit : signale le changement aux autres workers."""
+    _drop_sessions(registry.db_name, customer_ids)
+    try:
+        with registry.cursor() as cr:
+            cr.execute("SELECT nextval(%s)", (_SESSION_SEQUENCE,))
+    except Exception:
+        # Au pire, les autres workers voient le changement à l'échéance
+        # du TTL (``_SESSION_TTL_SECONDS``).
+        _logger.exception("invalidation du cache de sessions non diffusée")
+
 
 class QueueCustomer(models.Model):
     """Client de l'application mobile, identifié par son email.
@@ -89,6 +132,9 @@ class QueueCustomer(models.Model):
             raise ValidationError(_("Adresse email invalide : %s", email or ''))
         return normalized
 
+    def init(self):
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {_SESSION_SEQUENCE}")
+
     @api.model_create_multi
     def create(self, vals_list):
         for vals in vals_list:
@@ -101,7 +147,104 @@ class QueueCustomer(models.Model):
         # backoffice ne doit pas casser la connexion (recherches en minuscules).
         if vals.get('email'):
             vals['email'] = self._normalize_email(vals['email'])
-        return super().write(vals)
+        res = super().write(vals)
+        if not _SESSION_FIELDS.isdisjoint(vals):
+            self._invalidate_session_cache()
+        return res
+
+    def unlink(self):
+        self._invalidate_session_cache()
+        return super().unlink()
+
+    # --- Cache des sessions ---------------------------------------------------
+
+    @api.model
+    def _from_token(self, token):
+        """Client actif porteur du jeton en clair ``token`` (vide si inconnu,
+        désactivé ou session expirée). Passe par le cache de sessions."""
+        token_hash = self._hash(token)
+        self._sync_session_cache()
+        key = (self.env.cr.dbname, token_hash)
+        now = time.monotonic()
+        with _session_lock:
+            entry = _session_cache.get(key)
+            if entry and now - entry[2] < _SESSION_TTL_SECONDS:
+                _session_cache.move_to_end(key)
+                _session_stats['hits'] += 1
+            else:
+                entry = None
+                _session_stats['misses'] += 1
+        if entry is None:
+            # Seul le hash du jeton est stocké : on compare hash à hash.
+            customer = self.search(
+                [('token', '=', token_hash), ('active', '=', True)], limit=1)
+            if not customer:
+                # Pas de cache négatif : des jetons bidon ne doivent pas
+                # chasser les vraies sessions du LRU.
+                return customer
+            entry = (customer.id, customer.token_expiry, now)
+            with _session_lock:
+                _session_cache[key] = entry
+                if len(_session_cache) > _SESSION_CACHE_SIZE:
+                    _session_cache.popitem(last=False)
+        customer_id, expiry, _cached_at = entry
+        if expiry and fields.Datetime.now() > expiry:
+            return self.browse()  # session expirée : reconnexion par OTP
+        return self.browse(customer_id)
+
+    @api.model
+    def _sync_session_cache(self):
+        """Vide le cache local si un autre worker a signalé un changement."""
+        dbname = self.env.cr.dbname
+        now = time.monotonic()
+        version, checked_at = _session_versions.get(dbname, (None, 0.0))
+        if now - checked_at < _SESSION_CHECK_SECONDS:
+            return
+        self.env.cr.execute(f"SELECT last_value FROM {_SESSION_SEQUENCE}")
+        current = self.env.cr.fetchone()[0]
+        if version is not None and current != version:
+            _drop_sessions(dbname)
+        _session_versions[dbname] = (current, now)
+
+    def _invalidate_session_cache(self):
+        """Retire ces clients du cache, ici tout de suite et partout après
+        commit (la relecture d'avant-commit a pu remettre l'ancien état)."""
+        ids = set(self.ids)
+        _drop_sessions(self.env.cr.dbname, ids)
+        _session_stats['invalidations'] += 1
+        registry = self.env.registry
+        self.env.cr.postcommit.add(
+            lambda: _publish_session_change(registry, ids))
+
+    @api.model
+    def _session_cache_stats(self):
+        """Compteurs du cache de sessions de CE worker (supervision)."""
+        with _session_lock:
+            return dict(_session_stats, size=len(_session_cache))
+
+    def _site_versions(self, site_ids=()):
+        """``{site_id: display_version}`` des sites où le client a un ticket
+        actif, plus ``site_ids`` (ceux que l'appelant suit déjà).
+
+        Une seule requête, sur l'index ``customer_id`` des tickets et les
+        séquences de version des sites : c'est le contrôle « rien n'a bougé »
+        de ``/api/queue/sync``, sans lecture ORM.
+        """
+        self.ensure_one()
+        self.env['queue.ticket'].flush_model(['customer_id', 'state', 'location_id'])
+        self.env.cr.execute("""
+            SELECT l.id, COALESCE(seq.last_value, 0)
+              FROM queue_location l
+         LEFT JOIN pg_sequences seq
+                ON seq.schemaname = current_schema()
+               AND seq.sequencename = 'queue_location_display_' || l.id
+             WHERE l.id = ANY(%s)
+                OR l.id IN (SELECT t.location_id
+                              FROM queue_ticket t
+                             WHERE t.customer_id = %s
+                               AND t.state IN ('scheduled', 'waiting', 'called', 'serving'))
+        """, (list(site_ids), self.id))
+        return dict(self.env.cr.fetchall())
 
     def _ensure_partner(self):
         """Crée le ``res.partner`` miroir s'il manque (idempotent)."""
@@ -253,31 +396,21 @@ class QueueCustomer(models.Model):
         return True
 
     def _push(self, title, body, data=None):
-        """Envoie une notification push FCM au client (best-effort).
+        """Met en file une notification push FCM pour le client (best-effort).
 
-        Réutilise l'initialisation Firebase de ``push_notification_hub`` mais en
-        ciblant directement le ``fcm_token`` du client (qui n'est pas un
-        ``res.users``, donc hors API ``send(user_ids=...)`` du hub). Ne lève
-        jamais : si FCM n'est pas configuré ou échoue, on logge et on continue.
+        N'appelle PAS FCM : le message part après le commit, via
+        ``queue.push.outbox`` (lots, nouveaux essais, jetons morts retirés).
+        Aucun verrou n'est donc tenu pendant l'envoi. Ne lève jamais.
         """
         self.ensure_one()
+        return bool(self._push_many([(self, title, body, data)]))
+
+    @api.model
+    def _push_many(self, messages):
+        """Met en file un lot ``[(client, titre, corps, données)]`` ; les
+        clients sans appareil sont ignorés. Renvoie le nombre mis en file."""
         # fcm_token est restreint à base.group_system → lecture en sudo.
-        fcm_token = self.sudo().fcm_token
-        if not fcm_token:
-            return False
-        if 'push.notification' not in self.env:
-            _logger.info("push_notification_hub absent : push « %s » non envoyé", title)
-            return False
-        Push = self.env['push.notification'].sudo()
-        messaging = Push._get_fcm_messaging()
-        if messaging is None:
-            _logger.info("FCM non configuré : push « %s » non envoyé à %s",
-                         title, self.email)
-            return False
-        payload = {str(k): str(v) for k, v in (data or {}).items() if v is not None}
-        try:
-            Push._send_one(messaging, fcm_token, title, body, payload)
-            return True
-        except Exception as exc:  # noqa: BLE001 — best-effort, jamais bloquant
-            _logger.warning("queue_management : échec push à %s : %s", self.email, exc)
-            return False
+        ready = [message for message in messages if message[0].sudo().fcm_token]
+        if ready:
+            self.env['queue.push.outbox']._enqueue_many(ready)
+        return len(ready)
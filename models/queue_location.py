@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import secrets
 from datetime import datetime, time
+from functools import partial
 
 from odoo import _, api, fields, models
+from odoo.tools import sql
 
 
 class QueueLocation(models.Model):
@@ -57,6 +59,13 @@ class QueueLocation(models.Model):
     counter_count = fields.Integer("Nb de guichets", compute='_compute_counts')
     ticket_count = fields.Integer("Nb de tickets", compute='_compute_counts')
 
+    # Version de l'écran d'affichage : avance dès qu'un ticket, guichet ou
+    # service du site bouge. Sert d'ETag à /queue/display/<token>/data. Tenue
+    # par une séquence PostgreSQL propre au site (non transactionnelle) : les
+    # transactions concurrentes du site ne se disputent aucune ligne.
+    display_version = fields.Integer(
+        "Version d'affichage", compute='_compute_display_version')
+
     _qr_token_uniq = models.Constraint(
         'UNIQUE(qr_token)',
         "Le jeton QR doit être unique.",
@@ -71,6 +80,188 @@ class QueueLocation(models.Model):
             location.counter_count = len(location.counter_ids)
             location.ticket_count = counts.get(location, 0)
 
+    def init(self):
+        self.env.cr.execute("SELECT id FROM queue_location")
+        self.browse([row[0] for row in self.env.cr.fetchall()]
+                    )._ensure_display_sequence()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        locations = super().create(vals_list)
+        locations._ensure_display_sequence()
+        return locations
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'name', 'active'} & set(vals):
+            self._touch_display(self.ids)
+        return res
+
+    def unlink(self):
+        sequences = [location._display_sequence() for location in self]
+        res = super().unlink()
+        for sequence in sequences:
+            self.env.cr.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+        # Files supprimées en cascade par la base : leur ``unlink`` n'a pas
+        # tourné, leurs séquences de numérotation non plus.
+        self.env['queue.service']._drop_orphan_number_sequences()
+        return res
+
+    def _display_sequence(self):
+        """Nom de la séquence PostgreSQL de version d'affichage du site."""
+        self.ensure_one()
+        return 'queue_location_display_%d' % self.id
+
+    def _ensure_display_sequence(self):
+        """Crée la séquence de chaque site si besoin (idempotent). Une base
+        qui stockait la version en colonne repart de sa valeur : un écran
+        ne peut pas recevoir un 304 pour une version déjà vue."""
+        cr = self.env.cr
+        legacy = sql.column_exists(cr, 'queue_location', 'display_version')
+        for location in self:
+            sequence = location._display_sequence()
+            cr.execute("SELECT to_regclass(%s)", (sequence,))
+            if cr.fetchone()[0]:
+                continue
+            cr.execute(f"CREATE SEQUENCE {sequence} MINVALUE 0 START 1")
+            if legacy:
+                cr.execute(
+                    "SELECT display_version FROM queue_location WHERE id = %s",
+                    (location.id,))
+                row = cr.fetchone()
+                if row and row[0]:
+                    cr.execute("SELECT setval(%s, %s)", (sequence, row[0]))
+
+    def _compute_display_version(self):
+        versions = self._display_versions(self._origin.ids)
+        for location in self:
+            location.display_version = versions.get(location._origin.id, 0)
+
+    @api.model
+    def _display_versions(self, location_ids):
+        """``{location_id: version}`` en une requête, sans toucher aux lignes
+        des sites (0 tant que la séquence n'a jamais servi)."""
+        location_ids = sorted({location_id for location_id in location_ids
+                               if location_id})
+        if not location_ids:
+            return {}
+        self.env.cr.execute("""
+            SELECT l.id, COALESCE(seq.last_value, 0)
+              FROM unnest(%s::int[]) AS l(id)
+         LEFT JOIN pg_sequences seq
+                ON seq.schemaname = current_schema()
+               AND seq.sequencename = 'queue_location_display_' || l.id
+        """, (location_ids,))
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _bump_display_versions(self, location_ids):
+        """Avance la version des sites ; ``{location_id: nouvelle version}``.
+        ``nextval`` ne verrouille rien et survit à un rollback."""
+        self.env.cr.execute("""
+            SELECT l.id, nextval(('queue_location_display_' || l.id)::regclass)
+              FROM unnest(%s::int[]) AS l(id)
+        """, (sorted(location_ids),))
+        return dict(self.env.cr.fetchall())
+
+    _DISPLAY_TOUCHED = 'queue_management.display_touched'
+    BUS_SITE_CHANGED = 'queue_management.site_changed'
+    BUS_DISPLAY_CHANGED = 'queue_management.display_changed'
+
+    @api.model
+    def _touch_display(self, location_ids, service_ids=(), counter_ids=(),
+                       kpis=False):
+        """Marque ces sites comme modifiés, en pré-commit et une seule fois
+        par transaction quel que soit le nombre de mouvements :
+
+        - ``display_version`` avancée (séquence du site : aucun verrou), puis
+          de nouveau après le commit ;
+        - signal publié sur le bus pour les consoles et tableaux de bord :
+          nouvelle version et ids des files ``service_ids`` et des guichets
+          touchés (ou qui desservent ces files), KPI du jour si ``kpis`` ;
+          chacun relit ensuite sa propre vue par son RPC ;
+        - simple signal aux écrans d'affichage publics du site, qui relisent
+          alors leurs données (requête conditionnelle).
+        """
+        location_ids = {location_id for location_id in location_ids if location_id}
+        if not location_ids:
+            return
+        data = self.env.cr.precommit.data
+        touched = data.get(self._DISPLAY_TOUCHED)
+        if touched is None:
+            touched = data[self._DISPLAY_TOUCHED] = {
+                'locations': set(), 'services': set(), 'counters': set(),
+                'kpis': set(),
+            }
+            self.env.cr.precommit.add(self._publish_site_changes)
+        touched['locations'].update(location_ids)
+        touched['services'].update(filter(None, service_ids))
+        touched['counters'].update(filter(None, counter_ids))
+        if kpis:
+            touched['kpis'].update(location_ids)
+
+    def _publish_site_changes(self):
+        """Pré-commit : version et ids touchés seulement. Rien n'est construit
+        ici (ni lignes du tableau de bord, ni console, ni KPI) : ce hook court
+        dans CHAQUE transaction qui écrit un ticket, borne et mobile compris."""
+        touched = self.env.cr.precommit.data.pop(self._DISPLAY_TOUCHED, None)
+        if not touched:
+            return
+        location_ids = sorted(touched['locations'])
+        changes = self._site_changes(location_ids, touched)
+        versions = self._bump_display_versions(location_ids)
+        self.browse(location_ids).invalidate_recordset(['display_version'])
+        # La séquence avance AVANT le commit : un écran qui la lit entre-temps
+        # obtient la nouvelle version avec les anciennes données. Le second
+        # pas, une fois le commit fait, l'oblige à relire.
+        self.env.cr.postcommit.add(
+            partial(self._bump_display_versions, location_ids))
+        # Le bus ne notifie qu'après le commit : les abonnés relisent des
+        # données déjà visibles.
+        Bus = self.env['bus.bus']
+        for location in self.sudo().browse(location_ids):
+            version = versions[location.id]
+            Bus._sendone(location._bus_channel(), self.BUS_SITE_CHANGED, {
+                'location_id': location.id,
+                'version': version,
+                'services': sorted(changes[location.id]['services']),
+                'counters': sorted(changes[location.id]['counters']),
+                'kpis': location.id in touched['kpis'],
+            })
+            Bus._sendone(location._display_bus_channel(),
+                         self.BUS_DISPLAY_CHANGED, {'version': version})
+
+    def _site_changes(self, location_ids, touched):
+        """``{location_id: {'services': ids, 'counters': ids}}`` : les files
+        touchées et les guichets touchés ou qui les desservent. Deux
+        recherches par clé, aucune ligne construite."""
+        changes = {location_id: {'services': set(), 'counters': set()}
+                   for location_id in location_ids}
+        services = self.env['queue.service'].sudo().search_fetch([
+            ('id', 'in', list(touched['services'])),
+            ('location_id', 'in', location_ids),
+        ], ['location_id'])
+        counters = self.env['queue.counter'].sudo().search_fetch([
+            ('location_id', 'in', location_ids),
+            '|', ('id', 'in', list(touched['counters'])),
+                 ('service_ids', 'in', services.ids),
+        ], ['location_id'])
+        for service in services:
+            changes[service.location_id.id]['services'].add(service.id)
+        for counter in counters:
+            changes[counter.location_id.id]['counters'].add(counter.id)
+        return changes
+
+    def _bus_channel(self):
+        self.ensure_one()
+        return 'queue_management.location_%d' % self.id
+
+    def _display_bus_channel(self):
+        """Canal public des écrans du site : porte le jeton secret, comme
+        l'URL de l'écran (cf. ``ir.websocket``)."""
+        self.ensure_one()
+        return 'queue_management.display_%s' % self.qr_token
+
     def _open_related(self, name, model, domain, context=None):
         self.ensure_one()
         return {
@@ -152,76 +343,178 @@ class QueueLocation(models.Model):
     # Tableau de bord temps réel (client action Owl)
     # ------------------------------------------------------------------
 
-    @api.model
-    def get_dashboard_data(self, location_id=None):
-        """Photographie « maintenant » d'un site, pour le tableau de bord.
+    # Le tableau de bord et la console se construisent en un nombre
+    # FIXE de requêtes groupées, quel que soit le nombre de files, de guichets
+    # ou de tickets du site : agrégats et têtes de file en SQL, libellés
+    # (traduisibles) lus en un ``fetch`` par modèle.
 
-        Appelée SANS sudo : les record rules multi-société s'appliquent, un
-        responsable ne peut superviser que ses établissements. Re-sondée
-        toutes les quelques secondes par le composant Owl → rester léger.
-        """
-        locations = self.search([])
-        location = (locations.filtered(lambda l: l.id == location_id)
-                    or locations[:1])
-        result = {
-            'locations': [{'id': l.id, 'name': l.display_name} for l in locations],
-            'location_id': location.id if location else False,
-            'now': fields.Datetime.to_string(fields.Datetime.now()),
+    def _dashboard_kpis(self):
+        self.ensure_one()
+        self.env['queue.ticket'].flush_model(
+            ['location_id', 'created_at', 'state', 'wait_real_minutes'])
+        self.env['queue.service'].flush_model(['location_id', 'active'])
+        today_start = datetime.combine(fields.Date.context_today(self), time.min)
+        self.env.cr.execute("""
+            SELECT COUNT(*) FILTER (WHERE t.state = 'done'),
+                   COUNT(*) FILTER (WHERE t.state = 'no_show'),
+                   AVG(t.wait_real_minutes) FILTER (WHERE t.state = 'done'
+                                                      AND t.wait_real_minutes > 0),
+                   (SELECT COALESCE(SUM(n.waiting_count), 0)
+                      FROM queue_service s
+                      JOIN queue_service_count n ON n.service_id = s.id
+                     WHERE s.location_id = %s AND s.active)
+              FROM queue_ticket t
+             WHERE t.location_id = %s AND t.created_at >= %s
+        """, (self.id, self.id, today_start))
+        done, no_show, avg_wait, waiting = self.env.cr.fetchone()
+        closed_for_rate = done + no_show
+        return {
+            'waiting': waiting,
+            'done_today': done,
+            'avg_wait_today': round(avg_wait, 1) if avg_wait else 0.0,
+            'no_show_rate': round(100.0 * no_show / closed_for_rate, 1)
+            if closed_for_rate else 0.0,
         }
-        if not location:
-            return result
 
+    @api.model
+    def _dashboard_service_rows(self, services, window=20):
+        """Une ligne par file : attente, tête de file et son ETA.
+
+        Tête lue sur l'index partiel (``LATERAL … LIMIT 1``), durée moyenne
+        des ``window`` derniers services (cf. ``queue.ticket.
+        _avg_service_minutes``) et nombre de guichets dans la même requête.
+        """
+        if not services:
+            return []
         Ticket = self.env['queue.ticket']
-        today_start = datetime.combine(fields.Date.context_today(self), time.min)
-        day_tickets = Ticket.search([
-            ('location_id', '=', location.id),
-            ('created_at', '>=', today_start),
-        ])
-        done = day_tickets.filtered(lambda t: t.state == 'done')
-        no_show = day_tickets.filtered(lambda t: t.state == 'no_show')
-        waits = [t.wait_real_minutes for t in done if t.wait_real_minutes > 0]
-        closed_for_rate = len(done) + len(no_show)
-
-        services = []
-        for service in location.service_ids.filtered('active'):
-            head = service._get_next_waiting()
-            services.append({
+        Ticket.flush_model(['name', 'state', 'service_id', 'sched_weight',
+                            'created_at', 'closed_at', 'service_real_minutes'])
+        self.env['queue.counter'].flush_model(['active', 'service_ids'])
+        self.env.cr.execute("""
+            SELECT s.id, n.waiting_count, head.name, recent.avg_minutes,
+                   (SELECT COUNT(*)
+                      FROM queue_counter_service_rel r
+                      JOIN queue_counter c ON c.id = r.counter_id AND c.active
+                     WHERE r.service_id = s.id)
+              FROM queue_service s
+         LEFT JOIN queue_service_count n ON n.service_id = s.id
+         LEFT JOIN LATERAL (
+                  SELECT t.name
+                    FROM queue_ticket t
+                   WHERE t.service_id = s.id AND t.state = 'waiting'
+                ORDER BY t.sched_weight DESC, t.created_at, t.id
+                   LIMIT 1
+              ) head ON TRUE
+         LEFT JOIN LATERAL (
+                  SELECT AVG(d.service_real_minutes) AS avg_minutes
+                    FROM (SELECT t.service_real_minutes
+                            FROM queue_ticket t
+                           WHERE t.service_id = s.id AND t.state = 'done'
+                             AND t.service_real_minutes > 0
+                        ORDER BY t.closed_at DESC NULLS LAST
+                           LIMIT %s) d
+              ) recent ON TRUE
+             WHERE s.id = ANY(%s)
+        """, (window, services.ids))
+        live = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        services.fetch(['name', 'code', 'appointment_enabled'])
+        rows = []
+        for service in services:
+            waiting, head, avg_minutes, counters = live[service.id]
+            # Même formule que ``_estimated_wait_minutes`` pour la position 1.
+            eta = (int(round(avg_minutes / max(counters, 1)))
+                   if head and avg_minutes else 0)
+            rows.append({
                 'id': service.id,
                 'name': service.name,
                 'code': service.code,
-                'waiting': service.waiting_count,
-                'next_number': head.name if head else '',
-                'eta_next': head.eta_minutes if head else 0,
+                'waiting': waiting or 0,
+                'next_number': head or '',
+                'eta_next': eta,
                 'appointment': service.appointment_enabled,
             })
+        return rows
 
-        counters = []
-        for counter in location.counter_ids.filtered('active'):
-            ticket = counter.current_ticket_id
-            busy = counter.state == 'busy'
-            counters.append({
+    @api.model
+    def _dashboard_counter_rows(self, counters):
+        """Une ligne par guichet : occupation, agents et attente sur ses files."""
+        if not counters:
+            return []
+        self.env['queue.counter'].flush_model(
+            ['current_ticket_id', 'agent_id', 'agent_ids', 'service_ids'])
+        self.env['queue.ticket'].flush_model(['name', 'state', 'service_id'])
+        self.env['queue.service'].flush_model(['active'])
+        self.env.cr.execute("""
+            SELECT c.id, t.name, t.state, t.service_id,
+                   (SELECT string_agg(p.name, ', ' ORDER BY p.name, u.login)
+                      FROM queue_counter_agent_rel a
+                      JOIN res_users u ON u.id = a.user_id AND u.active
+                      JOIN res_partner p ON p.id = u.partner_id
+                     WHERE a.counter_id = c.id),
+                   (SELECT p.name
+                      FROM res_users u
+                      JOIN res_partner p ON p.id = u.partner_id
+                     WHERE u.id = c.agent_id),
+                   (SELECT COALESCE(SUM(n.waiting_count), 0)
+                      FROM queue_counter_service_rel r
+                      JOIN queue_service s ON s.id = r.service_id AND s.active
+                      JOIN queue_service_count n ON n.service_id = r.service_id
+                     WHERE r.counter_id = c.id)
+              FROM queue_counter c
+         LEFT JOIN queue_ticket t ON t.id = c.current_ticket_id
+             WHERE c.id = ANY(%s)
+        """, (counters.ids,))
+        live = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        counters.fetch(['name'])
+        service_names = {
+            service.id: service.name
+            for service in self.env['queue.service'].browse(
+                {row[2] for row in live.values() if row[2]}).with_context(
+                active_test=False)
+        }
+        rows = []
+        for counter in counters:
+            ticket, state, service_id, agents, holder, waiting = live[counter.id]
+            busy = state in ('called', 'serving')
+            rows.append({
                 'id': counter.id,
                 'name': counter.name,
                 'busy': busy,
-                'agent': ", ".join(counter.agent_ids.mapped('name'))
-                         or counter.agent_id.name or '',
-                'ticket': ticket.name if busy else '',
-                'ticket_state': ticket.state if busy else '',
-                'service': ticket.service_id.name if busy else '',
+                'agent': agents or holder or '',
+                'ticket': ticket if busy else '',
+                'ticket_state': state if busy else '',
+                'service': service_names.get(service_id, '') if busy else '',
                 # Nombre en attente sur les files desservies par CE guichet :
                 # pilote le bouton « Appeler le suivant » du tableau de bord.
-                'waiting': counter.waiting_count,
+                'waiting': waiting,
             })
+        return rows
+
+    @api.model
+    def get_dashboard_data(self, location_id=None):
+        """Photographie « maintenant » d'un site, pour le tableau de bord.
+
+        Appelée SANS sudo : les record rules multi-société s'appliquent, un
+        responsable ne peut superviser que ses établissements. Chargée à
+        l'ouverture, à la reconnexion du bus et à chaque signal publié par
+        ``_publish_site_changes`` pour le site affiché.
+        """
+        locations = self.search([])
+        location = (locations.filtered(lambda l: l.id == location_id)
+                    or locations[:1])
+        result = {
+            'locations': [{'id': l.id, 'name': l.display_name} for l in locations],
+            'location_id': location.id if location else False,
+            'now': fields.Datetime.to_string(fields.Datetime.now()),
+        }
+        if not location:
+            return result
 
         result.update({
-            'kpis': {
-                'waiting': sum(s['waiting'] for s in services),
-                'done_today': len(done),
-                'avg_wait_today': round(sum(waits) / len(waits), 1) if waits else 0.0,
-                'no_show_rate': round(100.0 * len(no_show) / closed_for_rate, 1)
-                if closed_for_rate else 0.0,
-            },
-            'services': services,
-            'counters': counters,
+            'kpis': location._dashboard_kpis(),
+            'services': location._dashboard_service_rows(
+                location.service_ids.filtered('active')),
+            'counters': location._dashboard_counter_rows(
+                location.counter_ids.filtered('active')),
         })
         return result
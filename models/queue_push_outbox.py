@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""File sortante des notifications push (FCM).
+
+Les transitions de ticket (appel, « bientôt votre tour », absence…) ne parlent
+plus au réseau : elles écrivent une ligne ``queue.push.outbox`` dans leur
+transaction, et le cron ``cron_push_outbox`` — déclenché au commit — draine la
+file. Aucun verrou de ligne n'est donc tenu pendant un appel FCM, et un push
+n'existe que si la transaction qui l'a décidé a été validée.
+
+Le drain prend un lot de lignes dues (``FOR UPDATE SKIP LOCKED`` : deux
+workers cron ne se disputent jamais une ligne), l'envoie en un seul appel
+``messaging.send_each`` (jusqu'à 500 messages) puis :
+
+- succès → ``sent`` (la latence « décidé → remis à FCM » se lit sur
+  ``sent_at - create_date``) ;
+- jeton refusé par FCM (appareil désinstallé, autre projet) → ``failed`` et
+  le jeton est retiré du client ;
+- erreur transitoire → nouvel essai avec attente exponentielle, ``failed``
+  après ``MAX_ATTEMPTS``.
+
+Un expéditeur local (``queue_management.push_sender = stub``) remplace FCM
+pour les tests et le développement : rien ne sort, les messages sont
+retenus dans ``STUB_SENDER.sent``.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Erreurs FCM qui condamnent le jeton (inutile de réessayer).
+_INVALID_TOKEN_ERRORS = frozenset({
+    'UnregisteredError', 'SenderIdMismatchError', 'InvalidArgumentError',
+})
+
+
+class _FcmSender:
+    """Envoi réel via ``firebase_admin.messaging`` (initialisé par le hub)."""
+
+    BATCH = 500  # plafond FCM d'un ``send_each``
+
+    def __init__(self, messaging):
+        self.messaging = messaging
+
+    def send(self, messages):
+        """``[(statut, erreur)]`` aligné sur ``messages`` ; statut parmi
+        ``sent``, ``invalid`` (jeton à retirer) et ``retry``."""
+        messaging = self.messaging
+        results = []
+        for start in range(0, len(messages), self.BATCH):
+            chunk = messages[start:start + self.BATCH]
+            fcm_messages = [messaging.Message(
+                token=message['token'],
+                notification=messaging.Notification(
+                    title=message['title'], body=message['body']),
+                data=message['data'],
+            ) for message in chunk]
+            try:
+                response = messaging.send_each(fcm_messages)
+            except Exception as exc:  # noqa: BLE001 — panne réseau : tout le lot réessaie
+                results.extend([('retry', str(exc))] * len(chunk))
+                continue
+            for item in response.responses:
+                if item.success:
+                    results.append(('sent', False))
+                elif type(item.exception).__name__ in _INVALID_TOKEN_ERRORS:
+                    results.append(('invalid', str(item.exception)))
+                else:
+                    results.append(('retry', str(item.exception)))
+        return results
+
+
+class _StubSender:
+    """Expéditeur local : retient les messages au lieu de les envoyer.
+
+    ``invalid_tokens`` simule des appareils désinstallés, ``failing_tokens``
+    des erreurs transitoires.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sent = []
+        self.calls = 0
+        self.invalid_tokens = set()
+        self.failing_tokens = set()
+
+    def send(self, messages):
+        self.calls += 1
+        results = []
+        for message in messages:
+            if message['token'] in self.invalid_tokens:
+                results.append(('invalid', "UnregisteredError (stub)"))
+            elif message['token'] in self.failing_tokens:
+                results.append(('retry', "unavailable (stub)"))
+            else:
+                self.sent.append(message)
+                results.append(('sent', False))
+        return results
+
+
+STUB_SENDER = _StubSender()
+
+
+class QueuePushOutbox(models.Model):
+    _name = 'queue.push.outbox'
+    _description = "Notification push en attente d'envoi"
+    _order = 'id desc'
+
+    # Messages par tour de cron (un seul appel FCM).
+    BATCH_SIZE = 500
+    MAX_ATTEMPTS = 5
+    # Attente avant le n-ième nouvel essai : RETRY_BASE × 2^(n-1), plafonnée.
+    RETRY_BASE_SECONDS = 30
+    RETRY_MAX_SECONDS = 3600
+    # Lignes terminées (envoyées / abandonnées) conservées pour les métriques.
+    KEEP_DAYS = 7
+
+    customer_id = fields.Many2one(
+        'queue.customer', "Client", required=True, ondelete='cascade', index=True)
+    title = fields.Char("Titre", required=True)
+    body = fields.Text("Message")
+    payload_json = fields.Text("Données (JSON)")
+    state = fields.Selection([
+        ('pending', "À envoyer"),
+        ('sent', "Envoyé"),
+        ('failed', "Abandonné"),
+    ], string="État", default='pending', required=True)
+    attempts = fields.Integer("Essais", default=0)
+    next_attempt_at = fields.Datetime(
+        "Prochain essai", default=fields.Datetime.now, required=True)
+    sent_at = fields.Datetime("Remis à FCM le")
+    last_error = fields.Char("Dernière erreur")
+
+    def init(self):
+        # Le drain ne lit que les lignes dues, dans l'ordre d'échéance ; la
+        # purge, que les lignes terminées les plus anciennes.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS queue_push_outbox_due_idx
+                ON queue_push_outbox (next_attempt_at, id)
+                WHERE state = 'pending'
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS queue_push_outbox_done_idx
+                ON queue_push_outbox (write_date)
+                WHERE state IN ('sent', 'failed')
+        """)
+
+    # --- Écriture (dans la transaction métier) -------------------------------
+
+    _TRIGGER_KEY = 'queue_management.push_outbox_trigger'
+
+    @api.model
+    def _enqueue(self, customer, title, body, data=None):
+        """Met un push en file ; il partira après le commit de la transaction."""
+        return self._enqueue_many([(customer, title, body, data)])
+
+    @api.model
+    def _enqueue_many(self, messages):
+        """Met en file ``[(client, titre, corps, données)]`` en une création."""
+        records = self.sudo().create([{
+            'customer_id': customer.id,
+            'title': title,
+            'body': body,
+            'payload_json': json.dumps(
+                {str(k): str(v) for k, v in (data or {}).items() if v is not None}),
+        } for customer, title, body, data in messages])
+        # Un seul réveil du cron par transaction, quel que soit le nombre de
+        # messages ; le déclencheur n'est visible qu'au commit.
+        data = self.env.cr.precommit.data
+        if not data.get(self._TRIGGER_KEY):
+            data[self._TRIGGER_KEY] = True
+            self.env.cr.precommit.add(self._trigger_drain)
+        return records
+
+    def _trigger_drain(self):
+        self.env.cr.precommit.data.pop(self._TRIGGER_KEY, None)
+        cron = self.env.ref('queue_management.cron_push_outbox',
+                            raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    # --- Drain (cron) ----------------------------------------------------------
+
+    @api.model
+    def _sender(self):
+        """Expéditeur à utiliser, ou ``None`` si FCM n'est pas disponible."""
+        param = self.env['ir.config_parameter'].sudo().get_param(
+            'queue_management.push_sender')
+        if param == 'stub':
+            return STUB_SENDER
+        if 'push.notification' not in self.env:
+            return None
+        messaging = self.env['push.notification'].sudo()._get_fcm_messaging()
+        return _FcmSender(messaging) if messaging is not None else None
+
+    @api.model
+    def _cron_drain(self, limit=None):
+        """Envoie un lot de pushs dus ; se relance si la file n'est pas vide."""
+        limit = limit or self.BATCH_SIZE
+        self.flush_model(['state', 'next_attempt_at'])
+        self.env.cr.execute("""
+            SELECT id FROM queue_push_outbox
+             WHERE state = 'pending' AND next_attempt_at <= %s
+          ORDER BY next_attempt_at, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (fields.Datetime.now(), limit + 1))
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        batch = self.sudo().browse(ids[:limit])
+        if batch:
+            batch._deliver()
+        if len(ids) > limit:
+            self._trigger_drain()
+        return len(batch)
+
+    def _deliver(self):
+        now = fields.Datetime.now()
+        sender = self._sender()
+        if sender is None:
+            _logger.info("FCM non configuré : %d push(s) abandonné(s)", len(self))
+            self.write({'state': 'failed', 'last_error': "FCM non configuré"})
+            return
+        # Jeton lu à l'envoi : un client déconnecté entre-temps (jeton
+        # effacé) ne reçoit plus rien sur l'ancien appareil.
+        self.customer_id.fetch(['fcm_token'])
+        ready = self.filtered(lambda m: m.customer_id.fcm_token)
+        (self - ready).write({'state': 'failed', 'last_error': "Aucun appareil"})
+        if not ready:
+            return
+        messages = [{
+            'token': message.customer_id.fcm_token,
+            'title': message.title,
+            'body': message.body or '',
+            'data': json.loads(message.payload_json or '{}'),
+        } for message in ready]
+        results = sender.send(messages)
+        outcome = {'sent': [], 'invalid': [], 'retry': []}
+        for message, (status, error) in zip(ready, results):
+            outcome[status].append((message, error))
+        if outcome['sent']:
+            self.browse([m.id for m, _e in outcome['sent']]).write(
+                {'state': 'sent', 'sent_at': now, 'last_error': False})
+        for message, error in outcome['invalid']:
+            message.write({'state': 'failed', 'last_error': (error or '')[:200]})
+        dead_tokens = {message.customer_id.fcm_token
+                       for message, _e in outcome['invalid']}
+        if dead_tokens:
+            self.env['queue.customer'].sudo().search(
+                [('fcm_token', 'in', list(dead_tokens))]).write({'fcm_token': False})
+        if outcome['retry']:
+            self._schedule_retry(outcome['retry'], now)
+        _logger.info("queue_management : push %d envoyé(s), %d jeton(s) invalide(s), "
+                     "%d à réessayer", len(outcome['sent']),
+                     len(outcome['invalid']), len(outcome['retry']))
+
+    def _schedule_retry(self, failures, now):
+        """Nouvel essai différé (exponentiel) ; abandon après MAX_ATTEMPTS."""
+        self.flush_model()
+        for message, error in failures:
+            self.env.cr.execute("""
+                UPDATE queue_push_outbox
+                   SET attempts = attempts + 1,
+                       state = CASE WHEN attempts + 1 >= %s
+                                    THEN 'failed' ELSE 'pending' END,
+                       next_attempt_at = %s + make_interval(
+                           secs => LEAST(%s * power(2, attempts), %s)),
+                       last_error = %s
+                 WHERE id = %s
+            """, (self.MAX_ATTEMPTS, now, self.RETRY_BASE_SECONDS,
+                  self.RETRY_MAX_SECONDS, (error or '')[:200], message.id))
+        self.invalidate_model(['attempts', 'state', 'next_attempt_at', 'last_error'])
+
+    @api.model
+    def _cron_purge_done(self):
+        """Purge quotidienne des pushs terminés depuis ``KEEP_DAYS`` jours
+        (hors du drain, qui tourne chaque minute)."""
+        cutoff = fields.Datetime.now() - timedelta(days=self.KEEP_DAYS)
+        self.env.cr.execute("""
+            DELETE FROM queue_push_outbox
+             WHERE state IN ('sent', 'failed') AND write_date < %s
+        """, (cutoff,))
+        if self.env.cr.rowcount:
+            _logger.info("outbox push : %s ligne(s) terminée(s) purgée(s)",
+                         self.env.cr.rowcount)
+        return True
+
+    # --- Métriques -------------------------------------------------------------
+
+    @api.model
+    def _push_metrics(self, hours=1):
+        """Santé de la file sur les ``hours`` dernières heures : volume, échecs
+        et latence (secondes, de la décision à la remise à FCM)."""
+        self.flush_model()
+        since = fields.Datetime.now() - timedelta(hours=hours)
+        self.env.cr.execute("""
+            SELECT COUNT(*) FILTER (WHERE state = 'pending'),
+                   COUNT(*) FILTER (WHERE state = 'pending' AND attempts > 0),
+                   COUNT(*) FILTER (WHERE state = 'sent' AND sent_at >= %s),
+                   COUNT(*) FILTER (WHERE state = 'failed' AND write_date >= %s),
+                   percentile_cont(0.5) WITHIN GROUP (
+                       ORDER BY EXTRACT(EPOCH FROM sent_at - create_date))
+                       FILTER (WHERE state = 'sent' AND sent_at >= %s),
+                   percentile_cont(0.95) WITHIN GROUP (
+                       ORDER BY EXTRACT(EPOCH FROM sent_at - create_date))
+                       FILTER (WHERE state = 'sent' AND sent_at >= %s)
+              FROM queue_push_outbox
+        """, (since, since, since, since))
+        pending, retrying, sent, failed, p50, p95 = self.env.cr.fetchone()
+        return {
+            'pending': pending,
+            'retrying': retrying,
+            'sent': sent,
+            'failed': failed,
+            'latency_p50': round(p50, 2) if p50 is not None else None,
+            'latency_p95': round(p95, 2) if p95 is not None else None,
+        }
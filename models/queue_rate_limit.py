@@ -1,20 +1,69 @@
 # -*- coding: utf-8 -*-
 """Rate-limit PG multi-worker pour l'API mobile publique.
 
-Les compteurs vivent dans PostgreSQL avec ``SELECT FOR UPDATE`` : deux workers
-Odoo concurrents sont sérialisés sur la même ``key`` (un compteur in-memory
-serait multiplié par le nombre de workers). Le verrou se libère à la fin de la
-transaction HTTP. Pattern repris de ``association_management`` (éprouvé sur
-l'API Coconut), embarqué ici pour que le module reste autonome.
+Algorithme GCRA (*Generic Cell Rate Algorithm*) : chaque clé ne porte qu'un
+instant théorique d'arrivée (``tat``) et un éventuel blocage. Autoriser
+``max_requests`` par ``window_seconds`` revient à espacer les hits de
+``window / max`` secondes, avec une rafale tolérée de ``max`` hits d'un coup.
+Tout se décide dans UN ``INSERT … ON CONFLICT DO UPDATE … RETURNING``, sur un
+curseur dédié validé aussitôt : état de taille fixe, verrou de ligne tenu le
+temps d'une seule instruction et non jusqu'au commit de la requête appelante,
+quel que soit le trafic de la clé (l'ancienne liste JSON d'horodatages
+grossissait avec lui). Un hit reste compté même si la requête échoue ensuite.
+Les compteurs vivent dans PostgreSQL : un compteur in-memory seul serait
+multiplié par le nombre de workers. Pattern repris de
+``association_management`` (éprouvé sur l'API Coconut), embarqué ici pour que
+le module reste autonome.
+
+Devant PG, un étage local par worker (``check``) absorbe le trafic nettement
+sous la limite : chaque synchronisation PG rapporte la marge restante de la
+clé, dont le worker s'accorde sa part (marge / nombre de workers) sans écrire.
+Les hits admis localement sont reportés en lot à la synchronisation suivante
+de la clé (part épuisée), ou par le balayage que fait tout appel au plus une
+fois par ``_LOCAL_SYNC_SECONDS`` pour les clés restées silencieuses depuis ;
+une clé chassée du LRU est reportée avant d'être oubliée. Seul un worker qui
+ne reçoit plus aucun appel garde ses hits en attente. Près du seuil la part
+tombe à zéro et chaque hit repasse par PG. Une clé bloquée est refusée depuis
+la mémoire jusqu'à l'échéance du blocage.
 """
-import json
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
 
 from odoo import api, fields, models
+from odoo.tools import config
 
 _logger = logging.getLogger(__name__)
 
+# Étage local (par worker) : au plus ce délai entre deux reports en base,
+# et ce nombre de clés suivies (LRU) pour borner la mémoire sous un flood.
+_LOCAL_SYNC_SECONDS = 5
+_LOCAL_MAX_KEYS = 10000
+
+_local_buckets = OrderedDict()
+_local_lock = threading.Lock()
+_local_swept_at = 0.0
+
+
+def _worker_count():
+    """Workers HTTP concurrents (1 en mode threadé)."""
+    return max(config.get('workers') or 0, 1)
+
+
+class _LocalBucket:
+    """État d'une clé dans ce worker (jamais partagé entre workers)."""
+    __slots__ = ('share', 'pending', 'synced_at', 'blocked_until',
+                 'block_seconds')
+
+    def __init__(self, block_seconds):
+        self.share = 0          # hits admissibles sans passer par PG
+        self.pending = 0        # hits admis localement, pas encore reportés
+        self.synced_at = 0.0    # time.monotonic() du dernier report
+        self.blocked_until = None
+        self.block_seconds = block_seconds
+
 
 class QueueRateLimit(models.Model):
     _name = 'queue.rate.limit'
@@ -22,9 +71,11 @@ class QueueRateLimit(models.Model):
     _rec_name = 'key'
 
     key = fields.Char("Clé", required=True, index=True)
-    events_json = fields.Text(
-        "Événements (JSON)", default='[]',
-        help="Horodatages ISO 8601 des hits récents dans la fenêtre.",
+    tat = fields.Datetime(
+        "Arrivée théorique",
+        help="GCRA : instant à partir duquel la clé a « consommé » son "
+             "débit. Un hit est refusé s'il le pousserait au-delà de "
+             "maintenant + fenêtre.",
     )
     blocked_until = fields.Datetime(
         "Bloqué jusqu'à",
@@ -40,73 +91,163 @@ class QueueRateLimit(models.Model):
         "La clé de rate-limit doit être unique.",
     )
 
+    @api.model
+    def check(self, key, max_requests, window_seconds, block_seconds):
+        """Point d'entrée des contrôleurs : étage local puis, si besoin, PG.
+
+        Même contrat que ``check_and_record`` : ``(is_limited,
+        seconds_remaining)``. Le total admis reste borné globalement : la
+        somme des parts locales n'excède pas la marge lue en base.
+        """
+        now = fields.Datetime.now()
+        local_key = (key, max_requests, window_seconds)
+        with _local_lock:
+            flush = self._take_stale_buckets(local_key)
+            bucket = _local_buckets.get(local_key)
+            if bucket is None:
+                bucket = _local_buckets[local_key] = _LocalBucket(block_seconds)
+                if len(_local_buckets) > _LOCAL_MAX_KEYS:
+                    evicted_key, evicted = _local_buckets.popitem(last=False)
+                    if evicted.pending:
+                        flush.append((evicted_key, evicted, evicted.pending))
+                        evicted.pending = 0
+            else:
+                _local_buckets.move_to_end(local_key)
+                bucket.block_seconds = block_seconds
+            if bucket.blocked_until and bucket.blocked_until > now:
+                result = True, int((bucket.blocked_until - now).total_seconds())
+            elif (time.monotonic() - bucket.synced_at < _LOCAL_SYNC_SECONDS
+                    and bucket.pending < bucket.share):
+                bucket.pending += 1
+                result = False, 0
+            else:
+                result = None
+                hits = bucket.pending + 1
+                bucket.pending = 0
+                bucket.share = 0
+        for stale_key, stale, stale_hits in flush:
+            self._sync(stale_key, stale, stale_hits)
+        if result is None:
+            result = self._sync(local_key, bucket, hits)
+        return result
+
+    @api.model
+    def _take_stale_buckets(self, current_key):
+        """Au plus une fois par ``_LOCAL_SYNC_SECONDS`` (verrou local tenu) :
+        retire les hits en attente des clés non synchronisées depuis, pour
+        que le report ne dépende pas du prochain hit de la même clé
+        (``current_key`` se reporte déjà elle-même).
+
+        :returns: ``[(clé locale, bucket, hits)]`` à reporter hors verrou.
+        """
+        global _local_swept_at
+        current = time.monotonic()
+        if current - _local_swept_at < _LOCAL_SYNC_SECONDS:
+            return []
+        _local_swept_at = current
+        stale = []
+        for local_key, bucket in _local_buckets.items():
+            if local_key == current_key or not bucket.pending:
+                continue
+            if current - bucket.synced_at >= _LOCAL_SYNC_SECONDS:
+                stale.append((local_key, bucket, bucket.pending))
+                bucket.pending = 0
+                bucket.share = 0
+        return stale
+
+    @api.model
+    def _sync(self, local_key, bucket, hits):
+        """Reporte ``hits`` en base et recale le bucket local sur la réponse."""
+        key, max_requests, window_seconds = local_key
+        now = fields.Datetime.now()
+        limited, retry, headroom = self._record(
+            key, max_requests, window_seconds, bucket.block_seconds, hits=hits)
+        with _local_lock:
+            bucket.synced_at = time.monotonic()
+            bucket.blocked_until = (
+                now + timedelta(seconds=retry) if limited else None)
+            bucket.share = headroom // _worker_count()
+        return limited, retry
+
     @api.model
     def check_and_record(self, key, max_requests, window_seconds, block_seconds):
-        """Vérifie et enregistre un hit pour ``key``. Atomique multi-worker.
+        """Vérifie et enregistre un hit pour ``key`` en base (étage PG seul).
+        Atomique multi-worker.
 
         :returns: ``(is_limited, seconds_remaining)``
         """
-        cr = self.env.cr
-        now = fields.Datetime.now()
+        limited, retry, _headroom = self._record(
+            key, max_requests, window_seconds, block_seconds)
+        return limited, retry
+
+    @api.model
+    def _record(self, key, max_requests, window_seconds, block_seconds, hits=1):
+        """Enregistre ``hits`` hits d'un coup (report en lot de l'étage local).
 
-        # Crée la row si absente (concurrent-safe via ON CONFLICT).
-        cr.execute(
-            """
-            INSERT INTO queue_rate_limit
-                (key, events_json, last_seen, create_uid, write_uid, create_date, write_date)
-            VALUES (%s, '[]', %s, 1, 1, %s, %s)
-            ON CONFLICT (key) DO NOTHING
-            """,
-            (key, now, now, now),
-        )
-        # Verrouille la row — sérialise les workers concurrents sur cette clé.
-        cr.execute(
-            "SELECT id, events_json, blocked_until FROM queue_rate_limit"
-            " WHERE key = %s FOR UPDATE",
-            (key,),
-        )
-        bucket_id, events_json, blocked_until = cr.fetchone()
-
-        if blocked_until and blocked_until > now:
-            cr.execute(
-                "UPDATE queue_rate_limit SET last_seen=%s WHERE id=%s",
-                (now, bucket_id),
-            )
-            return True, int((blocked_until - now).total_seconds())
-
-        try:
-            events = json.loads(events_json or '[]')
-        except (ValueError, TypeError):
-            events = []
-        cutoff = now - timedelta(seconds=window_seconds)
-        events = [
-            ts for ts in events
-            if self._parse_ts(ts) and self._parse_ts(ts) > cutoff
-        ]
-
-        if len(events) >= max_requests:
-            cr.execute(
-                "UPDATE queue_rate_limit"
-                " SET events_json=%s, blocked_until=%s, last_seen=%s WHERE id=%s",
-                (json.dumps(events), now + timedelta(seconds=block_seconds),
-                 now, bucket_id),
-            )
+        :returns: ``(is_limited, seconds_remaining, marge)`` — ``marge`` est
+            le nombre de hits encore admissibles immédiatement.
+        """
+        now = fields.Datetime.now()
+        step = window_seconds / max(max_requests, 1)
+        params = {
+            'key': key,
+            'now': now,
+            'cost': step * hits,
+            'step': step,
+            'window': window_seconds,
+            'block': block_seconds,
+            'uid': self.env.uid,
+        }
+        # Un hit refusé (clé bloquée ou débit dépassé) ne fait pas avancer
+        # ``tat`` ; le dépassement pose le blocage. Curseur propre : la ligne
+        # de la clé est relâchée au commit immédiat, pas à celui de la requête
+        # (envoi SMTP d'un OTP…) pendant lequel les autres workers attendraient.
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                INSERT INTO queue_rate_limit AS rl
+                    (key, tat, last_seen, create_uid, write_uid, create_date, write_date)
+                VALUES (%(key)s, %(now)s + make_interval(secs => %(cost)s), %(now)s,
+                        %(uid)s, %(uid)s, %(now)s, %(now)s)
+                ON CONFLICT (key) DO UPDATE SET
+                    blocked_until = CASE
+                        WHEN rl.blocked_until > %(now)s THEN rl.blocked_until
+                        WHEN GREATEST(rl.tat, %(now)s) + make_interval(secs => %(cost)s)
+                             > %(now)s + make_interval(secs => %(window)s)
+                            THEN %(now)s + make_interval(secs => %(block)s)
+                    END,
+                    tat = CASE
+                        WHEN rl.blocked_until > %(now)s THEN rl.tat
+                        WHEN GREATEST(rl.tat, %(now)s) + make_interval(secs => %(cost)s)
+                             > %(now)s + make_interval(secs => %(window)s)
+                            THEN rl.tat
+                        ELSE GREATEST(rl.tat, %(now)s) + make_interval(secs => %(cost)s)
+                    END,
+                    last_seen = %(now)s
+                RETURNING blocked_until,
+                          FLOOR(EXTRACT(EPOCH FROM (%(now)s
+                                + make_interval(secs => %(window)s) - rl.tat))
+                                / %(step)s)
+            """, params)
+            blocked_until, headroom = cr.fetchone()
+        headroom = max(int(headroom or 0), 0)
+        if not blocked_until or blocked_until <= now:
+            return False, 0, headroom
+        if blocked_until == now + timedelta(seconds=block_seconds):
             _logger.info("rate-limit atteint pour %s (%s hits/%ss)",
                          key, max_requests, window_seconds)
-            return True, block_seconds
-
-        events.append(now.isoformat())
-        cr.execute(
-            "UPDATE queue_rate_limit"
-            " SET events_json=%s, blocked_until=NULL, last_seen=%s WHERE id=%s",
-            (json.dumps(events), now, bucket_id),
-        )
-        return False, 0
+        return True, int((blocked_until - now).total_seconds()), 0
 
     @api.model
     def reset_key(self, key):
-        """Réinitialise le bucket ``key`` (tests / déblocage admin)."""
+        """Réinitialise le bucket ``key`` (tests / déblocage admin).
+
+        L'étage local n'est vidé que dans CE worker : ailleurs, un blocage en
+        mémoire court jusqu'à son échéance.
+        """
         self.env.cr.execute("DELETE FROM queue_rate_limit WHERE key = %s", (key,))
+        with _local_lock:
+            for local_key in [k for k in _local_buckets if k[0] == key]:
+                del _local_buckets[local_key]
 
     @api.model
     def _cron_cleanup_stale(self, days=1):
@@ -118,12 +259,3 @@ class QueueRateLimit(models.Model):
         if n:
             _logger.info("rate-limit : %s bucket(s) obsolète(s) purgé(s)", n)
         return True
-
-    @staticmethod
-    def _parse_ts(value):
-        if not value:
-            return None
-        try:
-            return datetime.fromisoformat(value)
-        except (ValueError, TypeError):
-            return None
@@ -61,11 +61,24 @@ class QueueService(models.Model):
         string="Guichets desservant le service",
     )
     ticket_ids = fields.One2many('queue.ticket', 'service_id', string="Tickets")
-
-    # Numérotation quotidienne. ``last_number`` est remis à 0 au premier ticket
-    # d'un nouveau jour (cf. ``_next_number``).
+    # File VIVANTE uniquement : les chemins chauds passent par ici pour que
+    # l'historique (des années de tickets clos) n'entre jamais dans le cache
+    # ORM du worker. ``ticket_ids`` reste pour les usages ponctuels.
+    active_ticket_ids = fields.One2many(
+        'queue.ticket', 'service_id', string="Tickets actifs",
+        domain=[('state', 'in', ('scheduled', 'waiting', 'called', 'serving'))],
+        readonly=True)
+
+    # Numérotation quotidienne. Mode par défaut : séquence PostgreSQL propre
+    # à la file, sans verrou ; ``number_base`` est la valeur de la séquence
+    # au premier ticket du jour (n° = nextval − base). Mode « sans trou » :
+    # ``last_number`` relu sous verrou de ligne, remis à 0 chaque jour.
     last_number = fields.Integer("Dernier n°", default=0, copy=False)
     last_number_date = fields.Date("Date du dernier n°", copy=False)
+    number_base = fields.Integer(
+        "Base de numérotation du jour", default=0, copy=False, readonly=True)
+    number_base_date = fields.Date(
+        "Date de la base de numérotation", copy=False, readonly=True)
 
     # --- Rendez-vous (Phase 4b) ---
     # NB : les heures d'ouverture sont interprétées dans le fuseau du serveur
@@ -84,7 +97,16 @@ class QueueService(models.Model):
     opening_hour_ids = fields.One2many(
         'queue.opening.hour', 'service_id', string="Plages d'ouverture")
 
-    waiting_count = fields.Integer("En attente", compute='_compute_waiting_count')
+    # Compteurs temps réel, tenus par incréments atomiques dans la table
+    # ``queue.service.count`` (une ligne par file) : borne, API, écran et
+    # tableau de bord les lisent sans toucher à la table des tickets, et rien
+    # n'est écrit sur la ligne de la file quand un ticket bouge.
+    waiting_count = fields.Integer("En attente", compute='_compute_live_counts')
+    called_count = fields.Integer("Appelés", compute='_compute_live_counts')
+    serving_count = fields.Integer("En cours", compute='_compute_live_counts')
+    scheduled_today_count = fields.Integer(
+        "RDV du jour", compute='_compute_live_counts',
+        help="Rendez-vous programmés aujourd'hui, pas encore enregistrés.")
     ticket_count = fields.Integer("Nb de tickets", compute='_compute_ticket_count')
 
     _code_uniq_per_location = models.Constraint(
@@ -92,17 +114,63 @@ class QueueService(models.Model):
         "Le préfixe doit être unique par site.",
     )
 
-    @api.depends('ticket_ids.state')
-    def _compute_waiting_count(self):
+    # Colonne de ``queue.service.count`` alimentée par chaque état de ticket.
+    STATE_COUNTERS = {
+        'scheduled': 'scheduled_today_count',
+        'waiting': 'waiting_count',
+        'called': 'called_count',
+        'serving': 'serving_count',
+    }
+
+    def init(self):
+        self.env.cr.execute("SELECT id FROM queue_service")
+        self.browse([row[0] for row in self.env.cr.fetchall()]
+                    )._ensure_number_sequence()
+        self._drop_orphan_number_sequences()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        services = super().create(vals_list)
+        services._ensure_number_sequence()
+        return services
+
+    def write(self, vals):
+        displayed = {'name', 'active', 'location_id'} & set(vals)
+        if displayed:
+            self.env['queue.location']._touch_display(
+                self.location_id.ids, service_ids=self.ids)
+        res = super().write(vals)
+        if displayed:
+            self.env['queue.location']._touch_display(
+                self.location_id.ids, service_ids=self.ids)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._drop_orphan_number_sequences()
+        return res
+
+    def _compute_live_counts(self):
+        """Une lecture par clé de la table des compteurs pour tout le lot."""
+        counts = self.env['queue.service.count']._counts(self._origin.ids)
         for service in self:
-            service.waiting_count = len(
-                service.ticket_ids.filtered(lambda t: t.state == 'waiting')
-            )
+            (service.waiting_count, service.called_count, service.serving_count,
+             service.scheduled_today_count) = counts.get(
+                service._origin.id, (0, 0, 0, 0))
+
+    @api.model
+    def _invalidate_live_counts(self):
+        """Les compteurs ont bougé : valeurs des files (et des guichets qui
+        les somment) à relire. Cache seul, aucune écriture."""
+        self.invalidate_model(list(self.STATE_COUNTERS.values()))
+        self.env['queue.counter'].invalidate_model(['waiting_count'])
 
-    @api.depends('ticket_ids')
     def _compute_ticket_count(self):
+        # Comptage SQL groupé : aucun ticket chargé en mémoire.
+        counts = dict(self.env['queue.ticket']._read_group(
+            [('service_id', 'in', self.ids)], ['service_id'], ['__count']))
         for service in self:
-            service.ticket_count = len(service.ticket_ids)
+            service.ticket_count = counts.get(service, 0)
 
     def action_view_tickets(self):
         self.ensure_one()
@@ -120,25 +188,115 @@ class QueueService(models.Model):
             if service.code and not service.code.strip():
                 raise ValidationError(_("Le préfixe ne peut pas être vide."))
 
-    def _lock_row(self):
-        """Verrouille la ligne de la file (``SELECT FOR UPDATE``).
+    def _number_sequence(self):
+        """Nom de la séquence PostgreSQL de numérotation de la file."""
+        self.ensure_one()
+        return 'queue_service_number_%d' % self.id
+
+    def _ensure_number_sequence(self):
+        """Crée la séquence de chaque file si besoin (idempotent).
 
-        Sérialise les transactions concurrentes (borne + mobile en même
-        temps) sur la numérotation et la capacité des créneaux. Le verrou est
-        libéré à la fin de la transaction HTTP.
+        Une base mise à jour reprend là où ``last_number`` s'était arrêté
+        aujourd'hui : pas de doublon avec les tickets déjà émis.
         """
+        cr = self.env.cr
+        for service in self:
+            sequence = service._number_sequence()
+            cr.execute("SELECT to_regclass(%s)", (sequence,))
+            if cr.fetchone()[0]:
+                continue
+            cr.execute(f"CREATE SEQUENCE {sequence} MINVALUE 0 START 1")
+            cr.execute(
+                "SELECT last_number, last_number_date FROM queue_service"
+                " WHERE id = %s", (service.id,))
+            last_number, last_number_date = cr.fetchone()
+            if last_number and last_number_date == fields.Date.context_today(service):
+                cr.execute("SELECT setval(%s, %s)", (sequence, last_number))
+                cr.execute(
+                    "UPDATE queue_service SET number_base = 0,"
+                    " number_base_date = %s WHERE id = %s",
+                    (last_number_date, service.id))
+
+    @api.model
+    def _drop_orphan_number_sequences(self):
+        """Supprime les séquences de numérotation des files disparues,
+        y compris celles supprimées en cascade avec leur site (ou par une
+        mise à jour hors ORM) : une requête sur le catalogue."""
+        cr = self.env.cr
+        cr.execute("""
+            SELECT q.sequencename
+              FROM pg_sequences q
+             WHERE q.schemaname = current_schema()
+               AND q.sequencename LIKE 'queue\\_service\\_number\\_%'
+               AND NOT EXISTS (
+                   SELECT 1 FROM queue_service s
+                    WHERE q.sequencename = 'queue_service_number_' || s.id)
+        """)
+        for (sequence,) in cr.fetchall():
+            cr.execute(f'DROP SEQUENCE IF EXISTS "{sequence}"')
+
+    def _format_number(self, number):
         self.ensure_one()
-        self.env.cr.execute(
-            "SELECT id FROM queue_service WHERE id = %s FOR UPDATE", (self.id,))
+        return f"{(self.code or '?').strip().upper()}-{number:03d}"
 
     def _next_number(self):
         """Retourne le prochain numéro de ticket (ex. « B-042 »).
 
-        Compteur réinitialisé chaque jour. Le compteur est relu en base sous
-        verrou de ligne : deux créations simultanées (borne + mobile) ne
-        peuvent plus produire le même numéro.
+        Compteur réinitialisé chaque jour. Politique réglable (Paramètres →
+        File d'attente) :
+
+        * ``sequence`` (défaut) : séquence PostgreSQL de la file, sans aucun
+          verrou — la borne, le mobile et les transferts ne s'attendent plus.
+          Un ticket dont la transaction échoue laisse un trou dans la suite.
+        * ``gapless`` : compteur relu sous verrou de ligne, suite sans trou
+          mais créations sérialisées sur la file.
         """
         self.ensure_one()
+        policy = self.env['ir.config_parameter'].sudo().get_param(
+            'queue_management.numbering_policy') or 'sequence'
+        if policy == 'gapless':
+            return self._format_number(self._next_number_gapless())
+        return self._format_number(self._next_number_sequence())
+
+    def _next_number_sequence(self):
+        """N° du jour = ``nextval`` − base du jour, la date de la base vérifiée
+        dans la MÊME requête que ``nextval`` : un numéro ne peut pas être tiré
+        sur la base d'une autre journée que celle relue."""
+        cr = self.env.cr
+        today = fields.Date.context_today(self)
+        sequence = self._number_sequence()
+        # Cas courant : base du jour déjà posée — aucune écriture, aucun verrou.
+        cr.execute("""
+            SELECT nextval(%s) - COALESCE(number_base, 0) FROM queue_service
+             WHERE id = %s AND number_base_date = %s
+        """, (sequence, self.id, today))
+        row = cr.fetchone()
+        if row is None:
+            # Premier ticket du jour : la ligne est verrouillée, la date
+            # revérifiée sous ce verrou (un concurrent a pu poser la base
+            # entre-temps) et le numéro tiré dans la même requête, après la
+            # lecture de la valeur courante de la séquence.
+            cr.execute(f"""
+                UPDATE queue_service
+                   SET number_base = CASE
+                           WHEN number_base_date IS DISTINCT FROM %(today)s
+                           THEN (SELECT CASE WHEN is_called THEN last_value
+                                             ELSE last_value - 1 END
+                                   FROM {sequence})
+                           ELSE number_base
+                       END,
+                       number_base_date = %(today)s
+                 WHERE id = %(id)s
+             RETURNING nextval(%(sequence)s) - COALESCE(number_base, 0)
+            """, {'today': today, 'id': self.id, 'sequence': sequence})
+            row = cr.fetchone()
+            self.invalidate_recordset(['number_base', 'number_base_date'])
+        return row[0]
+
+    def _next_number_gapless(self):
+        """Compteur relu en base sous verrou de ligne : deux créations
+        simultanées (borne + mobile) ne peuvent pas produire le même numéro,
+        et une transaction annulée rend son numéro."""
         # Les écritures ORM en attente doivent être visibles de la relecture
         # SQL (plusieurs tickets créés dans la même transaction).
         self.flush_recordset(['last_number', 'last_number_date'])
@@ -152,7 +310,40 @@ class QueueService(models.Model):
         # sudo : le compteur est de la plomberie interne — un agent (lecture
         # seule sur la file) doit pouvoir créer un ticket au guichet.
         self.sudo().write({'last_number': next_number, 'last_number_date': today})
-        return f"{(self.code or '?').strip().upper()}-{next_number:03d}"
+        return next_number
+
+    def _sync_numbering(self):
+        """Aligne les deux compteurs du jour (séquence et ``last_number``) sur
+        le plus grand numéro déjà émis aujourd'hui par l'une ou l'autre
+        politique. Appelé quand la politique change : la nouvelle reprend
+        après le dernier ticket de l'ancienne, sans redonner un numéro."""
+        cr = self.env.cr
+        today = fields.Date.context_today(self)
+        self.flush_recordset(['last_number', 'last_number_date'])
+        for service in self.sorted('id'):
+            sequence = service._number_sequence()
+            cr.execute("""
+                SELECT last_number, last_number_date, number_base, number_base_date
+                  FROM queue_service WHERE id = %s FOR UPDATE
+            """, (service.id,))
+            last_number, last_number_date, base, base_date = cr.fetchone()
+            cr.execute(f"SELECT last_value, is_called FROM {sequence}")
+            last_value, is_called = cr.fetchone()
+            issued = max(
+                (last_number or 0) if last_number_date == today else 0,
+                (last_value if is_called else last_value - 1) - (base or 0)
+                if base_date == today else 0,
+            )
+            # Base remise à 0 : n° = nextval, la séquence repart de ``issued``.
+            cr.execute("SELECT setval(%s, %s)", (sequence, issued))
+            cr.execute("""
+                UPDATE queue_service
+                   SET last_number = %s, last_number_date = %s,
+                       number_base = 0, number_base_date = %s
+                 WHERE id = %s
+            """, (issued, today, today, service.id))
+        self.invalidate_recordset(['last_number', 'last_number_date',
+                                   'number_base', 'number_base_date'])
 
     def _remote_available(self):
         """Le distant est-il réellement ouvert ? Hiérarchie : l'interrupteur
@@ -160,22 +351,56 @@ class QueueService(models.Model):
         self.ensure_one()
         return self.remote_enabled and self.location_id.remote_enabled
 
-    def _get_ordered_waiting(self):
+    def _get_ordered_waiting(self, limit=None):
         """Les tickets en attente de la file, triés dans l'ordre d'appel.
 
         Tri : priorité décroissante, puis ordre d'arrivée. Un rendez-vous dont
         l'heure est passée est traité au moins en priorité haute pour ne pas
         léser le client qui a réservé. C'est l'unique source de vérité de
         l'ordonnancement (réutilisée par le calcul de position du ticket).
+
+        Une seule requête sur l'index partiel des tickets en attente (poids
+        stocké ``sched_weight``) : le coût ne dépend pas de l'historique.
         """
         self.ensure_one()
-        waiting = self.ticket_ids.filtered(lambda t: t.state == 'waiting')
-        return waiting.sorted(key=lambda t: t._scheduling_key())
+        Ticket = self.env['queue.ticket']
+        return Ticket.search(
+            [('service_id', '=', self.id), ('state', '=', 'waiting')],
+            order=Ticket.WAITING_ORDER, limit=limit)
 
     def _get_next_waiting(self):
         """Le prochain ticket à appeler pour cette file (ou recordset vide)."""
         self.ensure_one()
-        return self._get_ordered_waiting()[:1]
+        return self._get_ordered_waiting(limit=1)
+
+    def _get_waiting_heads(self, limit=1):
+        """Les ``limit`` prochains tickets, toutes files de ``self`` confondues.
+
+        Fusion k-voies pilotée par l'index partiel des tickets en attente :
+        chaque file ne fournit que ses ``limit`` premiers (``LATERAL`` +
+        ``LIMIT`` sur l'index), puis on départage ces têtes avec le même
+        ordre. Le coût dépend du nombre de files et de ``limit``, pas de la
+        longueur des files.
+        """
+        Ticket = self.env['queue.ticket']
+        services = self._origin
+        if not services:
+            return Ticket
+        Ticket.flush_model(['state', 'service_id', 'sched_weight', 'created_at'])
+        self.env.cr.execute("""
+            SELECT head.id
+              FROM unnest(%s::int[]) AS s(service_id)
+        CROSS JOIN LATERAL (
+                  SELECT t.id, t.sched_weight, t.created_at
+                    FROM queue_ticket t
+                   WHERE t.service_id = s.service_id AND t.state = 'waiting'
+                ORDER BY t.sched_weight DESC, t.created_at, t.id
+                   LIMIT %s
+              ) head
+          ORDER BY head.sched_weight DESC, head.created_at, head.id
+             LIMIT %s
+        """, (services.ids, limit, limit))
+        return Ticket.browse([row[0] for row in self.env.cr.fetchall()])
 
     # --- Rendez-vous : créneaux & réservation -------------------------------
 
@@ -194,42 +419,48 @@ class QueueService(models.Model):
         ``day`` est une ``date``. Les datetimes renvoyés sont naïfs (UTC, comme
         le stockage Odoo).
         """
+        return self._slots_for_range(day, day).get(day, [])
+
+    def _slots_for_range(self, date_from, date_to):
+        """Créneaux de ``date_from`` à ``date_to`` inclus : ``{date: [(datetime,
+        places libres)]}`` (jours fermés compris, avec une liste vide).
+
+        Les places prises de toute la période sont lues en UNE requête de
+        plage (``_booked_counts``), puis chaque jour est découpé en mémoire.
+        """
         self.ensure_one()
+        days = [date_from + timedelta(days=n)
+                for n in range((date_to - date_from).days + 1)]
         if not self.appointment_enabled or self.slot_duration <= 0:
-            return []
-        hours = self.opening_hour_ids.filtered(
-            lambda h: h.dayofweek == str(day.weekday()))
-        if not hours:
-            return []
+            return {day: [] for day in days}
+        booked = self._booked_counts(
+            datetime.combine(date_from, time.min),
+            datetime.combine(date_to, time.max))
 
-        # Réservations déjà posées ce jour-là (toutes non clôturées).
-        day_start = datetime.combine(day, time.min)
-        day_end = datetime.combine(day, time.max)
-        booked = {}
-        for ticket in self.ticket_ids:
-            if (ticket.channel == 'appointment' and ticket.scheduled_time
-                    and ticket.state in ('scheduled', 'waiting', 'called', 'serving')
-                    and day_start <= ticket.scheduled_time <= day_end):
-                booked[ticket.scheduled_time] = booked.get(ticket.scheduled_time, 0) + 1
-
-        step = timedelta(minutes=self.slot_duration)
         capacity = max(self.slot_capacity, 1)
-        slots = []
-        for window in hours.sorted(key=lambda h: h.hour_from):
-            cursor = datetime.combine(day, self._float_to_time(window.hour_from))
-            end = datetime.combine(day, self._float_to_time(window.hour_to))
-            while cursor + step <= end:
-                used = booked.get(cursor, 0)
-                slots.append((cursor, max(capacity - used, 0)))
-                cursor += step
-        return slots
+        return {
+            day: [(start, max(capacity - booked.get(start, 0), 0))
+                  for start in self._slot_starts(day)]
+            for day in days
+        }
+
+    def _booked_counts(self, dt_from, dt_to):
+        """Places prises par heure de créneau sur l'intervalle : ``{datetime:
+        nombre}``, lues sur le registre ``queue.slot.booking`` (une requête
+        de plage sur sa clé unique)."""
+        self.ensure_one()
+        return self.env['queue.slot.booking']._used_counts(self, dt_from, dt_to)
 
-    def _book_appointment(self, partner, slot_dt):
+    def _book_appointment(self, partner, slot_dt, customer=None):
         """Réserve un créneau et renvoie le ticket de rendez-vous créé.
 
-        Toute la vérification (créneau futur, quota client, capacité) se fait
-        sous verrou de ligne de la file : deux réservations simultanées du
-        dernier créneau ne peuvent plus passer toutes les deux.
+        La capacité se prend sur la seule ligne du créneau dans le registre
+        ``queue.slot.booking`` (incrément conditionnel atomique) : aucun
+        verrou sur la file, deux créneaux différents ne se bloquent jamais et
+        deux réservations simultanées de la dernière place ne passent pas
+        toutes les deux. Le quota par client se compte après avoir pris la
+        ligne du couple (file, client) dans ``queue.appointment.quota`` :
+        seules les réservations du même client se sérialisent.
         """
         self.ensure_one()
         if not self.appointment_enabled:
@@ -238,11 +469,8 @@ class QueueService(models.Model):
             # L'API ne propose que des créneaux futurs, mais rien n'empêchait
             # d'en poster un passé directement.
             raise UserError(_("Ce créneau est déjà passé."))
-        self._lock_row()
-        # Le verrou acquis, on repart d'une vision fraîche des réservations
-        # (une transaction concurrente a pu committer pendant l'attente).
-        self.invalidate_recordset(['ticket_ids'])
         if partner:
+            self.env['queue.appointment.quota']._claim(self, partner)
             Ticket = self.env['queue.ticket']
             if Ticket.search_count([
                     ('service_id', '=', self.id),
@@ -261,18 +489,40 @@ class QueueService(models.Model):
                 raise UserError(_(
                     "Vous avez déjà %d rendez-vous à venir sur ce service. "
                     "Annulez-en un avant d'en réserver un autre.", active))
-        available = dict(self._slots_for_date(slot_dt.date()))
-        if slot_dt not in available:
+        if slot_dt not in self._slot_starts(slot_dt.date()):
             raise UserError(_("Ce créneau n'existe pas."))
-        if available[slot_dt] <= 0:
+        if not self.env['queue.slot.booking']._reserve(self, slot_dt):
             raise UserError(_("Ce créneau est complet."))
-        return self.env['queue.ticket'].create({
+        vals = {
             'service_id': self.id,
             'partner_id': partner.id if partner else False,
             'channel': 'appointment',
             'scheduled_time': slot_dt,
             'state': 'scheduled',
-        })
+        }
+        if customer:
+            # Appel de l'API mobile : le compte est connu, pas de recherche.
+            vals['customer_id'] = customer.id
+        return self.env['queue.ticket'].with_context(
+            queue_slot_reserved=True).create(vals)
+
+    def _slot_starts(self, day):
+        """Débuts des créneaux d'une journée, dans l'ordre (grille seule,
+        sans comptage des réservations)."""
+        self.ensure_one()
+        if self.slot_duration <= 0:
+            return []
+        step = timedelta(minutes=self.slot_duration)
+        starts = []
+        for window in self.opening_hour_ids.filtered(
+                lambda h: h.dayofweek == str(day.weekday())
+        ).sorted(key=lambda h: h.hour_from):
+            cursor = datetime.combine(day, self._float_to_time(window.hour_from))
+            end = datetime.combine(day, self._float_to_time(window.hour_to))
+            while cursor + step <= end:
+                starts.append(cursor)
+                cursor += step
+        return starts
 
     def _avg_service_minutes(self, window=20):
         """Durée de service moyenne des ``window`` derniers tickets terminés.
@@ -296,18 +546,47 @@ class QueueService(models.Model):
         Une seule fois par ticket (flag ``soon_notified``) pour ne pas spammer.
         Appelé après chaque mouvement de file (appel, fin, absence, annulation).
         Seuil configurable (Paramètres → File d'attente), défaut 2.
+
+        Seules les ``threshold`` premières lignes de chaque file sont lues
+        (``LATERAL … LIMIT`` sur l'index partiel des tickets en attente), le
+        flag est posé en une écriture et les pushs mis en file en un lot :
+        le coût d'un mouvement dépend du seuil, pas de la longueur de la file.
         """
         from .res_config_settings import int_param
         if threshold is None:
             threshold = int_param(self.env, 'queue_management.soon_threshold', 2)
-        for service in self:
-            for idx, ticket in enumerate(service._get_ordered_waiting(), start=1):
-                if idx > threshold:
-                    break
-                if not ticket.soon_notified:
-                    ticket.soon_notified = True
-                    ticket._notify(
-                        "Bientôt votre tour",
-                        "Vous êtes en position %d — %s." % (idx, service.name),
-                        {'type': 'soon', 'position': idx, 'service': service.name},
-                    )
+        services = self._origin
+        if threshold <= 0 or not services:
+            return
+        Ticket = self.env['queue.ticket']
+        Ticket.flush_model(['state', 'service_id', 'sched_weight', 'created_at',
+                            'soon_notified'])
+        self.env.cr.execute("""
+            SELECT s.service_id, head.id, head.soon_notified
+              FROM unnest(%s::int[]) AS s(service_id)
+        CROSS JOIN LATERAL (
+                  SELECT t.id, t.soon_notified, t.sched_weight, t.created_at
+                    FROM queue_ticket t
+                   WHERE t.service_id = s.service_id AND t.state = 'waiting'
+                ORDER BY t.sched_weight DESC, t.created_at, t.id
+                   LIMIT %s
+              ) head
+          ORDER BY s.service_id, head.sched_weight DESC, head.created_at, head.id
+        """, (services.ids, threshold))
+        positions = {}
+        due = []
+        for service_id, ticket_id, notified in self.env.cr.fetchall():
+            positions[service_id] = positions.get(service_id, 0) + 1
+            if not notified:
+                due.append((ticket_id, positions[service_id]))
+        if not due:
+            return
+        tickets = Ticket.browse([ticket_id for ticket_id, _position in due])
+        tickets.write({'soon_notified': True})
+        Ticket._notify_many([
+            (ticket, "Bientôt votre tour",
+             "Vous êtes en position %d — %s." % (position, ticket.service_id.name),
+             {'type': 'soon', 'position': position,
+              'service': ticket.service_id.name})
+            for ticket, (_id, position) in zip(tickets, due)
+        ])
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Compteurs temps réel des files : une ligne par file, hors de la ligne
+``queue_service``.
+
+Chaque mouvement de ticket y reporte sa variation par un ``UPDATE … SET n =
+n + delta`` atomique (cf. ``queue.ticket._counter_buckets``) : la borne,
+l'API, l'écran et le tableau de bord lisent les compteurs sans parcourir les
+tickets, et la numérotation (qui verrouille la ligne de la file en mode sans
+trou) ne croise jamais un compteur. Un cron horaire les recompte depuis les
+tickets : rattrapage d'une écriture SQL directe et bascule quotidienne des
+RDV du jour.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from odoo import api, fields, models
+from odoo.tools import sql
+
+_logger = logging.getLogger(__name__)
+
+
+class QueueServiceCount(models.Model):
+    _name = 'queue.service.count'
+    _description = "Compteurs temps réel d'une file"
+    _rec_name = 'service_id'
+
+    service_id = fields.Many2one(
+        'queue.service', "Service", required=True, ondelete='cascade')
+    waiting_count = fields.Integer("En attente", default=0)
+    called_count = fields.Integer("Appelés", default=0)
+    serving_count = fields.Integer("En cours", default=0)
+    scheduled_today_count = fields.Integer("RDV du jour", default=0)
+
+    _service_uniq = models.Constraint(
+        'UNIQUE(service_id)',
+        "Une file n'a qu'une ligne de compteurs.",
+    )
+
+    @api.model
+    def _columns(self):
+        return list(self.env['queue.service'].STATE_COUNTERS.values())
+
+    @api.model
+    def _apply_moves(self, deltas):
+        """Applique des variations ``{(service_id, colonne): delta}``.
+
+        Un ``INSERT … ON CONFLICT DO UPDATE SET n = n + delta`` par file
+        (atomique, sans relecture), dans l'ordre des ids pour ne jamais
+        croiser deux verrous.
+        """
+        columns = self._columns()
+        per_service = {}
+        for (service_id, column), delta in deltas.items():
+            if delta and column in columns:
+                per_service.setdefault(service_id, {})[column] = delta
+        if not per_service:
+            return
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        for service_id in sorted(per_service):
+            moves = per_service[service_id]
+            assignments = ", ".join(
+                f"{column} = queue_service_count.{column} + %s" for column in moves)
+            cr.execute(f"""
+                INSERT INTO queue_service_count
+                    (service_id, {', '.join(columns)},
+                     create_uid, write_uid, create_date, write_date)
+                VALUES (%s, {', '.join(['%s'] * len(columns))}, %s, %s, %s, %s)
+                ON CONFLICT (service_id) DO UPDATE
+                   SET {assignments}, write_date = EXCLUDED.write_date
+            """, (service_id, *(max(moves.get(column, 0), 0) for column in columns),
+                  self.env.uid, self.env.uid, now, now, *moves.values()))
+        self.invalidate_model(columns)
+        self.env['queue.service']._invalidate_live_counts()
+
+    @api.model
+    def _counts(self, service_ids):
+        """``{service_id: (attente, appelés, en cours, RDV du jour)}`` : une
+        lecture par clé, aucun ticket parcouru."""
+        if not service_ids:
+            return {}
+        self.env.cr.execute(f"""
+            SELECT service_id, {', '.join(self._columns())}
+              FROM queue_service_count
+             WHERE service_id = ANY(%s)
+        """, (list(service_ids),))
+        return {row[0]: row[1:] for row in self.env.cr.fetchall()}
+
+    @api.model
+    def _cron_recount(self):
+        """Réparation : recompte tous les compteurs depuis les tickets.
+
+        Rattrape toute dérive (écriture SQL directe, transaction interrompue)
+        et fait basculer « RDV du jour » au changement de date.
+        """
+        self._recount()
+        return True
+
+    @api.model
+    def _recount(self):
+        """Un seul ``INSERT … ON CONFLICT`` groupé ; n'écrit que les files
+        fausses. Renvoie leurs ids."""
+        today = fields.Date.today()
+        self.env['queue.ticket'].flush_model(['service_id', 'state', 'scheduled_time'])
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            INSERT INTO queue_service_count AS qc
+                (service_id, waiting_count, called_count, serving_count,
+                 scheduled_today_count, create_uid, write_uid, create_date,
+                 write_date)
+            SELECT sv.id,
+                   COUNT(t.id) FILTER (WHERE t.state = 'waiting'),
+                   COUNT(t.id) FILTER (WHERE t.state = 'called'),
+                   COUNT(t.id) FILTER (WHERE t.state = 'serving'),
+                   COUNT(t.id) FILTER (WHERE t.state = 'scheduled'
+                                         AND t.scheduled_time >= %s
+                                         AND t.scheduled_time < %s),
+                   %s, %s, %s, %s
+              FROM queue_service sv
+         LEFT JOIN queue_ticket t
+                ON t.service_id = sv.id
+               AND t.state IN ('scheduled', 'waiting', 'called', 'serving')
+          GROUP BY sv.id
+            ON CONFLICT (service_id) DO UPDATE
+               SET waiting_count = EXCLUDED.waiting_count,
+                   called_count = EXCLUDED.called_count,
+                   serving_count = EXCLUDED.serving_count,
+                   scheduled_today_count = EXCLUDED.scheduled_today_count,
+                   write_date = EXCLUDED.write_date
+             WHERE (qc.waiting_count, qc.called_count, qc.serving_count,
+                    qc.scheduled_today_count)
+                   IS DISTINCT FROM (EXCLUDED.waiting_count, EXCLUDED.called_count,
+                                     EXCLUDED.serving_count,
+                                     EXCLUDED.scheduled_today_count)
+         RETURNING qc.service_id
+        """, (datetime.combine(today, time.min),
+              datetime.combine(today + timedelta(days=1), time.min),
+              self.env.uid, self.env.uid, now, now))
+        fixed = [row[0] for row in self.env.cr.fetchall()]
+        if fixed:
+            self.invalidate_model(self._columns())
+            self.env['queue.service']._invalidate_live_counts()
+            _logger.info("queue_management : compteurs recalculés pour %d file(s)",
+                         len(fixed))
+        return fixed
+
+    def init(self):
+        # Base existante : les compteurs naissent justes dès la création de
+        # la table (à l'installation, la table des tickets n'existe pas).
+        if sql.table_exists(self.env.cr, 'queue_ticket'):
+            self._recount()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Registre des créneaux de rendez-vous : une ligne par (file, créneau).
+
+La capacité se consomme par un ``UPDATE … SET used = used + 1 WHERE used <
+capacity RETURNING`` : l'accord est atomique et ne verrouille que la ligne du
+créneau visé. Deux réservations sur des créneaux différents ne se croisent
+jamais (auparavant, tout l'agenda attendait derrière le verrou de la file).
+
+Le registre suit les tickets (cf. ``queue.ticket._slot_buckets``) : création,
+annulation, report ou suppression d'un RDV y reportent leur variation. Un cron
+horaire le recale sur les tickets et purge les jours passés.
+"""
+import logging
+from datetime import datetime, time
+
+from odoo import api, fields, models
+from odoo.tools import sql
+
+_logger = logging.getLogger(__name__)
+
+
+class QueueSlotBooking(models.Model):
+    _name = 'queue.slot.booking'
+    _description = "Occupation d'un créneau de rendez-vous"
+    _rec_name = 'slot_start'
+    _order = 'slot_start'
+
+    service_id = fields.Many2one(
+        'queue.service', "Service", required=True, ondelete='cascade')
+    slot_start = fields.Datetime("Début du créneau", required=True)
+    capacity = fields.Integer("Capacité", default=1)
+    used = fields.Integer("Places prises", default=0)
+
+    _slot_uniq = models.Constraint(
+        'UNIQUE(service_id, slot_start)',
+        "Un créneau n'a qu'une ligne d'occupation par service.",
+    )
+
+    @api.model
+    def _reserve(self, service, slot_start):
+        """Prend une place sur le créneau ; ``False`` s'il est complet.
+
+        La capacité courante de la file est reportée sur la ligne au passage :
+        une capacité réduite s'applique aux réservations suivantes.
+        """
+        cr = self.env.cr
+        capacity = max(service.slot_capacity, 1)
+        now = fields.Datetime.now()
+        cr.execute("""
+            INSERT INTO queue_slot_booking
+                (service_id, slot_start, capacity, used,
+                 create_uid, write_uid, create_date, write_date)
+            VALUES (%s, %s, %s, 0, %s, %s, %s, %s)
+            ON CONFLICT (service_id, slot_start) DO NOTHING
+        """, (service.id, slot_start, capacity,
+              self.env.uid, self.env.uid, now, now))
+        cr.execute("""
+            UPDATE queue_slot_booking
+               SET used = used + 1, capacity = %s, write_date = %s
+             WHERE service_id = %s AND slot_start = %s AND used < %s
+         RETURNING id
+        """, (capacity, now, service.id, slot_start, capacity))
+        reserved = bool(cr.fetchone())
+        self.invalidate_model(['used', 'capacity'])
+        return reserved
+
+    @api.model
+    def _apply_moves(self, deltas):
+        """Applique des variations ``{(service_id, slot_start): delta}`` sans
+        contrôle de capacité (RDV saisi au back-office, annulation, report)."""
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        for (service_id, slot_start), delta in sorted(deltas.items()):
+            cr.execute("""
+                INSERT INTO queue_slot_booking
+                    (service_id, slot_start, capacity, used,
+                     create_uid, write_uid, create_date, write_date)
+                SELECT s.id, %s, GREATEST(s.slot_capacity, 1), GREATEST(%s, 0),
+                       %s, %s, %s, %s
+                  FROM queue_service s
+                 WHERE s.id = %s
+                ON CONFLICT (service_id, slot_start) DO UPDATE
+                   SET used = GREATEST(queue_slot_booking.used + %s, 0),
+                       write_date = EXCLUDED.write_date
+            """, (slot_start, delta, self.env.uid, self.env.uid, now, now,
+                  service_id, delta))
+        self.invalidate_model(['used'])
+
+    @api.model
+    def _used_counts(self, service, dt_from, dt_to):
+        """``{slot_start: places prises}`` d'une file sur l'intervalle."""
+        self.env.cr.execute("""
+            SELECT slot_start, used
+              FROM queue_slot_booking
+             WHERE service_id = %s AND slot_start BETWEEN %s AND %s
+               AND used > 0
+        """, (service.id, dt_from, dt_to))
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _resync(self):
+        """Recale le registre sur les RDV vivants à venir et purge les jours
+        passés. N'écrit que les lignes fausses ; renvoie leur nombre."""
+        cr = self.env.cr
+        today = datetime.combine(fields.Date.today(), time.min)
+        self.env['queue.ticket'].flush_model(
+            ['service_id', 'channel', 'state', 'scheduled_time'])
+        cr.execute(
+            "DELETE FROM queue_slot_booking WHERE slot_start < %s", (today,))
+        now = fields.Datetime.now()
+        cr.execute("""
+            WITH live AS (
+                SELECT t.service_id, t.scheduled_time AS slot_start,
+                       COUNT(*) AS used
+                  FROM queue_ticket t
+                 WHERE t.channel = 'appointment'
+                   AND t.state IN ('scheduled', 'waiting', 'called', 'serving')
+                   AND t.scheduled_time >= %s
+              GROUP BY t.service_id, t.scheduled_time
+            ), fixed AS (
+                UPDATE queue_slot_booking b
+                   SET used = COALESCE(live.used, 0), write_date = %s
+                  FROM queue_slot_booking b2
+             LEFT JOIN live ON live.service_id = b2.service_id
+                           AND live.slot_start = b2.slot_start
+                 WHERE b.id = b2.id
+                   AND b.used IS DISTINCT FROM COALESCE(live.used, 0)
+             RETURNING b.id
+            ), added AS (
+                INSERT INTO queue_slot_booking
+                    (service_id, slot_start, capacity, used,
+                     create_uid, write_uid, create_date, write_date)
+                SELECT live.service_id, live.slot_start,
+                       GREATEST(s.slot_capacity, 1), live.used, %s, %s, %s, %s
+                  FROM live
+                  JOIN queue_service s ON s.id = live.service_id
+                ON CONFLICT (service_id, slot_start) DO NOTHING
+             RETURNING id
+            )
+            SELECT (SELECT COUNT(*) FROM fixed) + (SELECT COUNT(*) FROM added)
+        """, (today, now, self.env.uid, self.env.uid, now, now))
+        fixed = cr.fetchone()[0]
+        if fixed:
+            _logger.warning("registre des créneaux : %s ligne(s) recalée(s)", fixed)
+        self.invalidate_model(['used', 'capacity'])
+        return fixed
+
+    def init(self):
+        # Premier chargement (ou mise à jour) : le registre part des RDV
+        # déjà posés.
+        if sql.table_exists(self.env.cr, 'queue_ticket'):
+            self._resync()
@@ -74,6 +74,12 @@ class QueueTicket(models.Model):
         'res.partner', string="Client", index=True,
         help="Vide pour un ticket pris à la borne (anonyme).",
     )
+    # Compte mobile du client, figé à la création : les notifications le
+    # lisent directement au lieu de rechercher le compte par partenaire.
+    customer_id = fields.Many2one(
+        'queue.customer', string="Compte mobile", index='btree_not_null',
+        ondelete='set null', readonly=True, copy=False,
+    )
     channel = fields.Selection(CHANNEL, string="Canal", required=True, default='mobile')
     priority = fields.Selection(PRIORITY, string="Priorité", required=True, default='0')
     state = fields.Selection(
@@ -136,6 +142,14 @@ class QueueTicket(models.Model):
         "Position", compute='_compute_position',
         help="Rang dans la file parmi les tickets en attente (1 = prochain).",
     )
+    # Poids d'ordonnancement STOCKÉ (priorité, RDV échu ≥ 2) : « qui passe
+    # ensuite ? » devient une requête indexée (cf. index partiel dans
+    # ``init``) au lieu d'un tri Python de tout l'historique de la file.
+    sched_weight = fields.Integer(
+        "Poids d'ordonnancement", compute='_compute_sched_weight', store=True,
+        readonly=True, copy=False,
+        help="Priorité effective dans la file (plus grand = appelé avant).",
+    )
     soon_notified = fields.Boolean(
         "Push « bientôt » envoyé", default=False, copy=False,
         help="Évite d'envoyer plusieurs fois la notification « bientôt votre tour ».",
@@ -153,6 +167,84 @@ class QueueTicket(models.Model):
         "Attente estimée (min)", compute='_compute_eta',
         help="Estimation basée sur la durée de service moyenne récente.")
 
+    # Ordre d'appel en SQL, sur le poids stocké : équivalent à
+    # ``_scheduling_key`` puisque chaque mouvement de file remonte d'abord
+    # les RDV échus (cf. ``_promote_due_appointments``).
+    WAITING_ORDER = 'sched_weight desc, created_at, id'
+
+    def init(self):
+        """Index partiels de la file vivante : la tête de file, la liste
+        ordonnée et l'agenda des RDV se lisent sur l'index, sans dépendre de
+        l'historique."""
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS queue_ticket_waiting_sched_idx
+                ON queue_ticket (service_id, sched_weight DESC, created_at, id)
+                WHERE state = 'waiting'
+        """)
+        # Agenda des RDV vivants : le décompte des créneaux (un jour ou un
+        # mois) est un parcours de plage sur cet index.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS queue_ticket_appointment_slot_idx
+                ON queue_ticket (service_id, scheduled_time)
+                WHERE channel = 'appointment'
+                  AND state IN ('scheduled', 'waiting', 'called', 'serving')
+        """)
+
+    @api.depends('priority', 'channel', 'scheduled_time', 'state')
+    def _compute_sched_weight(self):
+        # ``state`` en dépendance : le check-in et la re-mise en file
+        # réévaluent un rendez-vous devenu échu entre-temps.
+        now = fields.Datetime.now()
+        for ticket in self:
+            weight = int(ticket.priority or 0)
+            if (ticket.channel == 'appointment' and ticket.scheduled_time
+                    and ticket.scheduled_time <= now):
+                weight = max(weight, 2)
+            ticket.sched_weight = weight
+
+    @api.model
+    def _promote_due_appointments(self, services=None):
+        """Remonte les rendez-vous EN FILE dont l'heure vient de passer
+        (toutes les files si ``services`` n'est pas donné).
+
+        Le poids stocké est figé à l'écriture ; un RDV enregistré en avance
+        devient prioritaire plus tard, sans qu'aucun champ ne change. Appelé
+        à chaque mouvement des files touchées (création, transition, report)
+        et par le cron des rendez-vous en filet, jamais depuis une lecture :
+        toutes les lectures et la réservation au guichet trient ainsi sur le
+        seul poids stocké, par l'index. Un UPDATE borné aux RDV en attente
+        (quasi toujours vide) ; une ligne déjà verrouillée ailleurs (appel en
+        cours) est sautée plutôt qu'attendue.
+        """
+        if services is not None and not services:
+            return
+        self.flush_model(['state', 'channel', 'scheduled_time', 'sched_weight',
+                          'service_id'])
+        self.env.cr.execute("""
+            UPDATE queue_ticket t SET sched_weight = 2
+              FROM (SELECT id FROM queue_ticket
+                     WHERE state = 'waiting' AND channel = 'appointment'
+                       AND scheduled_time <= %s AND sched_weight < 2
+                       AND (%s::int[] IS NULL OR service_id = ANY(%s::int[]))
+                       FOR UPDATE SKIP LOCKED) due
+             WHERE t.id = due.id
+         RETURNING t.id, t.service_id
+        """, (fields.Datetime.now(),
+              services.ids if services is not None else None,
+              services.ids if services is not None else None))
+        rows = self.env.cr.fetchall()
+        if rows:
+            self.browse([row[0] for row in rows]).invalidate_recordset(
+                ['sched_weight'])
+            # Écriture SQL : rangs, attentes et aperçus des guichets déjà
+            # calculés sont périmés.
+            self.invalidate_model(['position', 'eta_minutes'])
+            self.env['queue.counter'].invalidate_model(
+                ['next_ticket_id', 'next_number'])
+            services = self.env['queue.service'].browse({row[1] for row in rows})
+            self.env['queue.location']._touch_display(
+                services.location_id.ids, service_ids=services.ids)
+
     @api.depends('created_at', 'called_at', 'served_at', 'closed_at')
     def _compute_durations(self):
         for ticket in self:
@@ -182,16 +274,47 @@ class QueueTicket(models.Model):
         counters = max(len(self.service_id.counter_ids), 1)
         return int(round(self.position * avg / counters))
 
-    @api.depends('state', 'priority', 'created_at', 'scheduled_time',
-                 'service_id', 'service_id.ticket_ids.state')
+    @api.depends('state', 'sched_weight', 'created_at',
+                 'service_id', 'service_id.active_ticket_ids.state')
     def _compute_position(self):
+        waiting = self.filtered(lambda t: t.state == 'waiting' and t.service_id)
+        positions = self._waiting_positions(waiting.service_id._origin)
         for ticket in self:
-            if ticket.state != 'waiting' or not ticket.service_id:
-                ticket.position = 0
-                continue
-            ordered = ticket.service_id._get_ordered_waiting()
-            ids = ordered.ids
-            ticket.position = ids.index(ticket.id) + 1 if ticket.id in ids else 0
+            ticket.position = (positions.get(ticket._origin.id, 0)
+                               if ticket in waiting else 0)
+
+    # --- Rangs dans la file ----------------------------------------------------
+
+    # Champs dont la modification déplace un ticket dans sa file.
+    _POSITION_FIELDS = frozenset({
+        'state', 'service_id', 'priority', 'channel', 'scheduled_time',
+        'created_at', 'sched_weight',
+    })
+
+    @api.model
+    def _waiting_positions(self, services):
+        """Rang de chaque ticket en attente des files ``services``.
+
+        Une seule requête ``ROW_NUMBER()`` pour toutes les files du lot (même
+        ordre que ``WAITING_ORDER``). Rien n'est gardé d'un appel à l'autre :
+        un rang ne peut pas survivre à une écriture SQL ou au rollback d'un
+        savepoint ; entre deux mouvements, c'est le cache ORM du champ
+        ``position`` qui évite de relire.
+
+        :returns: ``{ticket_id: position}`` (1 = prochain)
+        """
+        if not services:
+            return {}
+        self.flush_model(['state', 'service_id', 'sched_weight', 'created_at'])
+        self.env.cr.execute("""
+            SELECT id,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY service_id
+                       ORDER BY sched_weight DESC, created_at, id)
+              FROM queue_ticket
+             WHERE state = 'waiting' AND service_id IN %s
+        """, (tuple(services.ids),))
+        return dict(self.env.cr.fetchall())
 
     @api.model_create_multi
     def create(self, vals_list):
@@ -209,30 +332,158 @@ class QueueTicket(models.Model):
                     vals.setdefault('payment_amount', service.price)
                 else:
                     vals['payment_state'] = 'not_required'
-        return super().create(vals_list)
+        self._fill_customer(vals_list)
+        tickets = super().create(vals_list)
+        self.env['queue.location']._touch_display(
+            tickets.location_id.ids, service_ids=tickets.service_id.ids)
+        self._apply_counter_moves([], tickets._counter_buckets())
+        self._promote_due_appointments(tickets.service_id)
+        if not self.env.context.get('queue_slot_reserved'):
+            # Place déjà prise par ``_book_appointment`` sinon.
+            self._apply_slot_moves([], tickets._slot_buckets())
+        return tickets
+
+    def write(self, vals):
+        if 'partner_id' in vals and 'customer_id' not in vals:
+            vals = dict(vals)
+            self._fill_customer([vals])
+        moved = not self._POSITION_FIELDS.isdisjoint(vals)
+        counted = not self._COUNTER_FIELDS.isdisjoint(vals)
+        slotted = not self._SLOT_FIELDS.isdisjoint(vals)
+        displayed = not self._DISPLAY_FIELDS.isdisjoint(vals)
+        if displayed:
+            self._touch_site(vals)
+        before = self._counter_buckets() if counted else []
+        slots_before = self._slot_buckets() if slotted else []
+        res = super().write(vals)
+        if moved:
+            self._promote_due_appointments(self.service_id)
+            # Aperçus « prochain » des guichets (non stockés) à recalculer.
+            self.env['queue.counter'].invalidate_model(
+                ['next_ticket_id', 'next_number'])
+        if counted:
+            self._apply_counter_moves(before, self._counter_buckets())
+        if slotted:
+            self._apply_slot_moves(slots_before, self._slot_buckets())
+        if displayed:
+            self._touch_site(vals)
+        return res
+
+    def unlink(self):
+        self.env['queue.location']._touch_display(
+            self.location_id.ids, service_ids=self.service_id.ids,
+            counter_ids=self.counter_id.ids, kpis=True)
+        before = self._counter_buckets()
+        slots_before = self._slot_buckets()
+        res = super().unlink()
+        self._apply_counter_moves(before, [])
+        self._apply_slot_moves(slots_before, [])
+        return res
+
+    # Champs visibles sur l'écran du site, les consoles et le tableau de bord
+    # (appels, prochains, attente, paiement du ticket en cours).
+    _DISPLAY_FIELDS = frozenset({
+        'name', 'state', 'service_id', 'counter_id', 'called_at',
+        'priority', 'sched_weight', 'created_at', 'partner_id', 'payment_state',
+    })
+
+    def _touch_site(self, vals):
+        self.env['queue.location']._touch_display(
+            self.location_id.ids, service_ids=self.service_id.ids,
+            counter_ids=self.counter_id.ids,
+            kpis=vals.get('state') in ('done', 'no_show'))
+
+    # --- Compteurs des files (incréments) -------------------------------------
+
+    # Champs qui font passer un ticket d'un compteur de file à un autre.
+    _COUNTER_FIELDS = frozenset({'state', 'service_id', 'scheduled_time'})
+
+    def _counter_buckets(self):
+        """``[(service_id, colonne)]`` : le compteur de file où chaque ticket
+        est compté (aucun pour un ticket clos ou un RDV d'un autre jour)."""
+        columns = self.env['queue.service'].STATE_COUNTERS
+        today = fields.Date.today()
+        buckets = []
+        for ticket in self:
+            column = columns.get(ticket.state)
+            if ticket.state == 'scheduled' and not (
+                    ticket.scheduled_time and ticket.scheduled_time.date() == today):
+                column = None
+            if column and ticket.service_id:
+                buckets.append((ticket.service_id.id, column))
+        return buckets
+
+    @api.model
+    def _apply_counter_moves(self, before, after):
+        deltas = {}
+        for bucket in before:
+            deltas[bucket] = deltas.get(bucket, 0) - 1
+        for bucket in after:
+            deltas[bucket] = deltas.get(bucket, 0) + 1
+        self.env['queue.service.count']._apply_moves(deltas)
+
+    # --- Registre des créneaux de RDV ------------------------------------------
+
+    # Champs qui font entrer / sortir un ticket d'un créneau de rendez-vous.
+    _SLOT_FIELDS = frozenset({'state', 'service_id', 'scheduled_time', 'channel'})
+
+    def _slot_buckets(self):
+        """``[(service_id, scheduled_time)]`` : le créneau occupé par chaque
+        RDV non clôturé (aucun pour les autres tickets)."""
+        return [
+            (ticket.service_id.id, ticket.scheduled_time)
+            for ticket in self
+            if ticket.channel == 'appointment' and ticket.scheduled_time
+            and ticket.service_id
+            and ticket.state in ('scheduled', 'waiting', 'called', 'serving')
+        ]
+
+    @api.model
+    def _apply_slot_moves(self, before, after):
+        deltas = {}
+        for bucket in before:
+            deltas[bucket] = deltas.get(bucket, 0) - 1
+        for bucket in after:
+            deltas[bucket] = deltas.get(bucket, 0) + 1
+        self.env['queue.slot.booking']._apply_moves(deltas)
 
     def _scheduling_key(self):
         """Clé de tri d'un ticket dans la file (unique source de vérité).
 
         Priorité décroissante, puis ordre d'arrivée. Un rendez-vous dont l'heure
-        est passée est remonté au moins en priorité haute. Réutilisée par la file
-        (``_get_ordered_waiting``), le guichet et l'écran d'affichage.
+        est passée est remonté au moins en priorité haute. Miroir Python de
+        ``WAITING_ORDER`` (tri SQL de ``_get_ordered_waiting``), réutilisé par
+        le guichet et l'écran d'affichage.
         """
         self.ensure_one()
         weight = int(self.priority)
         if (self.channel == 'appointment' and self.scheduled_time
                 and self.scheduled_time <= fields.Datetime.now()):
             weight = max(weight, 2)
-        return (-weight, self.created_at or self.create_date)
+        return (-weight, self.created_at or self.create_date, self.id)
 
     # --- Notifications push --------------------------------------------------
 
+    @api.model
+    def _fill_customer(self, vals_list):
+        """Complète ``customer_id`` d'après le partenaire (saisie back-office,
+        RDV) : une seule recherche pour tout le lot. L'API mobile le fournit
+        directement."""
+        pending = [vals for vals in vals_list
+                   if 'partner_id' in vals and 'customer_id' not in vals]
+        partner_ids = {vals['partner_id'] for vals in pending if vals['partner_id']}
+        by_partner = {}
+        if partner_ids:
+            # Ordre du modèle (plus récent d'abord), comme l'ancienne recherche.
+            for customer in self.env['queue.customer'].sudo().search(
+                    [('partner_id', 'in', list(partner_ids))]):
+                by_partner.setdefault(customer.partner_id.id, customer.id)
+        for vals in pending:
+            vals['customer_id'] = by_partner.get(vals['partner_id'], False)
+
     def _customer(self):
         self.ensure_one()
-        if not self.partner_id:
-            return self.env['queue.customer']
-        return self.env['queue.customer'].sudo().search(
-            [('partner_id', '=', self.partner_id.id)], limit=1)
+        return self.sudo().customer_id
 
     def _notify(self, title, body, data=None):
         """Push best-effort au client du ticket (silencieux si pas de client)."""
@@ -242,6 +493,19 @@ class QueueTicket(models.Model):
             customer._push(title, body, dict(data or {}, ticket_id=self.id,
                                              ticket=self.name))
 
+    @api.model
+    def _notify_many(self, messages):
+        """Pushs groupés ``[(ticket, titre, corps, données)]`` : comptes lus
+        d'un seul coup (préchargement), une seule insertion dans la file."""
+        resolved = [(ticket._customer(), ticket, title, body, data)
+                    for ticket, title, body, data in messages]
+        self.env['queue.customer']._push_many([
+            (customer, title, body,
+             dict(data or {}, ticket_id=ticket.id, ticket=ticket.name))
+            for customer, ticket, title, body, data in resolved
+            if customer
+        ])
+
     # --- Transitions d'état --------------------------------------------------
 
     def _transition(self, new_state, vals=None):
@@ -315,13 +579,15 @@ class QueueTicket(models.Model):
 
     @api.model
     def _cron_expire_appointments(self):
-        """Marque « absent » les rendez-vous non enregistrés bien après l'heure.
+        """Remonte en tête les rendez-vous en file devenus échus, et marque
+        « absent » ceux non enregistrés bien après l'heure.
 
         Le client est prévenu par push (best-effort) : sans cela, son RDV
         disparaît silencieusement et il l'apprend au guichet. Délai
         configurable (Paramètres → File d'attente), défaut 60 min.
         """
         from .res_config_settings import int_param
+        self._promote_due_appointments()
         delay = int_param(self.env, 'queue_management.no_show_delay_min', 60)
         deadline = fields.Datetime.now() - timedelta(minutes=max(delay, 1))
         overdue = self.search([
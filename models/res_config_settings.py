@@ -51,6 +51,15 @@ class ResConfigSettings(models.TransientModel):
         help="Un ticket appelé resté sans réponse ce délai passe en Absent "
              "(guichet libéré, client notifié, re-mise en file possible). "
              "0 = désactivé.")
+    queue_numbering_policy = fields.Selection(
+        [('sequence', "Rapide (trous possibles)"),
+         ('gapless', "Sans trou (créations sérialisées)")],
+        string="Numérotation des tickets", default='sequence',
+        config_parameter='queue_management.numbering_policy',
+        help="Rapide : aucun verrou, les bornes et l'app ne s'attendent pas ; "
+             "un ticket abandonné en cours de création laisse un numéro "
+             "inutilisé. Sans trou : suite stricte, mais les créations "
+             "simultanées sur une même file passent l'une après l'autre.")
     # --- Paiement Wave ---
     queue_wave_payment_link = fields.Char(
         related='company_id.wave_payment_link', readonly=False,
@@ -81,3 +90,14 @@ class ResConfigSettings(models.TransientModel):
         config_parameter='queue_management.no_show_delay_min',
         help="Un rendez-vous non enregistré ce délai après son heure passe "
              "en Absent (le client est prévenu par notification).")
+
+    def set_values(self):
+        Param = self.env['ir.config_parameter'].sudo()
+        policy = Param.get_param('queue_management.numbering_policy') or 'sequence'
+        super().set_values()
+        if (Param.get_param('queue_management.numbering_policy')
+                or 'sequence') != policy:
+            # Changement en cours de journée : la nouvelle politique repart
+            # du dernier numéro émis par l'ancienne.
+            self.env['queue.service'].sudo().with_context(
+                active_test=False).search([])._sync_numbering()
@@ -2,13 +2,15 @@ import { Component, onWillDestroy, onWillStart, useState } from "@odoo/owl";
 import { registry } from "@web/core/registry";
 import { useService } from "@web/core/utils/hooks";
 
-const REFRESH_MS = 3000;
+const SITE_CHANGED = "queue_management.site_changed";
 
 /**
  * « Ma console » — le poste de travail plein écran de l'agent : il se
  * connecte à un guichet (présence partagée possible : binôme, formation),
  * voit le ticket en cours en très grand et agit en un geste.
- * Données via queue.counter.get_console_data (sans sudo : record rules).
+ * Données via queue.counter.get_console_data (sans sudo : record rules),
+ * relue quand un signal du site poussé par le bus cite notre guichet, et à
+ * la reconnexion du bus.
  */
 export class QueueConsole extends Component {
     static template = "queue_management.QueueConsole";
@@ -17,6 +19,7 @@ export class QueueConsole extends Component {
     setup() {
         this.orm = useService("orm");
         this.notification = useService("notification");
+        this.busService = useService("bus_service");
         this.state = useState({
             loading: true,
             acting: false,
@@ -24,18 +27,78 @@ export class QueueConsole extends Component {
             counters: [],
             data: {},
         });
+        this.channel = null;
+        this.countersVersion = null;
+        this.version = null;
+        this.reloading = false;
+        this.reloadPending = false;
+        this.onSiteChanged = (payload) => this.refresh(payload);
+        this.onReconnect = () => this.load();
+        this.busService.subscribe(SITE_CHANGED, this.onSiteChanged);
+        this.busService.addEventListener("reconnect", this.onReconnect);
         onWillStart(() => this.load());
-        this.timer = setInterval(() => this.load(), REFRESH_MS);
-        onWillDestroy(() => clearInterval(this.timer));
+        onWillDestroy(() => {
+            this.busService.unsubscribe(SITE_CHANGED, this.onSiteChanged);
+            this.busService.removeEventListener("reconnect", this.onReconnect);
+            this.listenSite(false);
+        });
+    }
+
+    /** Abonne la console au canal du site de son guichet (un seul à la fois). */
+    listenSite(locationId) {
+        const channel = locationId ? `queue_management.location_${locationId}` : null;
+        if (channel === this.channel) {
+            return;
+        }
+        if (this.channel) {
+            this.busService.deleteChannel(this.channel);
+        }
+        if (channel) {
+            this.busService.addChannel(channel);
+        }
+        this.channel = channel;
+    }
+
+    /** Signal du site : ne relit que si NOTRE guichet a bougé, une relecture
+     * à la fois (la partie vivante est versionnée, cf. load). */
+    async refresh(payload) {
+        if (payload.location_id !== this.state.data.location_id
+                || !payload.counters.includes(this.state.counterId)) {
+            return;
+        }
+        if (this.reloading) {
+            this.reloadPending = true;
+            return;
+        }
+        this.reloading = true;
+        try {
+            do {
+                this.reloadPending = false;
+                await this.load();
+            } while (this.reloadPending);
+        } finally {
+            this.reloading = false;
+        }
     }
 
+    /** Ne redemande que ce qui a bougé depuis les versions détenues. */
     async load() {
         try {
             const data = await this.orm.call(
-                "queue.counter", "get_console_data", [this.state.counterId]);
-            this.state.counters = data.counters;
+                "queue.counter", "get_console_data", [this.state.counterId], {
+                    counters_version: this.countersVersion,
+                    version: this.version,
+                });
+            if (data.counters) {
+                this.state.counters = data.counters;
+            }
+            this.countersVersion = data.counters_version;
+            this.version = data.version;
             this.state.counterId = data.counter_id;
-            this.state.data = data;
+            if (!data.unchanged) {
+                this.state.data = data;
+            }
+            this.listenSite(this.state.data.location_id);
         } catch {
             // transitoire : on garde l'affichage courant
         } finally {
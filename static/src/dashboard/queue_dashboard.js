@@ -2,7 +2,7 @@ import { Component, onWillDestroy, onWillStart, useState } from "@odoo/owl";
 import { registry } from "@web/core/registry";
 import { useService } from "@web/core/utils/hooks";
 
-const REFRESH_MS = 5000;
+const SITE_CHANGED = "queue_management.site_changed";
 
 // Seuils d'alerte visuels sur les files (rendus configurables en Phase I).
 const WAITING_WARN = 4;
@@ -14,7 +14,8 @@ const ETA_DANGER = 30;
  * Tableau de bord temps réel d'un site — et poste de travail : les cartes
  * guichets portent les actions (appeler / démarrer / terminer / absent).
  * Données via queue.location.get_dashboard_data (sans sudo : les record
- * rules multi-société s'appliquent), re-sondées toutes les 5 s.
+ * rules multi-société s'appliquent), relue à chaque signal du site poussé par
+ * le bus (version et ids touchés seulement) et à la reconnexion du bus.
  */
 export class QueueDashboard extends Component {
     static template = "queue_management.QueueDashboard";
@@ -33,9 +34,56 @@ export class QueueDashboard extends Component {
             services: [],
             counters: [],
         });
+        this.busService = useService("bus_service");
+        this.channel = null;
+        this.reloading = false;
+        this.reloadPending = false;
+        this.onSiteChanged = (payload) => this.refresh(payload);
+        this.onReconnect = () => this.load();
+        this.busService.subscribe(SITE_CHANGED, this.onSiteChanged);
+        this.busService.addEventListener("reconnect", this.onReconnect);
         onWillStart(() => this.load());
-        this.timer = setInterval(() => this.load(), REFRESH_MS);
-        onWillDestroy(() => clearInterval(this.timer));
+        onWillDestroy(() => {
+            this.busService.unsubscribe(SITE_CHANGED, this.onSiteChanged);
+            this.busService.removeEventListener("reconnect", this.onReconnect);
+            this.listenSite(false);
+        });
+    }
+
+    /** Abonne le tableau de bord au canal du site affiché. */
+    listenSite(locationId) {
+        const channel = locationId ? `queue_management.location_${locationId}` : null;
+        if (channel === this.channel) {
+            return;
+        }
+        if (this.channel) {
+            this.busService.deleteChannel(this.channel);
+        }
+        if (channel) {
+            this.busService.addChannel(channel);
+        }
+        this.channel = channel;
+    }
+
+    /** Signal du site affiché : une relecture à la fois, la dernière
+     * rafale de signaux se résume à une relecture de plus. */
+    async refresh(payload) {
+        if (payload.location_id !== this.state.locationId) {
+            return;
+        }
+        if (this.reloading) {
+            this.reloadPending = true;
+            return;
+        }
+        this.reloading = true;
+        try {
+            do {
+                this.reloadPending = false;
+                await this.load();
+            } while (this.reloadPending);
+        } finally {
+            this.reloading = false;
+        }
     }
 
     async load() {
@@ -51,9 +99,10 @@ export class QueueDashboard extends Component {
             this.state.services = data.services || [];
             this.state.counters = data.counters || [];
             this.state.error = false;
+            this.listenSite(data.location_id);
         } catch {
             // Erreur transitoire (réseau…) : on garde les dernières données
-            // affichées et on retentera au prochain tick.
+            // affichées ; la reconnexion du bus relancera un chargement.
             this.state.error = true;
         } finally {
             this.state.loading = false;
@@ -78,6 +78,26 @@ class TestQueueCustomerOtp(TransactionCase):
         self.assertFalse(self.customer.token_expiry)
         self.assertFalse(self.customer.sudo().fcm_token)
 
+    def test_session_cache_hits_and_invalidation(self):
+        """Le jeton est résolu via le cache ; déconnexion et désactivation
+        l'invalident aussitôt."""
+        Customer = self.env['queue.customer'].sudo()
+        self._arm_otp('123456')
+        token = self.customer.verify_otp('123456')
+        before = Customer._session_cache_stats()
+        self.assertEqual(Customer._from_token(token), self.customer)
+        self.assertEqual(Customer._from_token(token), self.customer)
+        after = Customer._session_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.customer._revoke_session()
+        self.assertFalse(Customer._from_token(token))
+        self._arm_otp('654321')
+        token = self.customer.verify_otp('654321')
+        self.assertEqual(Customer._from_token(token), self.customer)
+        self.customer.active = False
+        self.assertFalse(Customer._from_token(token))
+
     def test_register_fcm_steals_token_from_previous_account(self):
         """Un jeton FCM (= un appareil) ne doit appartenir qu'à UN client."""
         other = self.env['queue.customer'].create({'email': 'ancien@test.com'})
@@ -109,6 +129,13 @@ class TestQueueCustomerOtp(TransactionCase):
 class TestQueueRateLimit(TransactionCase):
     """Compteurs PG du rate-limit (logique pure, sans HTTP)."""
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # ``_record`` écrit sur son propre curseur : en mode test, celui-ci
+        # reste dans la transaction du test (rien n'est validé en base).
+        cls.registry_enter_test_mode_cls()
+
     def test_blocks_after_max_then_reports_retry(self):
         Bucket = self.env['queue.rate.limit']
         for _ in range(5):
@@ -121,6 +148,70 @@ class TestQueueRateLimit(TransactionCase):
         limited, _retry = Bucket.check_and_record('t:5.6.7.8', 5, 60, 300)
         self.assertFalse(limited)
 
+    def test_gcra_refills_one_hit_per_interval(self):
+        """5 hits / 60 s = un hit regagné toutes les 12 s, sans blocage tant
+        que le débit est respecté."""
+        Bucket = self.env['queue.rate.limit']
+        for _ in range(5):
+            self.assertFalse(Bucket.check_and_record('t:gcra', 5, 60, 300)[0])
+        # 12 s « passent » : une seule place se libère.
+        self.env.cr.execute(
+            "UPDATE queue_rate_limit SET tat = tat - interval '12 seconds'"
+            " WHERE key = 't:gcra'")
+        self.assertFalse(Bucket.check_and_record('t:gcra', 5, 60, 300)[0])
+        limited, retry = Bucket.check_and_record('t:gcra', 5, 60, 300)
+        self.assertTrue(limited)
+        self.assertEqual(retry, 300)
+
+    def test_local_tier_batches_pg_writes(self):
+        """L'étage local admet sous la marge sans écrire, reporte en lot,
+        puis refuse depuis la mémoire une clé bloquée."""
+        from odoo.addons.queue_management.models import queue_rate_limit
+        Bucket = self.env['queue.rate.limit']
+        Bucket.reset_key('t:local')
+        self.startPatcher(patch.object(
+            queue_rate_limit, '_worker_count', return_value=1))
+
+        def pg_steps():
+            self.env.cr.execute(
+                "SELECT EXTRACT(EPOCH FROM tat - last_seen) / 12"
+                " FROM queue_rate_limit WHERE key = 't:local'")
+            return round(self.env.cr.fetchone()[0])
+
+        self.assertFalse(Bucket.check('t:local', 5, 60, 300)[0])
+        for _ in range(4):
+            self.assertFalse(Bucket.check('t:local', 5, 60, 300)[0])
+        self.assertEqual(pg_steps(), 1)  # les 4 derniers : mémoire seule
+        limited, retry = Bucket.check('t:local', 5, 60, 300)
+        self.assertTrue(limited)
+        self.assertEqual(retry, 300)
+        self.env.cr.execute(
+            "UPDATE queue_rate_limit SET blocked_until = NULL WHERE key = 't:local'")
+        self.assertTrue(Bucket.check('t:local', 5, 60, 300)[0])
+        Bucket.reset_key('t:local')
+        self.assertFalse(Bucket.check('t:local', 5, 60, 300)[0])
+
+    def test_local_tier_flushes_quiet_keys(self):
+        """Les hits en attente d'une clé restée silencieuse partent en base
+        au balayage suivant, quelle que soit la clé qui le déclenche."""
+        from odoo.addons.queue_management.models import queue_rate_limit
+        Bucket = self.env['queue.rate.limit']
+        Bucket.reset_key('t:quiet')
+        self.startPatcher(patch.object(
+            queue_rate_limit, '_worker_count', return_value=1))
+        for _ in range(3):
+            self.assertFalse(Bucket.check('t:quiet', 5, 60, 300)[0])
+        bucket = queue_rate_limit._local_buckets[('t:quiet', 5, 60)]
+        self.assertEqual(bucket.pending, 2)  # 1 report PG, 2 en mémoire
+        bucket.synced_at -= queue_rate_limit._LOCAL_SYNC_SECONDS
+        self.startPatcher(patch.object(queue_rate_limit, '_local_swept_at', 0.0))
+        Bucket.check('t:other', 5, 60, 300)
+        self.assertEqual(bucket.pending, 0)
+        self.env.cr.execute(
+            "SELECT EXTRACT(EPOCH FROM tat - last_seen) / 12"
+            " FROM queue_rate_limit WHERE key = 't:quiet'")
+        self.assertEqual(round(self.env.cr.fetchone()[0]), 3)
+
     def test_reset_key_unblocks(self):
         Bucket = self.env['queue.rate.limit']
         for _ in range(6):
@@ -205,6 +296,141 @@ class TestQueueApi(HttpCase):
             'auth_token': self.TOKEN, 'ticket_id': ticket_id})
         self.assertEqual(res4['ticket']['state'], 'cancelled')
 
+    def test_ticket_fields_selection_and_timings(self):
+        from odoo.addons.queue_management.controllers import mobile_api
+        ticket_id = self._create_ticket(self.service)['ticket']['id']
+        before = mobile_api.ticket_field_stats()
+        res = self._call('/api/queue/ticket/status', {
+            'auth_token': self.TOKEN, 'ticket_id': ticket_id,
+            'fields': 'state, position,inconnu'})
+        # Seuls les champs demandés (et connus) reviennent, id toujours.
+        self.assertEqual(res['ticket'], {'id': ticket_id, 'state': 'waiting',
+                                         'position': 1})
+        after = mobile_api.ticket_field_stats()
+        self.assertEqual(after['state']['calls'], before['state']['calls'] + 1)
+        # L'attente estimée n'a pas été calculée pour cet appel.
+        self.assertEqual(after['eta_minutes']['calls'],
+                         before['eta_minutes']['calls'])
+        self.assertNotIn('inconnu', after)
+
+    def test_sync_returns_only_what_moved(self):
+        ticket_id = self._create_ticket(self.service)['ticket']['id']
+        first = self._call('/api/queue/sync', {'auth_token': self.TOKEN})
+        self.assertEqual([t['id'] for t in first['changed']], [ticket_id])
+        self.assertEqual(first['changed'][0]['position'], 1)
+        # Rien n'a bougé : diff vide, même version.
+        same = self._call('/api/queue/sync', {
+            'auth_token': self.TOKEN, 'version': first['version']})
+        self.assertEqual((same['changed'], same['removed']), ([], []))
+        self.assertEqual(same['version'], first['version'])
+        # Un autre client arrive derrière : le site bouge, pas notre ticket.
+        self.env['queue.ticket'].create({'service_id': self.service.id})
+        self.env.cr.flush()  # pré-commit : version du site
+        other = self._call('/api/queue/sync', {
+            'auth_token': self.TOKEN, 'version': first['version']})
+        self.assertEqual(other['changed'], [])
+        self.assertNotEqual(other['version'], first['version'])
+        # Annulé : il sort de la liste.
+        self._call('/api/queue/ticket/cancel', {
+            'auth_token': self.TOKEN, 'ticket_id': ticket_id})
+        gone = self._call('/api/queue/sync', {
+            'auth_token': self.TOKEN, 'version': other['version']})
+        self.assertEqual(gone['removed'], [ticket_id])
+
+    def test_batch_runs_several_operations_in_one_call(self):
+        Customer = type(self.env['queue.customer'])
+        with patch.object(Customer, '_from_token', autospec=True,
+                          side_effect=Customer._from_token) as lookup:
+            res = self._call('/api/queue/batch', {
+                'auth_token': self.TOKEN,
+                'ops': [
+                    {'op': 'site', 'id': 'a',
+                     'params': {'qr_token': self.location.qr_token}},
+                    {'op': 'ticket/create', 'id': 'b', 'params': {
+                        'service_id': self.service.id,
+                        'qr_token': self.location.qr_token}},
+                    {'op': 'tickets', 'id': 'c'},
+                    {'op': 'auth/request_otp', 'id': 'd'},
+                ],
+            })
+        self.assertEqual(res['status'], 'ok')
+        site, created, mine, refused = res['results']
+        self.assertEqual((site['op'], site['id'], site['status']), ('site', 'a', 'ok'))
+        self.assertEqual(created['status'], 'ok')
+        self.assertEqual([t['id'] for t in mine['tickets']],
+                         [created['ticket']['id']])
+        self.assertEqual(refused['status'], 'error')   # hors liste blanche
+        self.assertEqual(lookup.call_count, 1)          # client résolu une fois
+
+    def test_batch_failed_operation_leaves_no_pending_publication(self):
+        """Le savepoint annule les écritures d'une opération en échec ; ce
+        qu'elle avait marqué pour le pré-commit doit disparaître aussi."""
+        from odoo.addons.queue_management.controllers import mobile_api
+        from odoo.exceptions import UserError
+        other = self.env['queue.location'].create({'name': "Site en échec"})
+        channel = other._display_bus_channel()
+        Bus = self.env['bus.bus'].sudo()
+        before = Bus.search_count([('channel', 'like', '"%s"' % channel)])
+
+        def failing(controller, **kw):
+            mobile_api.request.env['queue.location']._touch_display([other.id])
+            raise UserError("échec")
+
+        with patch.object(mobile_api.QueueMobileApi, 'my_tickets', failing):
+            res = self._call('/api/queue/batch', {
+                'auth_token': self.TOKEN,
+                'ops': [{'op': 'tickets', 'id': 'a'}, {'op': 'site', 'id': 'b',
+                        'params': {'qr_token': self.location.qr_token}}],
+            })
+        failed, site = res['results']
+        self.assertEqual(failed['status'], 'error')
+        self.assertEqual(site['status'], 'ok')
+        self.assertEqual(
+            Bus.search_count([('channel', 'like', '"%s"' % channel)]), before)
+
+    def test_stats_endpoint_admin_only(self):
+        self.env['res.users'].create({
+            'name': "Agent stats", 'login': 'queue_stats', 'password': 'queue_stats',
+            'group_ids': [(6, 0, [self.env.ref('base.group_user').id])],
+        })
+        self.authenticate('admin', 'admin')
+        stats = self._call('/queue_management/stats')
+        self.assertIn('pid', stats)
+        self.assertIn('hits', stats['session_cache'])
+        self.assertIsInstance(stats['ticket_fields'], dict)
+        self.authenticate('queue_stats', 'queue_stats')
+        self.assertEqual(self._call('/queue_management/stats'), {})  # refusé
+
+    def test_batch_publishes_changes_after_a_failed_operation(self):
+        """Une opération réussie, une en échec, puis une création : le
+        dernier changement part quand même sur le bus."""
+        from odoo.addons.queue_management.controllers import mobile_api
+        from odoo.exceptions import UserError
+        channel = self.location._display_bus_channel()
+        Bus = self.env['bus.bus'].sudo()
+        before = Bus.search_count([('channel', 'like', '"%s"' % channel)])
+
+        def failing(controller, **kw):
+            mobile_api.request.env['queue.location']._touch_display(
+                [self.location.id])
+            raise UserError("échec")
+
+        create = {'service_id': self.service.id,
+                  'qr_token': self.location.qr_token}
+        with patch.object(mobile_api.QueueMobileApi, 'my_tickets', failing):
+            res = self._call('/api/queue/batch', {
+                'auth_token': self.TOKEN,
+                'ops': [{'op': 'ticket/create', 'id': 'a', 'params': create},
+                        {'op': 'tickets', 'id': 'b'},
+                        {'op': 'ticket/create', 'id': 'c', 'params': create}],
+            })
+        self.assertEqual([r['status'] for r in res['results']],
+                         ['ok', 'error', 'ok'])
+        # Première création publiée au flush du savepoint suivant, dernière
+        # au commit de la requête.
+        self.assertEqual(
+            Bus.search_count([('channel', 'like', '"%s"' % channel)]), before + 2)
+
     def test_requires_auth(self):
         res = self._call('/api/queue/ticket/create', {
             'service_id': self.service.id,
@@ -375,6 +601,30 @@ class TestQueueApi(HttpCase):
                             {'service_id': self.service.id, 'date': day})
         self.assertEqual(slots2['slots'][0]['available'], 0)
 
+    def test_slots_range_api(self):
+        from datetime import date, timedelta as td
+        self._enable_appointments()
+        start = date.today() + td(days=1)
+        self.service._book_appointment(
+            self.customer.partner_id,
+            fields.Datetime.to_datetime('%s 08:00:00' % start))
+        res = self._call('/api/queue/slots/range', {
+            'service_id': self.service.id,
+            'date_from': start.strftime('%Y-%m-%d'),
+            'date_to': (start + td(days=6)).strftime('%Y-%m-%d')})
+        self.assertEqual(res['status'], 'ok')
+        self.assertEqual(len(res['days']), 7)
+        first = res['days'][0]
+        self.assertEqual(first['date'], start.strftime('%Y-%m-%d'))
+        self.assertEqual([s['available'] for s in first['slots']], [0, 1])
+        self.assertTrue(all(len(d['slots']) == 2 for d in res['days']))
+        # Au-delà de 31 jours : refusé.
+        too_long = self._call('/api/queue/slots/range', {
+            'service_id': self.service.id,
+            'date_from': start.strftime('%Y-%m-%d'),
+            'date_to': (start + td(days=31)).strftime('%Y-%m-%d')})
+        self.assertEqual(too_long['status'], 'error')
+
     def test_appointment_checkin_api(self):
         ticket = self.env['queue.ticket'].create({
             'service_id': self.service.id,
@@ -489,6 +739,35 @@ class TestQueueKiosk(HttpCase):
         self.assertIn('services', data)
         self.assertIn('call_token', data)
 
+    def test_display_data_etag_304_until_site_changes(self):
+        url = '/queue/display/%s/data' % self.location.qr_token
+        etag = self.url_open(url).headers['ETag']
+        self.assertTrue(etag)
+        same = self.url_open(url, headers={'If-None-Match': etag})
+        self.assertEqual(same.status_code, 304)
+        # Un ticket pris sur le site → nouvelle version au pré-commit.
+        self.env['queue.ticket'].create({'service_id': self.service.id})
+        self.env.cr.flush()
+        changed = self.url_open(url, headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_display_changes_pushed_on_public_bus_channel(self):
+        """Les écrans publics s'abonnent au canal de leur site par le jeton
+        QR ; chaque changement y publie un signal de relecture."""
+        channel = self.location._display_bus_channel()
+        Websocket = self.env['ir.websocket'].with_user(self.env.ref('base.public_user'))
+        granted = Websocket._build_bus_channel_list(
+            [channel, 'queue_management.display_inconnu'])
+        self.assertIn(channel, granted)
+        self.assertNotIn('queue_management.display_inconnu', granted)
+        self.env['queue.ticket'].create({'service_id': self.service.id})
+        self.env.cr.flush()
+        message = self.env['bus.bus'].sudo().search(
+            [('channel', 'like', '"%s"' % channel)], order='id desc', limit=1)
+        self.assertEqual(json.loads(message.message)['type'],
+                         'queue_management.display_changed')
+
     def test_site_qr_report_renders(self):
         """Le rapport affiche QR se génère et contient le nom + le QR du site."""
         report = self.env.ref('queue_management.action_report_site_qr')
@@ -35,6 +35,22 @@ class TestAppRelease(HttpCase):
                          hashlib.sha256(APK_BYTES).hexdigest())
         self.assertGreater(self.release.apk_size_mb, 0)
 
+    def test_apk_meta_hashed_once_without_loading_binaries(self):
+        from unittest.mock import patch
+        new_bytes = APK_BYTES + b'-v2'
+        self.release.write({'apk_file': base64.b64encode(new_bytes)})
+        self.assertEqual(self.release.apk_sha256,
+                         hashlib.sha256(new_bytes).hexdigest())
+        # La liste des versions n'ouvre aucun fichier APK.
+        self.env.invalidate_all()
+        Attachment = type(self.env['ir.attachment'])
+        with patch.object(Attachment, '_file_read',
+                          side_effect=AssertionError("APK lu")):
+            rows = self.env['queue.app.release'].search_read(
+                [('id', '=', self.release.id)],
+                ['name', 'apk_size_mb', 'apk_sha256', 'download_count'])
+        self.assertEqual(rows[0]['apk_sha256'], hashlib.sha256(new_bytes).hexdigest())
+
     def test_publish_is_exclusive(self):
         other = self.release.copy({'version': '1.1.0',
                                    'apk_file': base64.b64encode(APK_BYTES)})
@@ -73,6 +89,29 @@ class TestAppRelease(HttpCase):
         self.assertEqual(self.release.download_count, before + 1)
         self.release.action_unpublish()
 
+    def test_download_resumes_with_range_and_etag(self):
+        self.release.action_publish()
+        before = self.release.download_count
+        etag = '"%s"' % self.release.apk_sha256
+        resp = self.url_open('/queue/app/download')
+        self.assertEqual(resp.headers.get('ETag'), etag)
+        self.assertEqual(resp.headers.get('Accept-Ranges'), 'bytes')
+        # Reprise après coupure : seule la suite est envoyée, sans recompter.
+        resp = self.url_open('/queue/app/download',
+                             headers={'Range': 'bytes=1000-'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, APK_BYTES[1000:])
+        self.assertEqual(resp.headers.get('Content-Range'),
+                         'bytes 1000-%d/%d' % (len(APK_BYTES) - 1, len(APK_BYTES)))
+        # Déjà à jour : 304 sans corps.
+        resp = self.url_open('/queue/app/download',
+                             headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(resp.content)
+        self.release.invalidate_recordset(['download_count'])
+        self.assertEqual(self.release.download_count, before + 1)
+        self.release.action_unpublish()
+
     def test_landing_redirects_to_store_when_configured(self):
         self.release.action_publish()
         self.env['ir.config_parameter'].sudo().set_param(
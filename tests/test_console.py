@@ -73,6 +73,18 @@ class TestConsole(TransactionCase):
         self.assertEqual(data['ticket'], ticket.name)
         self.assertEqual(data['ticket_state'], 'called')
 
+    def test_console_lists_upcoming(self):
+        """La console annonce le prochain ET les suivants, dans l'ordre."""
+        tickets = self.env['queue.ticket'].create(
+            [{'service_id': self.service.id} for _ in range(3)])
+        urgent = self.env['queue.ticket'].create(
+            {'service_id': self.service.id, 'priority': '2'})
+        data = self.env['queue.counter'].with_user(self.agent).get_console_data(
+            self.counter_a.id)
+        self.assertEqual(data['next_number'], urgent.name)
+        self.assertEqual(data['upcoming'], tickets.mapped('name'))
+        self.assertEqual(self.counter_a.peek_next_n(2), urgent | tickets[0])
+
     def test_console_surfaces_payments(self):
         """La console remonte le paiement du ticket en cours et la liste des
         paiements déclarés à distance, actionnables par l'agent."""
@@ -112,3 +124,28 @@ class TestConsole(TransactionCase):
         ids = [c['id'] for c in data['counters']]
         self.assertIn(self.counter_a.id, ids)
         self.assertNotIn(other_counter.id, ids)
+
+    def test_console_data_since_versions(self):
+        """Le client ne reçoit que ce qui a bougé depuis ses versions."""
+        Counter = self.env['queue.counter'].with_user(self.agent)
+        first = Counter.get_console_data(self.counter_a.id)
+        self.assertIn('counters', first)
+        again = Counter.get_console_data(
+            self.counter_a.id, counters_version=first['counters_version'],
+            version=first['version'])
+        self.assertTrue(again['unchanged'])
+        self.assertNotIn('counters', again)
+        self.assertNotIn('next_number', again)
+        # Un ticket arrive : la version du site avance au pré-commit.
+        ticket = self.env['queue.ticket'].create({'service_id': self.service.id})
+        self.env.cr.flush()
+        self.counter_a.location_id.invalidate_recordset(['display_version'])
+        fresh = Counter.get_console_data(
+            self.counter_a.id, counters_version=first['counters_version'],
+            version=first['version'])
+        self.assertNotIn('unchanged', fresh)
+        self.assertNotIn('counters', fresh)
+        self.assertEqual(fresh['next_number'], ticket.name)
+        # Tous les guichets du site en une passe : même tête de file.
+        live = (self.counter_a | self.counter_b)._console_live_batch()
+        self.assertEqual(live[self.counter_b.id]['next_number'], ticket.name)
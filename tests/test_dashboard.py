@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import json
+
 from odoo.tests import TransactionCase, tagged
 
 
@@ -100,4 +102,66 @@ class TestDashboard(TransactionCase):
         # Demander explicitement le site d'un autre tenant ne le révèle pas :
         # les record rules filtrent, on retombe sur son propre site.
         data_b = Location.get_dashboard_data(self.loc_b.id)
-        self.assertNotEqual(data_b['location_id'], self.loc_b.id)
\ No newline at end of file
+        self.assertNotEqual(data_b['location_id'], self.loc_b.id)
+
+    def test_site_change_signalled_on_bus(self):
+        version = self.loc_a.display_version
+        row_version = self._location_xmin()
+        self._ticket()
+        # Le flush déclenche les hooks precommit : version du site + signal bus.
+        self.env.cr.flush()
+        self.loc_a.invalidate_recordset(['display_version'])
+        self.assertEqual(self.loc_a.display_version, version + 1)
+        # Version tenue par la séquence du site : sa ligne n'est pas réécrite.
+        self.assertEqual(self._location_xmin(), row_version)
+        message = self.env['bus.bus'].sudo().search([
+            ('channel', 'like', '"queue_management.location_%d"' % self.loc_a.id),
+        ], order='id desc', limit=1)
+        self.assertTrue(message)
+        payload = json.loads(message.message)['payload']
+        # Ids touchés seulement : ni lignes, ni console, ni KPI dans le signal.
+        self.assertEqual(payload, {
+            'location_id': self.loc_a.id,
+            'version': version + 1,
+            'services': self.service_a.ids,
+            'counters': self.counter_a.ids,
+            'kpis': False,
+        })
+
+    def _location_xmin(self):
+        self.env.cr.execute(
+            "SELECT xmin::text FROM queue_location WHERE id = %s", (self.loc_a.id,))
+        return self.env.cr.fetchone()[0]
+
+    def _dashboard_query_count(self, location):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        before = self.env.cr.sql_log_count
+        self.env['queue.location'].get_dashboard_data(location.id)
+        return self.env.cr.sql_log_count - before
+
+    def test_dashboard_query_count_is_constant(self):
+        self._ticket()
+        self._ticket()
+        self.counter_a.action_call_next()
+        small = self._dashboard_query_count(self.loc_a)
+        # Site trois fois plus gros, avec historique du jour.
+        services = self.env['queue.service'].create([
+            {'name': 'File Q%d' % i, 'code': 'Q%d' % i, 'location_id': self.loc_a.id}
+            for i in range(3)])
+        self.env['queue.counter'].create([
+            {'name': 'Guichet Q%d' % i, 'location_id': self.loc_a.id,
+             'service_ids': [(6, 0, services.ids)]}
+            for i in range(3)])
+        for service in services:
+            for _i in range(4):
+                self.env['queue.ticket'].create({'service_id': service.id})
+        self.counter_a.action_start()
+        self.counter_a.action_done()
+        self.counter_a.action_call_next()
+        self.assertEqual(self._dashboard_query_count(self.loc_a), small)
+        data = self.env['queue.location'].get_dashboard_data(self.loc_a.id)
+        self.assertEqual(data['kpis']['done_today'], 1)
+        self.assertEqual(data['kpis']['waiting'], 12)
+        self.assertEqual(len(data['services']), 4)
+        self.assertEqual(len(data['counters']), 4)
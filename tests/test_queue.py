@@ -45,14 +45,61 @@ class TestQueue(TransactionCase):
 
     def test_numbering_batch_same_transaction(self):
         """Deux tickets créés dans le même batch ont des numéros distincts
-        (le compteur relu en SQL sous verrou doit voir l'écriture ORM en
-        attente de la même transaction)."""
+        (la base du jour posée par le premier est relue par le second)."""
         tickets = self.env['queue.ticket'].create([
             {'service_id': self.service.id},
             {'service_id': self.service.id},
         ])
         self.assertEqual(tickets.mapped('name'), ["CAR-001", "CAR-002"])
 
+    def test_numbering_daily_reset_with_sequence(self):
+        """Séquence PG : la numérotation repart à 1 au premier ticket du
+        jour, même si la séquence a continué de tourner la veille."""
+        self.assertEqual(self._new_ticket().name, "CAR-001")
+        self._new_ticket()
+        self.env.cr.execute(
+            "UPDATE queue_service SET number_base_date = %s WHERE id = %s",
+            (fields.Date.today() - timedelta(days=1), self.service.id))
+        self.assertEqual(self._new_ticket().name, "CAR-001")
+        self.assertEqual(self._new_ticket().name, "CAR-002")
+
+    def test_number_sequences_dropped_with_their_location(self):
+        """Les files supprimées en cascade avec leur site ne laissent pas
+        leur séquence de numérotation derrière elles."""
+        location = self.env['queue.location'].create({
+            'name': "Site éphémère", 'company_id': self.company.id})
+        service = self.env['queue.service'].create({
+            'name': "Éphémère", 'code': 'eph', 'location_id': location.id})
+        sequence = service._number_sequence()
+        location.unlink()
+        self.env.cr.execute("SELECT to_regclass(%s)", (sequence,))
+        self.assertIsNone(self.env.cr.fetchone()[0])
+
+    def test_numbering_gapless_policy(self):
+        """Politique « sans trou » : compteur sous verrou, même format."""
+        self.env['ir.config_parameter'].sudo().set_param(
+            'queue_management.numbering_policy', 'gapless')
+        tickets = self.env['queue.ticket'].create([
+            {'service_id': self.service.id},
+            {'service_id': self.service.id},
+        ])
+        self.assertEqual(tickets.mapped('name'), ["CAR-001", "CAR-002"])
+        self.assertEqual(self.service.last_number, 2)
+
+    def test_numbering_policy_switch_keeps_the_sequence(self):
+        """Changer de politique en cours de journée ne redonne jamais un
+        numéro déjà émis, dans un sens comme dans l'autre."""
+        def switch(policy):
+            self.env['res.config.settings'].create(
+                {'queue_numbering_policy': policy}).execute()
+
+        self._new_ticket()
+        self._new_ticket()
+        switch('gapless')
+        self.assertEqual(self._new_ticket().name, "CAR-003")
+        switch('sequence')
+        self.assertEqual(self._new_ticket().name, "CAR-004")
+
     def test_numbering_as_readonly_agent(self):
         """Un agent (lecture seule sur la file) peut créer un ticket : le
         compteur interne s'écrit en sudo."""
@@ -105,6 +152,132 @@ class TestQueue(TransactionCase):
         )
         self.assertEqual(self.service._get_next_waiting(), rdv)
 
+    def test_sched_weight_stored_and_due_promotion(self):
+        """Le poids stocké suit la priorité, et un RDV en file dont l'heure
+        passe APRÈS son enregistrement est remonté au mouvement suivant de la
+        file (une lecture n'écrit rien), ou à défaut par le cron des RDV."""
+        normal = self._new_ticket(priority='0')
+        rdv = self._new_ticket(
+            channel='appointment',
+            scheduled_time=fields.Datetime.now() + timedelta(hours=1))
+        self.assertEqual(rdv.sched_weight, 0)
+        self.assertEqual(self.service._get_next_waiting(), normal)
+        normal.priority = '1'
+        self.assertEqual(normal.sched_weight, 1)
+        # Le temps passe : l'heure du RDV est maintenant échue.
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE queue_ticket SET scheduled_time = %s WHERE id = %s",
+            (fields.Datetime.now() - timedelta(minutes=1), rdv.id))
+        self.env.invalidate_all()
+        self.assertEqual(self.service._get_next_waiting(), normal)
+        self.assertEqual(rdv.sched_weight, 0)
+        self._new_ticket()
+        self.assertEqual(rdv.sched_weight, 2)
+        self.assertEqual(self.service._get_next_waiting(), rdv)
+        self.assertEqual(rdv.position, 1)
+        # Sans mouvement, le cron fait le même travail.
+        other = self._new_ticket(
+            channel='appointment',
+            scheduled_time=fields.Datetime.now() + timedelta(hours=1))
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE queue_ticket SET scheduled_time = %s WHERE id = %s",
+            (fields.Datetime.now() - timedelta(minutes=1), other.id))
+        self.env.invalidate_all()
+        self.env['queue.ticket']._cron_expire_appointments()
+        self.assertEqual(other.sched_weight, 2)
+
+    def test_claim_takes_due_appointment_before_the_cron(self):
+        """Au guichet, un RDV échu passe devant même si le cron ne l'a pas
+        encore remonté : la réservation le remonte d'abord, puis suit le même
+        ordre que l'aperçu de la console."""
+        normal = self._new_ticket(priority='1')
+        rdv = self._new_ticket(
+            channel='appointment',
+            scheduled_time=fields.Datetime.now() + timedelta(hours=1))
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE queue_ticket SET scheduled_time = %s WHERE id = %s",
+            (fields.Datetime.now() - timedelta(minutes=1), rdv.id))
+        self.env.invalidate_all()
+        self.assertEqual(self.counter._claim_next(), rdv)
+        self.assertEqual(rdv.sched_weight, 2)
+        self.assertEqual(self.counter._peek_next(), rdv)
+        self.assertEqual(normal.state, 'waiting')
+
+    def test_ordered_waiting_ignores_history(self):
+        """La file ordonnée ne contient que les tickets en attente."""
+        closed = self._new_ticket()
+        self.counter.action_call_next()
+        closed.action_done()
+        first = self._new_ticket()
+        second = self._new_ticket()
+        self.assertEqual(self.service._get_ordered_waiting(), first | second)
+        self.assertEqual(self.service._get_ordered_waiting().ids,
+                         [first.id, second.id])
+
+    def test_positions_batch_in_one_query(self):
+        """Positions calculées pour tout un lot en une requête, sans mémo
+        qui survivrait à une écriture SQL directe."""
+        radio = self.env['queue.service'].create({
+            'name': 'Radio', 'code': 'RPO', 'location_id': self.location.id})
+        a1, a2 = self._new_ticket(), self._new_ticket(priority='2')
+        b1 = self.env['queue.ticket'].create({'service_id': radio.id})
+        tickets = a1 | a2 | b1
+        self.assertEqual(tickets.mapped('position'), [2, 1, 1])
+        Ticket = self.env['queue.ticket']
+        with self.assertQueryCount(1):
+            positions = Ticket._waiting_positions(self.service | radio)
+        self.assertEqual(positions, {a1.id: 2, a2.id: 1, b1.id: 1})
+        # Écriture hors ORM : l'appel suivant la voit.
+        self.env.cr.execute(
+            "UPDATE queue_ticket SET sched_weight = 3 WHERE id = %s", (a1.id,))
+        self.assertEqual(Ticket._waiting_positions(self.service)[a1.id], 1)
+        # Un appel déplace la file.
+        self.counter.action_call_next()
+        self.assertEqual(a1.position, 0)
+        self.assertEqual(a2.position, 1)
+
+    def test_live_counters_follow_transitions(self):
+        """Les compteurs de la file suivent chaque transition, tenus dans
+        leur propre table : la ligne de la file n'est jamais réécrite (seul
+        le premier ticket du jour y fige la base de numérotation). Le cron de
+        réparation les recale après une écriture SQL directe."""
+        first = self._new_ticket()
+        self.env.flush_all()
+        self.env.cr.execute(
+            "SELECT xmin::text FROM queue_service WHERE id = %s", (self.service.id,))
+        row_version = self.env.cr.fetchone()[0]
+        self._new_ticket()
+        self.env['queue.ticket'].create({
+            'service_id': self.service.id, 'channel': 'appointment',
+            'state': 'scheduled',
+            'scheduled_time': fields.Datetime.now() + timedelta(minutes=30)})
+        self.assertEqual(self.service.waiting_count, 2)
+        self.assertEqual(self.service.scheduled_today_count, 1)
+        self.counter.action_call_next()
+        self.assertEqual(
+            (self.service.waiting_count, self.service.called_count), (1, 1))
+        self.assertEqual(self.counter.waiting_count, 1)
+        first.action_start()
+        self.assertEqual(
+            (self.service.called_count, self.service.serving_count), (0, 1))
+        first.action_done()
+        self.assertEqual(self.service.serving_count, 0)
+        self.env.flush_all()
+        self.env.cr.execute(
+            "SELECT xmin::text FROM queue_service WHERE id = %s", (self.service.id,))
+        self.assertEqual(self.env.cr.fetchone()[0], row_version)
+        # Dérive simulée, puis réparation.
+        self.env.cr.execute(
+            "UPDATE queue_service_count SET waiting_count = 42 WHERE service_id = %s",
+            (self.service.id,))
+        self.env.invalidate_all()
+        self.assertEqual(self.service.waiting_count, 42)
+        self.env['queue.service.count']._cron_recount()
+        self.assertEqual(self.service.waiting_count, 1)
+
     def test_no_show(self):
         ticket = self._new_ticket()
         self.counter.action_call_next()
@@ -306,6 +479,20 @@ class TestQueue(TransactionCase):
         self.assertEqual(self.counter.next_ticket_id, urgent2)
         self.assertEqual(self.counter.waiting_count, 2)
 
+    def test_claim_next_follows_scheduling_order(self):
+        """La réservation SKIP LOCKED suit le même ordre que l'aperçu, toutes
+        files du guichet confondues."""
+        service2 = self.env['queue.service'].create({
+            'name': 'Radio', 'code': 'RCL', 'location_id': self.location.id})
+        self.counter.write({'service_ids': [(4, service2.id)]})
+        self._new_ticket()
+        urgent2 = self.env['queue.ticket'].create({
+            'service_id': service2.id, 'priority': '2'})
+        self.assertEqual(self.counter._claim_next(), urgent2)
+        self.assertEqual(self.counter._claim_next(), self.counter._peek_next())
+        self.counter.action_call_next()
+        self.assertEqual(urgent2.state, 'called')
+
     def test_counter_next_preview(self):
         """L'aperçu du guichet annonce le bon prochain numéro et le compte."""
         self._new_ticket(priority='0')
@@ -314,6 +501,18 @@ class TestQueue(TransactionCase):
         self.assertEqual(self.counter.next_number, urgent.name)
         self.assertEqual(self.counter.waiting_count, 2)
 
+    def test_active_tickets_exclude_history(self):
+        """La relation « tickets actifs » ignore les tickets clos ; le total
+        (historique compris) reste juste via un comptage groupé."""
+        done = self._new_ticket()
+        done.write({'state': 'done'})
+        cancelled = self._new_ticket()
+        cancelled.action_cancel()
+        live = self._new_ticket()
+        self.service.invalidate_recordset(['active_ticket_ids', 'ticket_count'])
+        self.assertEqual(self.service.active_ticket_ids, live)
+        self.assertEqual(self.service.ticket_count, 3)
+
     def test_notify_upcoming_marks_flag(self):
         """Après un appel, les têtes de file restantes sont notifiées une fois."""
         self._new_ticket()
@@ -323,12 +522,135 @@ class TestQueue(TransactionCase):
         remaining = self.service._get_ordered_waiting()
         self.assertTrue(all(t.soon_notified for t in remaining[:2]))
 
+    def test_notify_upcoming_reads_only_the_head(self):
+        """Seuil atteint : flags posés d'un coup, pushs mis en file en un lot,
+        et le coût ne dépend pas de la longueur de la file."""
+        def notify_queries():
+            self.env.flush_all()
+            before = self.env.cr.sql_log_count
+            self.service._notify_upcoming(threshold=2)
+            self.env.flush_all()
+            return self.env.cr.sql_log_count - before
+
+        customers = self.env['queue.customer'].create([
+            {'email': 'tete%d@test.com' % i, 'fcm_token': 'tok-tete-%d' % i}
+            for i in range(2)])
+        customers._ensure_partner()
+        head = self.env['queue.ticket'].create([
+            {'service_id': self.service.id, 'partner_id': c.partner_id.id}
+            for c in customers])
+        short = notify_queries()
+        self.assertTrue(all(head.mapped('soon_notified')))
+        pushes = self.env['queue.push.outbox'].search(
+            [('customer_id', 'in', customers.ids)])
+        self.assertEqual(len(pushes), 2)
+        self.assertIn('"position": "1"', pushes.filtered(
+            lambda p: p.customer_id == customers[0]).payload_json)
+        # Déjà prévenus : rien à refaire, et une longue file n'y change rien.
+        self.assertEqual(notify_queries(), notify_queries())
+        quiet = notify_queries()
+        for _i in range(30):
+            self._new_ticket()
+        self.assertEqual(notify_queries(), quiet)
+        self.assertLess(quiet, short)
+
+    def test_ticket_keeps_customer_for_notifications(self):
+        """Le compte mobile est figé sur le ticket (repris par partenaire pour
+        l'existant) : la notification ne recherche plus le client."""
+        from unittest.mock import patch
+        customer = self.env['queue.customer'].create({'email': 'lien@test.com'})
+        customer._ensure_partner()
+        first, second = self.env['queue.ticket'].create([
+            {'service_id': self.service.id, 'partner_id': customer.partner_id.id}
+            for _i in range(2)])
+        self.assertEqual(first.customer_id, customer)
+        # Reprise : une base antérieure n'a pas la colonne renseignée.
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE queue_ticket SET customer_id = NULL WHERE id = %s", (second.id,))
+        second.invalidate_recordset(['customer_id'])
+        from odoo.modules.migration import load_script
+        load_script('queue_management/migrations/19.0.2.10.0/post-migrate.py',
+                    'queue_management_post_migrate').migrate(self.env.cr, '19.0.2.9.0')
+        second.invalidate_recordset(['customer_id'])
+        self.assertEqual(second.customer_id, customer)
+        # Le dictionnaire de l'appelant n'est pas modifié.
+        vals = {'partner_id': customer.partner_id.id}
+        second.write(vals)
+        self.assertEqual(vals, {'partner_id': customer.partner_id.id})
+        Customer = type(self.env['queue.customer'])
+        with patch.object(Customer, 'search', side_effect=AssertionError("recherche")), \
+                patch.object(Customer, '_push_many', autospec=True,
+                             return_value=2) as push:
+            self.service._notify_upcoming(threshold=2)
+        messages = push.call_args.args[1]
+        self.assertEqual([m[0] for m in messages], [customer, customer])
+
     def test_push_graceful_without_fcm(self):
-        """Sans credentials FCM, _push ne lève pas et renvoie False."""
+        """Sans credentials FCM, le push ne lève pas : il est abandonné au drain."""
         c = self.env['queue.customer'].create({'email': 'push@test.com'})
         self.assertFalse(c._push("Titre", "Corps"))  # pas de fcm_token
         c.fcm_token = 'device-token'
-        self.assertFalse(c._push("Titre", "Corps"))  # FCM non configuré → no-op
+        self.assertTrue(c._push("Titre", "Corps"))   # mis en file
+        from unittest.mock import patch
+        Outbox = self.env['queue.push.outbox']
+        message = Outbox.search([('customer_id', '=', c.id)])
+        self.assertEqual(message.state, 'pending')
+        with patch.object(type(Outbox), '_sender', return_value=None):
+            Outbox._cron_drain()
+        self.assertEqual(message.state, 'failed')   # FCM non configuré → abandon
+
+    def test_push_outbox_batches_retries_and_drops_dead_tokens(self):
+        """Le drain envoie en un lot, réessaie plus tard et retire les jetons morts."""
+        from odoo.addons.queue_management.models.queue_push_outbox import STUB_SENDER
+        self.env['ir.config_parameter'].sudo().set_param(
+            'queue_management.push_sender', 'stub')
+        STUB_SENDER.reset()
+        self.addCleanup(STUB_SENDER.reset)
+        ok, dead, flaky = self.env['queue.customer'].create([
+            {'email': 'ok@push.test', 'fcm_token': 'tok-ok'},
+            {'email': 'dead@push.test', 'fcm_token': 'tok-dead'},
+            {'email': 'flaky@push.test', 'fcm_token': 'tok-flaky'},
+        ])
+        STUB_SENDER.invalid_tokens.add('tok-dead')
+        STUB_SENDER.failing_tokens.add('tok-flaky')
+        for customer in (ok, dead, flaky):
+            customer._push("C'est bientôt", "Présentez-vous", {'ticket': 'A-001'})
+        Outbox = self.env['queue.push.outbox']
+        self.assertEqual(Outbox._cron_drain(), 3)
+        self.assertEqual(STUB_SENDER.calls, 1)            # un seul appel pour le lot
+        self.assertEqual([m['token'] for m in STUB_SENDER.sent], ['tok-ok'])
+        self.assertEqual(STUB_SENDER.sent[0]['data'], {'ticket': 'A-001'})
+        self.assertFalse(dead.sudo().fcm_token)            # jeton mort retiré
+        retry = Outbox.search([('customer_id', '=', flaky.id)])
+        self.assertEqual((retry.state, retry.attempts), ('pending', 1))
+        self.assertGreater(retry.next_attempt_at, fields.Datetime.now())
+        self.assertEqual(Outbox._cron_drain(), 0)          # pas encore dû
+        metrics = Outbox._push_metrics()
+        self.assertEqual((metrics['sent'], metrics['failed'], metrics['retrying']),
+                         (1, 1, 1))
+
+    def test_push_outbox_purge_is_a_separate_cron(self):
+        """Le drain ne purge plus ; le cron quotidien retire les lignes
+        terminées depuis ``KEEP_DAYS`` jours, pas les récentes."""
+        c = self.env['queue.customer'].create(
+            {'email': 'purge@push.test', 'fcm_token': 'tok-purge'})
+        Outbox = self.env['queue.push.outbox']
+        old, pending = Outbox._enqueue_many([
+            (c, "Ancien", "Corps", None), (c, "En file", "Corps", None)])
+        old.state = 'sent'
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE queue_push_outbox SET write_date = now() - interval '30 days'"
+            " WHERE id IN %s", (tuple((old | pending).ids),))
+        Outbox.invalidate_model()
+        from unittest.mock import patch
+        with patch.object(type(Outbox), '_sender', return_value=None):
+            Outbox._cron_drain()
+        self.assertTrue(old.exists())
+        Outbox._cron_purge_done()
+        self.assertFalse(old.exists())
+        self.assertTrue(pending.exists())   # abandonné à l'instant : conservé
 
     # --- Rendez-vous (Phase 4b) ----------------------------------------------
 
@@ -367,6 +689,25 @@ class TestQueue(TransactionCase):
             self.service._book_appointment(partners[2], slot)
         self.assertEqual(dict(self.service._slots_for_date(day))[slot], 0)
 
+    def test_slot_ledger_follows_tickets(self):
+        """Le registre des créneaux suit annulation, report et saisie
+        back-office ; le recalage ne trouve rien à corriger."""
+        self._enable_appointments()
+        day = date.today() + timedelta(days=1)
+        slot, later = (datetime.combine(day, time(8, 0)),
+                       datetime.combine(day, time(8, 30)))
+        Booking = self.env['queue.slot.booking']
+        partner = self.env['res.partner'].create({'name': 'Registre'})
+        booked = self.service._book_appointment(partner, slot)
+        manual = self._new_ticket(channel='appointment', scheduled_time=slot)
+        manual.state = 'scheduled'
+        self.assertEqual(Booking._used_counts(self.service, slot, later), {slot: 2})
+        self.assertFalse(Booking._reserve(self.service, slot))
+        booked.action_cancel()
+        manual.scheduled_time = later
+        self.assertEqual(Booking._used_counts(self.service, slot, later), {later: 1})
+        self.assertEqual(Booking._resync(), 0)
+
     def test_booking_rejects_past_slot(self):
         """L'API n'affiche que des créneaux futurs, mais le modèle doit aussi
         refuser un créneau passé posté directement."""
@@ -405,6 +746,10 @@ class TestQueue(TransactionCase):
         booked = self.service._book_appointment(
             partner, datetime.combine(day, time(9, 0)))
         self.assertEqual(booked.state, 'scheduled')
+        # Chaque réservation du client a repris la même ligne de garde.
+        self.assertEqual(self.env['queue.appointment.quota'].search_count([
+            ('service_id', '=', self.service.id),
+            ('partner_id', '=', partner.id)]), 1)
 
     def test_checkin_assigns_number(self):
         ticket = self.env['queue.ticket'].create({